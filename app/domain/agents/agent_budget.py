@@ -0,0 +1,113 @@
+"""
+Per-question budget for a ReAct run: a deadline, a step cap and a Tavily call cap.
+
+  with agent_budget.run(deadline_seconds=20, max_web_searches=2) as budget:
+      for state in agent_executor.stream(...):
+          if budget.expired():
+              break
+
+The budget lives in a contextvar, so the tools and the LLM gateway see it on the agent's
+threads too. The run stops between steps, web searches past the cap are answered with a
+note to the model, waits for an LLM slot end at the deadline, and each LLM call or Tavily
+request gets the time left as its timeout (LLM calls without client retries), so no call
+runs past the deadline. Each limit that cut a run short is counted once per run in
+exhausted.
+"""
+import os
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# seconds from when the agent starts on a question until it must answer
+AGENT_DEADLINE = float(os.getenv("AGENT_DEADLINE", "20"))
+# LLM calls per question; tool calls between them are not counted
+AGENT_MAX_STEPS = int(os.getenv("AGENT_MAX_STEPS", "6"))
+AGENT_MAX_WEB_SEARCHES = int(os.getenv("AGENT_MAX_WEB_SEARCHES", "2"))
+
+
+class DeadlineExceeded(Exception):
+    '''Raised inside a run (e.g. while waiting for an LLM slot) once its deadline has passed.'''
+
+
+class RunBudget:
+    def __init__(self, deadline_seconds: float, max_steps: int, max_web_searches: int):
+        self.deadline = time.monotonic() + deadline_seconds
+        self.max_steps = max_steps
+        self.max_web_searches = max_web_searches
+        self.web_searches = 0
+        self.exhausted: set[str] = set()
+        self._lock = threading.Lock()
+
+    def remaining(self) -> float:
+        return self.deadline - time.monotonic()
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def recursion_limit(self) -> int:
+        # LangGraph counts every node run, an LLM step and the tool step after it are two.
+        # The caller stops at max_steps itself; this is the backstop, with room to spare so
+        # the prebuilt agent's own "need more steps" reply is never reached first
+        return 2 * self.max_steps + 4
+
+    def take_web_search(self) -> bool:
+        """Reserves one Tavily call; False once the cap is reached or the deadline has passed."""
+        with self._lock:
+            if self.web_searches >= self.max_web_searches:
+                limit = "web_searches"
+            elif self.expired():
+                limit = "deadline"
+            else:
+                self.web_searches += 1
+                return True
+        self.mark_exhausted(limit)
+        return False
+
+    def mark_exhausted(self, limit: str):
+        """Counts a limit the first time it stops this run."""
+        with self._lock:
+            if limit in self.exhausted:
+                return
+            self.exhausted.add(limit)
+        with _exhausted_lock:
+            exhausted[limit] += 1
+
+
+_current: ContextVar[RunBudget | None] = ContextVar("frontdesk_agent_budget", default=None)
+
+exhausted = {"deadline": 0, "steps": 0, "web_searches": 0}
+_exhausted_lock = threading.Lock()
+
+
+@contextmanager
+def run(
+    deadline_seconds: float = AGENT_DEADLINE,
+    max_steps: int = AGENT_MAX_STEPS,
+    max_web_searches: int = AGENT_MAX_WEB_SEARCHES,
+):
+    budget = RunBudget(deadline_seconds, max_steps, max_web_searches)
+    token = _current.set(budget)
+    try:
+        yield budget
+    finally:
+        _current.reset(token)
+
+
+def current() -> RunBudget | None:
+    return _current.get()
+
+
+def stats() -> dict:
+    with _exhausted_lock:
+        counts = dict(exhausted)
+    return {
+        "deadline_seconds": AGENT_DEADLINE,
+        "max_steps": AGENT_MAX_STEPS,
+        "max_web_searches": AGENT_MAX_WEB_SEARCHES,
+        "exhausted": counts,
+    }
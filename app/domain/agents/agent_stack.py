@@ -0,0 +1,184 @@
+"""
+Lazily built LLM, tools and ReAct agent shared by every RoutingAgent.
+
+Nothing heavy is imported or constructed at import time: langchain/langgraph are
+imported and the hub prompt is fetched on first use (or by warm_up() in the background),
+so the web app boots fast and still boots when the network is down.
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+from dotenv import load_dotenv
+
+from app.utils import sqlite_utils
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+LLM_MODEL = os.getenv("LLM_MODEL", "mistral")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")
+
+# hub prompt for the ReAct agent; pin a commit with "owner/name:commit" for reproducible prompts
+REACT_PROMPT_REF = os.getenv("REACT_PROMPT_REF", "wfh/react-agent-executor")
+PROMPT_CACHE_DIR = os.getenv("PROMPT_CACHE_DIR") or sqlite_utils.data_path("prompts")
+PROMPT_CACHE_TTL = float(os.getenv("PROMPT_CACHE_TTL", str(7 * 24 * 3600)))
+# bump when the cache file layout changes so old files are ignored
+PROMPT_CACHE_VERSION = 1
+
+WARMUP_RETRY_SECONDS = float(os.getenv("AGENT_WARMUP_RETRY_SECONDS", "30"))
+
+_lock = threading.RLock()
+_llm = None
+_tools = None
+_agent_executor = None
+_warmup_error: str | None = None
+
+
+def get_llm():
+    global _llm
+    if _llm is None:
+        with _lock:
+            if _llm is None:
+                # one model over every configured backend; calls queue in the gateway for a slot
+                from app.domain.agents.gateway_chat_model import GatewayChatModel
+                from app.domain.agents.llm_gateway import get_gateway
+                _llm = GatewayChatModel(gateway=get_gateway())
+    return _llm
+
+
+def get_tools():
+    global _tools
+    if _tools is None:
+        with _lock:
+            if _tools is None:
+                from app.domain.agents.tools import build_tools
+                _tools = build_tools()
+    return _tools
+
+
+def _prompt_cache_path(ref: str) -> str:
+    return os.path.join(PROMPT_CACHE_DIR, ref.replace("/", "__").replace(":", "@") + ".json")
+
+
+def _read_cached_prompt(path: str):
+    """Returns (prompt, fetched_at) from the disk cache, or (None, 0) if missing or from another layout/version."""
+    from langchain_core import __version__ as core_version
+    from langchain_core.load import load
+
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+        if cached.get("version") != PROMPT_CACHE_VERSION or cached.get("langchain_core") != core_version:
+            return None, 0
+        return load(cached["prompt"]), cached["fetched_at"]
+    except FileNotFoundError:
+        return None, 0
+    except Exception as e:
+        logger.warning("Ignoring unreadable prompt cache %s: %s", path, e)
+        return None, 0
+
+
+def _write_cached_prompt(path: str, ref: str, prompt):
+    from langchain_core import __version__ as core_version
+    from langchain_core.load import dumpd
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({
+            "version": PROMPT_CACHE_VERSION,
+            "langchain_core": core_version,
+            "ref": ref,
+            "fetched_at": time.time(),
+            "prompt": dumpd(prompt),
+        }, f)
+    os.replace(tmp_path, path)
+
+
+def get_react_prompt(ref: str = REACT_PROMPT_REF):
+    """
+    Returns the hub prompt, served from the disk cache while it is fresh. A stale cache
+    is refreshed from the hub, and used as-is if the hub can't be reached.
+    """
+    path = _prompt_cache_path(ref)
+    prompt, fetched_at = _read_cached_prompt(path)
+    if prompt is not None and time.time() - fetched_at < PROMPT_CACHE_TTL:
+        return prompt
+    try:
+        from langchain import hub
+        fresh = hub.pull(ref)
+    except Exception as e:
+        if prompt is None:
+            raise
+        logger.warning("Could not refresh prompt %s, using cached copy: %s", ref, e)
+        return prompt
+    try:
+        _write_cached_prompt(path, ref, fresh)
+    except Exception as e:
+        logger.warning("Could not cache prompt %s: %s", ref, e)
+    return fresh
+
+
+def get_agent_executor():
+    global _agent_executor
+    if _agent_executor is None:
+        with _lock:
+            if _agent_executor is None:
+                from langchain_core.runnables import RunnableLambda
+                from langgraph.prebuilt import create_react_agent
+                from app.domain.agents import guest_memory
+                # each guest's earlier questions go in front of the prompt, compacted
+                _agent_executor = create_react_agent(
+                    get_llm(),
+                    get_tools(),
+                    messages_modifier=RunnableLambda(guest_memory.prompt_messages) | get_react_prompt(),
+                    checkpointer=guest_memory.get_checkpointer() if guest_memory.AGENT_MEMORY_ENABLED else None,
+                )
+    return _agent_executor
+
+
+def is_ready() -> bool:
+    return _agent_executor is not None
+
+
+def warmup_error() -> str | None:
+    return _warmup_error
+
+
+def warm_up_knowledge_base():
+    """Builds the knowledge base index if the corpus changed. The webhook process calls
+    this before starting worker processes, so they only ever read the index."""
+    # embedding the corpus is slow the first time; a failure here only disables the KB tool's results
+    from app.domain.agents.knowledge_base import HOTEL_KB_ENABLED, get_knowledge_base
+    if not HOTEL_KB_ENABLED:
+        return
+    try:
+        get_knowledge_base().ensure_index()
+    except Exception as e:
+        logger.error("Knowledge base indexing failed: %s", e, exc_info=True)
+
+
+def warm_up(retry: bool = True):
+    """
+    Builds the agent stack ahead of the first message. Meant to run on a background
+    thread; keeps retrying every WARMUP_RETRY_SECONDS until it succeeds if retry is set.
+    """
+    global _warmup_error
+    while True:
+        start_time = time.time()
+        try:
+            get_agent_executor()
+            warm_up_knowledge_base()
+            _warmup_error = None
+            logger.info("Agent stack ready in %.2f seconds", time.time() - start_time)
+            return
+        except Exception as e:
+            _warmup_error = str(e)
+            logger.error("Agent warm-up failed: %s", e, exc_info=True)
+            if not retry:
+                return
+        time.sleep(WARMUP_RETRY_SECONDS)
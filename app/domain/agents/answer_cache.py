@@ -0,0 +1,225 @@
+"""
+Semantic cache of answers to search-intent questions, backed by a chromadb collection.
+
+Guests ask the same things over and over ("when does the spa open"); a question whose
+embedding is within ANSWER_CACHE_MAX_DISTANCE of a cached one is answered from the cache
+instead of running the ReAct agent. Entries expire after ANSWER_CACHE_TTL seconds and the
+oldest are evicted once ANSWER_CACHE_MAX_ENTRIES is exceeded.
+"""
+import os
+import re
+import time
+import uuid
+import logging
+import threading
+
+from app.domain.agents.embeddings import get_embedding_function
+from app.utils import sqlite_utils
+
+logger = logging.getLogger(__name__)
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "1") != "0"
+ANSWER_CACHE_PATH = os.getenv("ANSWER_CACHE_PATH") or sqlite_utils.data_path("answer_cache")
+# cosine distance; 0 is identical. ~0.1 catches rephrasings without merging different questions
+ANSWER_CACHE_MAX_DISTANCE = float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.1"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(6 * 3600)))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+
+COLLECTION_NAME = "answers"
+# answers are stored with the guest's name, where it addresses them, swapped for this and
+# re-personalized on a hit
+GUEST_PLACEHOLDER = "{guest}"
+
+_WHITESPACE = re.compile(r"\s+")
+# ways the agent addresses the guest, with {name} as the name: "May, the spa...", "Hi May",
+# "Enjoy your stay, May!"; "opens in May" or "April, May and June" are content
+_ADDRESS_FORMS = (
+    r"^(?:(?i:hi|hello|hey|dear|good (?:morning|afternoon|evening))\s+)?(?P<name>{name})(?=[,!.])",
+    r"\b(?i:hi|hello|hey|dear)\s+(?P<name>{name})\b",
+    r",\s*(?P<name>{name})(?=[.!?])",
+)
+
+
+def _normalize_question(question: str) -> str:
+    return _WHITESPACE.sub(" ", question.strip().lower())
+
+
+def depersonalize(answer: str, first_name: str) -> str | None:
+    """
+    Swaps the guest's name for GUEST_PLACEHOLDER where the answer addresses them. Returns
+    None if the name is still used some other way: that could be content ("opens in May"
+    for a guest named May) or about this guest, so the answer isn't safe to reuse.
+    """
+    if not first_name:
+        return answer
+    name = re.escape(first_name)
+
+    def placeholder(match: re.Match) -> str:
+        text = match.group(0)
+        return text[:match.start("name") - match.start()] + GUEST_PLACEHOLDER + text[match.end("name") - match.start():]
+
+    for form in _ADDRESS_FORMS:
+        answer = re.sub(form.format(name=name), placeholder, answer)
+    if re.search(rf"\b{name}\b", answer):
+        return None
+    return answer
+
+
+class AnswerCache:
+    '''Embedding-keyed answer cache. lookup() and store() never raise: a cache failure is
+    logged and treated as a miss so it can't break a guest reply.'''
+    def __init__(
+        self,
+        path: str = ANSWER_CACHE_PATH,
+        max_distance: float = ANSWER_CACHE_MAX_DISTANCE,
+        ttl: float = ANSWER_CACHE_TTL,
+        max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+        embedding_function=None,
+    ):
+        self.path = path
+        self.max_distance = max_distance
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._embedding_function = embedding_function
+        self._collection = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self.errors = 0
+
+    def _get_collection(self):
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    import chromadb
+                    client = chromadb.PersistentClient(path=self.path)
+                    self._collection = client.get_or_create_collection(
+                        COLLECTION_NAME,
+                        embedding_function=self._embedding_function or get_embedding_function(),
+                        metadata={"hnsw:space": "cosine"},
+                    )
+        return self._collection
+
+    def lookup(self, question: str, first_name: str) -> str | None:
+        try:
+            result = self._get_collection().query(
+                query_texts=[_normalize_question(question)],
+                n_results=1,
+                where={"created_at": {"$gte": time.time() - self.ttl}},
+                include=["metadatas", "distances"],
+            )
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Answer cache lookup failed: %s", e)
+            return None
+        if result["ids"][0] and result["distances"][0][0] <= self.max_distance:
+            self.hits += 1
+            logger.info("Answer cache hit (distance %.3f) for: %s", result["distances"][0][0], question)
+            return result["metadatas"][0][0]["answer"].replace(GUEST_PLACEHOLDER, first_name)
+        self.misses += 1
+        return None
+
+    def store(self, question: str, answer: str, first_name: str):
+        if not answer:
+            return
+        answer = depersonalize(answer, first_name)
+        if answer is None:
+            logger.info("Not caching an answer that uses the guest's name beyond addressing them")
+            return
+        try:
+            collection = self._get_collection()
+            with self._lock:
+                collection.add(
+                    ids=[uuid.uuid4().hex],
+                    documents=[_normalize_question(question)],
+                    metadatas=[{"answer": answer, "question": question, "created_at": time.time()}],
+                )
+                self.stores += 1
+                if self.stores % 100 == 0 or collection.count() > self.max_entries:
+                    self._evict(collection)
+        except Exception as e:
+            self.errors += 1
+            logger.warning("Answer cache store failed: %s", e)
+
+    def _evict(self, collection):
+        """Drops expired entries, then the oldest ones beyond max_entries (with 10% headroom)."""
+        collection.delete(where={"created_at": {"$lt": time.time() - self.ttl}})
+        overflow = collection.count() - self.max_entries
+        if overflow <= 0:
+            return
+        overflow += self.max_entries // 10
+        entries = collection.get(include=["metadatas"])
+        oldest = sorted(zip(entries["ids"], entries["metadatas"]), key=lambda entry: entry[1]["created_at"])
+        collection.delete(ids=[entry_id for entry_id, _ in oldest[:overflow]])
+        self.evictions += min(overflow, len(oldest))
+
+    def invalidate(self, question: str | None = None, entry_id: str | None = None) -> int:
+        """
+        Lets staff drop stale answers: by entry id, by question (every entry within the
+        similarity threshold), or everything when neither is given. Returns entries removed.
+        """
+        collection = self._get_collection()
+        with self._lock:
+            if entry_id:
+                ids = collection.get(ids=[entry_id])["ids"]
+            elif question:
+                result = collection.query(
+                    query_texts=[_normalize_question(question)], n_results=50, include=["distances"]
+                )
+                ids = [i for i, distance in zip(result["ids"][0], result["distances"][0]) if distance <= self.max_distance]
+            else:
+                ids = collection.get(include=[])["ids"]
+            if ids:
+                collection.delete(ids=ids)
+        logger.info("Answer cache: invalidated %d entries", len(ids))
+        return len(ids)
+
+    def entries(self, limit: int = 100) -> list[dict]:
+        result = self._get_collection().get(limit=limit, include=["metadatas"])
+        return [{"id": entry_id, **metadata} for entry_id, metadata in zip(result["ids"], result["metadatas"])]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        stats = {
+            "enabled": ANSWER_CACHE_ENABLED,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+            "errors": self.errors,
+        }
+        if self._collection is not None:
+            stats["size"] = self._collection.count()
+        return stats
+
+
+_answer_cache = None
+_answer_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> AnswerCache:
+    global _answer_cache
+    if _answer_cache is None:
+        with _answer_cache_lock:
+            if _answer_cache is None:
+                _answer_cache = AnswerCache()
+    return _answer_cache
+
+
+def use_path(path: str):
+    """
+    Points this process's answer cache at its own directory. chromadb's PersistentClient
+    can't be shared between processes, so each worker process keeps a separate cache
+    (see worker_pool).
+    """
+    global _answer_cache
+    with _answer_cache_lock:
+        _answer_cache = AnswerCache(path=path)
+
+
+def invalidate(question: str | None = None, entry_id: str | None = None) -> int:
+    """AnswerCache.invalidate on this process's cache; sent to every worker process by the admin API."""
+    return get_answer_cache().invalidate(question=question, entry_id=entry_id)
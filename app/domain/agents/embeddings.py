@@ -0,0 +1,17 @@
+import os
+
+# "default" (chromadb's bundled MiniLM) or "ollama:<model>" to embed with the local Ollama
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "default")
+
+
+def get_embedding_function(spec: str = EMBEDDING_MODEL):
+    """Embedding function shared by the chromadb collections (answer cache, knowledge base)."""
+    from chromadb.utils import embedding_functions
+
+    if spec.startswith("ollama:"):
+        from app.domain.agents.agent_stack import OLLAMA_BASE_URL
+        base_url = OLLAMA_BASE_URL.removesuffix("/v1")
+        return embedding_functions.OllamaEmbeddingFunction(
+            url=f"{base_url}/api/embeddings", model_name=spec.split(":", 1)[1]
+        )
+    return embedding_functions.DefaultEmbeddingFunction()
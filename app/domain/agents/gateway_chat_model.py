@@ -0,0 +1,75 @@
+"""
+Chat model that sends every call through the LLM gateway. The agent and the task
+acknowledgement use it in place of a ChatOpenAI bound to one endpoint; imported by
+agent_stack on first use, like the rest of the langchain stack.
+"""
+from typing import Any
+
+import openai
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from pydantic import ConfigDict
+
+from app.domain.agents import agent_budget
+from app.domain.agents.llm_gateway import LLM_REQUEST_TIMEOUT, LLMGateway
+
+# errors raised before the backend produced anything, so the call can go to another backend
+_UNREACHABLE = (openai.APIConnectionError, openai.InternalServerError)
+
+
+class GatewayChatModel(BaseChatModel):
+    gateway: LLMGateway
+    # arguments of bind_tools(), applied to whichever backend's model serves the call
+    tool_binding: tuple | None = None
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    @property
+    def _llm_type(self) -> str:
+        return "frontdesk-llm-gateway"
+
+    def bind_tools(self, tools, **kwargs) -> "GatewayChatModel":
+        return self.model_copy(update={"tool_binding": (tools, kwargs)})
+
+    def _backend_model(self, backend, max_retries: int | None = None):
+        llm = backend.model(max_retries)
+        if self.tool_binding is None:
+            return llm
+        tools, kwargs = self.tool_binding
+        return llm.bind_tools(tools, **kwargs)
+
+    def _generate(self, messages: list[BaseMessage], stop: list[str] | None = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        run = agent_budget.current()
+        unreachable = None
+        while True:
+            backend = self.gateway.acquire(exclude=unreachable)
+            try:
+                # inside an agent run the call must end by the run's deadline, and a client
+                # retry would start it over, so one attempt capped at the time left
+                model = self._backend_model(backend, None if run is None else 0)
+                if run is not None:
+                    if run.expired():
+                        run.mark_exhausted("deadline")
+                        raise agent_budget.DeadlineExceeded()
+                    kwargs["timeout"] = min(LLM_REQUEST_TIMEOUT, run.remaining())
+                message = model.invoke(messages, stop=stop, **kwargs)
+            except openai.APITimeoutError:
+                self.gateway.release(backend)
+                if run is not None and run.expired():
+                    # cut off by the run's deadline, not a sign the backend is down
+                    run.mark_exhausted("deadline")
+                    raise agent_budget.DeadlineExceeded() from None
+                raise
+            except _UNREACHABLE:
+                self.gateway.release(backend, unreachable=True)
+                # one more try on another backend; this one is in cooldown now
+                if unreachable is not None or len(self.gateway.backends) < 2:
+                    raise
+                unreachable = backend
+                continue
+            except BaseException:
+                self.gateway.release(backend)
+                raise
+            self.gateway.release(backend)
+            return ChatResult(generations=[ChatGeneration(message=message)])
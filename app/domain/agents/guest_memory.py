@@ -0,0 +1,154 @@
+"""
+Per-guest conversation memory for the ReAct agent.
+
+Each guest has a LangGraph thread, checkpointed to SQLite, so follow-ups ("and what about
+tomorrow?") are answered with the earlier questions in view. History is kept small:
+
+- after every run the thread is rewritten to one question and the reply actually sent
+  per turn (tool calls, search results and the prompt suffix are dropped), and only the
+  last AGENT_MEMORY_TURNS turns are kept
+- the checkpoints LangGraph writes for every step of the run are deleted, leaving the
+  latest one
+- the prompt sees the same compacted history, so a thread left mid-run by a crash
+  still costs no more tokens
+
+Prompt size therefore stays flat however long the stay is, and the SQLite file grows
+with the number of guests, not with the number of messages.
+"""
+import os
+import threading
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from app.utils import sqlite_utils
+
+load_dotenv()
+
+AGENT_MEMORY_ENABLED = os.getenv("AGENT_MEMORY_ENABLED", "1") != "0"
+AGENT_MEMORY_PATH = os.getenv("AGENT_MEMORY_PATH") or sqlite_utils.data_path("agent_memory.sqlite3")
+# earlier question/answer pairs kept per guest
+AGENT_MEMORY_TURNS = int(os.getenv("AGENT_MEMORY_TURNS", "4"))
+# a question asked within this many seconds of the guest's previous one may refer back to
+# it, so it is neither answered from nor stored in the answer cache
+AGENT_MEMORY_FOLLOWUP_WINDOW = float(os.getenv("AGENT_MEMORY_FOLLOWUP_WINDOW", "1800"))
+
+_checkpointer = None
+_lock = threading.Lock()
+
+
+def get_checkpointer():
+    global _checkpointer
+    if _checkpointer is None:
+        with _lock:
+            if _checkpointer is None:
+                from langgraph.checkpoint.sqlite import SqliteSaver
+                saver = SqliteSaver(sqlite_utils.connect(AGENT_MEMORY_PATH))
+                saver.setup()
+                _checkpointer = saver
+    return _checkpointer
+
+
+def _final_answer(messages: list):
+    """The last AI message of a turn that is an answer rather than a tool call, or None."""
+    from langchain_core.messages import AIMessage
+
+    for message in reversed(messages):
+        if isinstance(message, AIMessage) and not message.tool_calls and message.content:
+            return message
+    return None
+
+
+def _split_turns(messages: list) -> list[list]:
+    from langchain_core.messages import HumanMessage
+
+    turns = []
+    for message in messages:
+        if isinstance(message, HumanMessage) or not turns:
+            turns.append([message])
+        else:
+            turns[-1].append(message)
+    return turns
+
+
+def compact_turns(turns: list[list], max_turns: int = AGENT_MEMORY_TURNS) -> list:
+    """Question and final answer of each of the last max_turns answered turns."""
+    compacted = []
+    for turn in turns:
+        answer = _final_answer(turn[1:])
+        if answer is not None:
+            compacted.append([turn[0], answer])
+    return [message for turn in compacted[-max_turns:] for message in turn] if max_turns > 0 else []
+
+
+def prompt_messages(messages: list) -> list:
+    """messages_modifier step: compacted history, then the current turn as it stands."""
+    turns = _split_turns(messages)
+    if len(turns) < 2:
+        return messages
+    return compact_turns(turns[:-1]) + turns[-1]
+
+
+def thread_config(thread_id: str) -> dict:
+    return {"configurable": {"thread_id": thread_id}}
+
+
+def remember(graph, thread_id: str, question: str, reply: str):
+    """
+    Rewrites the thread after a run: the turn just finished becomes the guest's own
+    question and the reply they were sent (even if the run was cut short), older turns are
+    compacted, and the per-step checkpoints of the run are deleted.
+    """
+    from langchain_core.messages import AIMessage, HumanMessage, RemoveMessage
+
+    config = thread_config(thread_id)
+    messages = graph.get_state(config).values.get("messages", [])
+    turns = _split_turns(messages)
+    if not turns:
+        return
+    current = turns[-1]
+    # with the turn just finished, AGENT_MEMORY_TURNS in all
+    kept = compact_turns(turns[:-1], AGENT_MEMORY_TURNS - 1)
+    kept_ids = {message.id for message in kept}
+    answer = _final_answer(current[1:])
+    updates = [
+        RemoveMessage(id=message.id) for message in messages
+        if message.id not in kept_ids and message is not current[0] and message is not answer
+    ]
+    # same ids replace the messages in place
+    updates.append(HumanMessage(content=question, id=current[0].id))
+    updates.append(AIMessage(content=reply, id=answer.id) if answer is not None else AIMessage(content=reply))
+    # as the agent node: the thread ends on an answer, so the graph has nothing left to run
+    latest = graph.update_state(config, {"messages": updates}, as_node="agent")
+    _delete_older_checkpoints(thread_id, latest["configurable"]["checkpoint_id"])
+
+
+def _delete_older_checkpoints(thread_id: str, keep_checkpoint_id: str):
+    saver = get_checkpointer()
+    with saver.lock:
+        saver.conn.execute(
+            "DELETE FROM checkpoints WHERE thread_id = ? AND checkpoint_id != ?", (thread_id, keep_checkpoint_id)
+        )
+        saver.conn.execute(
+            "DELETE FROM writes WHERE thread_id = ? AND checkpoint_id != ?", (thread_id, keep_checkpoint_id)
+        )
+
+
+def last_turn_at(graph, thread_id: str) -> float | None:
+    """Wall-clock time of the thread's latest checkpoint, or None for a guest with no history."""
+    snapshot = graph.get_state(thread_config(thread_id))
+    if not snapshot.values.get("messages") or not snapshot.created_at:
+        return None
+    return datetime.fromisoformat(snapshot.created_at).timestamp()
+
+
+def stats() -> dict:
+    if not AGENT_MEMORY_ENABLED:
+        return {"enabled": False}
+    saver = _checkpointer
+    if saver is None:
+        # no search answered yet; don't open the store just for the count
+        return {"enabled": True, "threads": 0, "max_turns": AGENT_MEMORY_TURNS}
+    with saver.lock:
+        threads = saver.conn.execute("SELECT COUNT(DISTINCT thread_id) FROM checkpoints").fetchone()[0]
+    return {"enabled": True, "threads": threads, "max_turns": AGENT_MEMORY_TURNS}
@@ -0,0 +1,129 @@
+"""
+Keyword classifier for guest messages: task vs search intent, and which department a
+task belongs to. All keywords from the taxonomy file are compiled into one word-boundary
+regex, so a message is scanned once no matter how many keywords there are.
+
+Classify historical messages in bulk (one message per line in, JSON lines out):
+
+  python -m app.domain.agents.intent_classifier messages.txt > classified.jsonl
+"""
+import os
+import re
+import sys
+import json
+import threading
+from typing import Iterable, NamedTuple
+
+INTENT_TAXONOMY_PATH = os.getenv(
+    "INTENT_TAXONOMY_PATH", os.path.join(os.path.dirname(__file__), "taxonomy.json")
+)
+
+_WHITESPACE = re.compile(r"\s+")
+# inflections matched on top of each keyword ("towel" -> "towels", "deliver" -> "delivered", "delivery")
+_SUFFIXES = ("", "s", "es", "d", "ed", "ing", "y", "ies")
+
+
+class Classification(NamedTuple):
+    intent: str
+    department: str
+    # 0..1: how strongly the matched keywords back the chosen intent (and department, for tasks)
+    confidence: float
+    keywords: tuple[str, ...]
+
+
+class IntentClassifier:
+    '''Single-pass intent and department classifier built from a taxonomy:
+    {"default_intent", "default_department", "intents": {label: [keywords]}, "departments": {label: [keywords]}}.
+    Keywords match whole words, case-insensitively, with an optional -s/-es/-d/-ed/-ing/-y/-ies ending.'''
+    def __init__(self, taxonomy: dict):
+        self.default_intent = taxonomy.get("default_intent", "search")
+        self.default_department = taxonomy.get("default_department", "general")
+        # keyword -> (is_intent, label); first listing wins
+        keywords: dict[str, tuple[bool, str]] = {}
+        for is_intent, section in ((True, "intents"), (False, "departments")):
+            for label, section_keywords in taxonomy.get(section, {}).items():
+                for keyword in section_keywords:
+                    keywords.setdefault(self._normalize(keyword), (is_intent, label))
+        # every inflected form the regex can match maps straight to its label, so a hit is one dict lookup
+        self._labels = {}
+        for keyword, label in keywords.items():
+            for suffix in _SUFFIXES:
+                self._labels.setdefault(keyword + suffix, label)
+        # taxonomy order breaks department ties
+        self._department_order = {label: i for i, label in enumerate(taxonomy.get("departments", {}))}
+        alternatives = sorted(keywords, key=len, reverse=True)
+        pattern = "|".join(r"\s+".join(map(re.escape, keyword.split(" "))) for keyword in alternatives)
+        self._pattern = re.compile(rf"\b(?:{pattern})(?:e?s|e?d|ing|y|ies)?\b", re.IGNORECASE)
+
+    @classmethod
+    def from_file(cls, path: str = INTENT_TAXONOMY_PATH) -> "IntentClassifier":
+        with open(path) as f:
+            return cls(json.load(f))
+
+    @staticmethod
+    def _normalize(text: str) -> str:
+        return _WHITESPACE.sub(" ", text.strip().lower())
+
+    def classify(self, message: str) -> Classification:
+        intent_hits: dict[str, int] = {}
+        department_hits: dict[str, int] = {}
+        keywords = []
+        labels = self._labels
+        for matched in self._pattern.findall(message):
+            matched = matched.lower()
+            found = labels.get(matched) or labels.get(_WHITESPACE.sub(" ", matched))
+            if not found:
+                continue
+            is_intent, label = found
+            hits = intent_hits if is_intent else department_hits
+            hits[label] = hits.get(label, 0) + 1
+            keywords.append(matched)
+
+        if intent_hits:
+            intent, count = max(intent_hits.items(), key=lambda item: item[1])
+            intent_confidence = count / (count + 1)
+        elif department_hits:
+            intent = self.default_intent
+            # department words with no action word are ambiguous ("is room service open?")
+            intent_confidence = 1 / (1 + sum(department_hits.values()))
+        else:
+            # no keyword at all: the default intent is a guess, not evidence
+            intent, intent_confidence = self.default_intent, 0.0
+
+        if department_hits:
+            department, count = max(
+                department_hits.items(), key=lambda item: (item[1], -self._department_order[item[0]])
+            )
+            department_confidence = count / sum(department_hits.values())
+        else:
+            department, department_confidence = self.default_department, 0.0
+
+        if intent == self.default_intent:
+            confidence = intent_confidence
+        else:
+            confidence = (intent_confidence + department_confidence) / 2
+        return Classification(intent, department, round(confidence, 3), tuple(keywords))
+
+    def classify_many(self, messages: Iterable[str]) -> list[Classification]:
+        classify = self.classify
+        return [classify(message) for message in messages]
+
+
+_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_intent_classifier() -> IntentClassifier:
+    global _classifier
+    if _classifier is None:
+        with _classifier_lock:
+            if _classifier is None:
+                _classifier = IntentClassifier.from_file()
+    return _classifier
+
+
+if __name__ == "__main__":
+    source = open(sys.argv[1]) if len(sys.argv) > 1 else sys.stdin
+    lines = [line.rstrip("\n") for line in source if line.strip()]
+    for line, result in zip(lines, get_intent_classifier().classify_many(lines)):
+        print(json.dumps({"message": line, **result._asdict()}))
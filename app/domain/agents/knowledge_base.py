@@ -0,0 +1,118 @@
+"""
+Local retrieval over the hotel's FAQ/amenities corpus (JSON lines: id, title, text).
+
+The corpus is embedded once into a persistent chromadb collection and re-embedded only
+when the corpus file changes (its sha256 is stored on the collection), so a lookup only
+embeds the query. Rebuild by hand with:
+
+  python -m app.domain.agents.knowledge_base --rebuild
+"""
+import os
+import sys
+import json
+import hashlib
+import logging
+import threading
+
+from app.domain.agents.embeddings import get_embedding_function
+from app.utils import sqlite_utils
+
+logger = logging.getLogger(__name__)
+
+# the property's own corpus; data/hotel_kb.example.jsonl only shows the format, so there is
+# no default and the tool is off until this is set
+HOTEL_KB_PATH = os.getenv("HOTEL_KB_PATH")
+HOTEL_KB_ENABLED = bool(HOTEL_KB_PATH) and os.getenv("HOTEL_KB_ENABLED", "1") != "0"
+HOTEL_KB_INDEX_PATH = os.getenv("HOTEL_KB_INDEX_PATH") or sqlite_utils.data_path("knowledge_base")
+HOTEL_KB_RESULTS = int(os.getenv("HOTEL_KB_RESULTS", "3"))
+# cosine distance above which a passage is considered unrelated to the question
+HOTEL_KB_MAX_DISTANCE = float(os.getenv("HOTEL_KB_MAX_DISTANCE", "0.6"))
+
+COLLECTION_NAME = "hotel_kb"
+
+
+class KnowledgeBase:
+    '''Vector index over the hotel corpus, built lazily on first search.'''
+    def __init__(self, corpus_path: str = HOTEL_KB_PATH, index_path: str = HOTEL_KB_INDEX_PATH, embedding_function=None):
+        self.corpus_path = corpus_path
+        self.index_path = index_path
+        self._embedding_function = embedding_function
+        self._collection = None
+        self._lock = threading.Lock()
+
+    def _corpus_digest(self) -> str:
+        with open(self.corpus_path, "rb") as f:
+            return hashlib.sha256(f.read()).hexdigest()
+
+    def _load_corpus(self) -> list[dict]:
+        with open(self.corpus_path) as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def ensure_index(self, force: bool = False):
+        """Embeds the corpus into the collection unless it is already indexed at the current digest."""
+        import chromadb
+
+        with self._lock:
+            embedding_function = self._embedding_function or get_embedding_function()
+            client = chromadb.PersistentClient(path=self.index_path)
+            digest = self._corpus_digest()
+            if not force:
+                try:
+                    collection = client.get_collection(COLLECTION_NAME, embedding_function=embedding_function)
+                    if (collection.metadata or {}).get("corpus_sha256") == digest:
+                        self._collection = collection
+                        return
+                except Exception:
+                    pass
+            try:
+                client.delete_collection(COLLECTION_NAME)
+            except Exception:
+                pass
+            documents = self._load_corpus()
+            collection = client.create_collection(
+                COLLECTION_NAME,
+                embedding_function=embedding_function,
+                metadata={"hnsw:space": "cosine", "corpus_sha256": digest},
+            )
+            texts = [f"{doc['title']}. {doc['text']}" for doc in documents]
+            collection.add(
+                ids=[doc["id"] for doc in documents],
+                documents=texts,
+                embeddings=embedding_function(texts),
+                metadatas=[{"title": doc["title"]} for doc in documents],
+            )
+            self._collection = collection
+            logger.info("Indexed %d knowledge base entries from %s", len(documents), self.corpus_path)
+
+    def search(self, query: str, k: int = HOTEL_KB_RESULTS, max_distance: float = HOTEL_KB_MAX_DISTANCE) -> list[dict]:
+        if self._collection is None:
+            self.ensure_index()
+        result = self._collection.query(query_texts=[query], n_results=k, include=["documents", "distances"])
+        return [
+            {"id": entry_id, "text": document, "distance": round(distance, 3)}
+            for entry_id, document, distance in zip(result["ids"][0], result["documents"][0], result["distances"][0])
+            if distance <= max_distance
+        ]
+
+
+_knowledge_base = None
+_knowledge_base_lock = threading.Lock()
+
+
+def get_knowledge_base() -> KnowledgeBase:
+    global _knowledge_base
+    if _knowledge_base is None:
+        with _knowledge_base_lock:
+            if _knowledge_base is None:
+                _knowledge_base = KnowledgeBase()
+    return _knowledge_base
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if not HOTEL_KB_PATH:
+        sys.exit("Set HOTEL_KB_PATH to the hotel's corpus")
+    knowledge_base = get_knowledge_base()
+    knowledge_base.ensure_index(force="--rebuild" in sys.argv)
+    for query in [arg for arg in sys.argv[1:] if not arg.startswith("--")]:
+        print(json.dumps({"query": query, "results": knowledge_base.search(query)}, indent=2))
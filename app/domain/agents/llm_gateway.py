@@ -0,0 +1,249 @@
+"""
+Admission control in front of the Ollama backends.
+
+Every LLM call (the task acknowledgement and each step of the ReAct agent) takes a slot
+here before it reaches a backend. Each backend takes at most LLM_MAX_IN_FLIGHT calls at
+once; Ollama serializes anything beyond its parallelism, so extra calls only add to
+everyone's latency there. Calls beyond that wait in one priority queue:
+
+  with llm_gateway.priority(llm_gateway.ACK):
+      response = get_llm().invoke(messages)
+
+Acknowledgements go ahead of search steps, and a call that waits longer than its
+priority's queue budget raises LLMOverloaded so the caller can answer from a template
+instead. Slots are spread over OLLAMA_BASE_URLS, least loaded first; a backend that
+refuses connections is skipped for LLM_BACKEND_COOLDOWN seconds.
+"""
+import os
+import time
+import heapq
+import logging
+import itertools
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from dotenv import load_dotenv
+
+from app.domain.agents import agent_budget
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# comma separated OpenAI-compatible endpoints; falls back to the single OLLAMA_BASE_URL
+OLLAMA_BASE_URLS = [
+    url.strip() for url in
+    os.getenv("OLLAMA_BASE_URLS", os.getenv("OLLAMA_BASE_URL", "http://localhost:11434/v1")).split(",")
+    if url.strip()
+]
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "2"))
+# seconds a call may wait for a slot before it is shed, per priority
+LLM_ACK_QUEUE_BUDGET = float(os.getenv("LLM_ACK_QUEUE_BUDGET", "3"))
+LLM_SEARCH_QUEUE_BUDGET = float(os.getenv("LLM_SEARCH_QUEUE_BUDGET", "10"))
+LLM_BACKEND_COOLDOWN = float(os.getenv("LLM_BACKEND_COOLDOWN", "15"))
+# seconds one call may take on a backend, so a stuck call can't hold a worker indefinitely
+LLM_REQUEST_TIMEOUT = float(os.getenv("LLM_REQUEST_TIMEOUT", "60"))
+
+# lower runs first
+ACK = 0
+SEARCH = 1
+PRIORITY_NAMES = {ACK: "ack", SEARCH: "search"}
+QUEUE_BUDGETS = {ACK: LLM_ACK_QUEUE_BUDGET, SEARCH: LLM_SEARCH_QUEUE_BUDGET}
+
+_priority: ContextVar[int] = ContextVar("frontdesk_llm_priority", default=SEARCH)
+
+
+class LLMOverloaded(Exception):
+    '''Raised when a call waited longer than its queue budget for a backend slot.'''
+
+
+@contextmanager
+def priority(level: int):
+    """LLM calls made inside the block (on this thread or in a copied context) queue at this priority."""
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority() -> int:
+    return _priority.get()
+
+
+class Backend:
+    '''One Ollama endpoint with its own chat models, built on first use.'''
+    def __init__(self, base_url: str, build):
+        self.base_url = base_url
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.down_until = 0.0
+        self._build = build
+        self._models = {}
+
+    def model(self, max_retries: int | None = None):
+        """The chat model for this endpoint; max_retries=None keeps the client's default retries."""
+        model = self._models.get(max_retries)
+        if model is None:
+            model = self._models[max_retries] = self._build(self.base_url, max_retries)
+        return model
+
+    @property
+    def llm(self):
+        return self.model()
+
+    def available(self, now: float) -> bool:
+        return self.down_until <= now
+
+
+class LLMGateway:
+    '''
+    Bounded slots per backend and a priority queue for the calls waiting on them. Only the
+    head of the queue may take a free slot, so a search step never overtakes a waiting
+    acknowledgement; within a priority calls are served in arrival order.
+    '''
+    def __init__(
+        self,
+        base_urls: list[str],
+        build,
+        max_in_flight: int = LLM_MAX_IN_FLIGHT,
+        cooldown: float = LLM_BACKEND_COOLDOWN,
+    ):
+        self.backends = [Backend(url, build) for url in base_urls]
+        self.max_in_flight = max_in_flight
+        self.cooldown = cooldown
+        self._waiting: list[tuple[int, int]] = []
+        self._sequence = itertools.count()
+        self._next_backend = 0
+        self._cond = threading.Condition()
+        self.shed = {name: 0 for name in PRIORITY_NAMES.values()}
+
+    def _pick(self, exclude: Backend | None) -> Backend | None:
+        # least loaded backend with a free slot; backends in cooldown only when every
+        # backend is down, so an outage of all of them still reaches the caller as an error
+        now = time.monotonic()
+        candidates = [
+            backend for backend in self.backends
+            if backend is not exclude and backend.in_flight < self.max_in_flight
+        ]
+        healthy = [backend for backend in candidates if backend.available(now)]
+        if healthy:
+            candidates = healthy
+        elif any(backend.available(now) for backend in self.backends if backend is not exclude):
+            return None
+        if not candidates:
+            return None
+        # rotate the starting point so equally loaded backends take turns
+        self._next_backend = (self._next_backend + 1) % len(self.backends)
+        offset = self._next_backend
+        return min(
+            candidates,
+            key=lambda backend: (backend.in_flight, (self.backends.index(backend) - offset) % len(self.backends)),
+        )
+
+    def acquire(self, level: int | None = None, budget: float | None = None, exclude: Backend | None = None) -> Backend:
+        """
+        Waits for a backend slot and returns the backend; release() it when the call is done.
+        Raises LLMOverloaded after budget seconds (the priority's queue budget by default),
+        or DeadlineExceeded if the agent run making the call reaches its deadline first.
+        """
+        level = current_priority() if level is None else level
+        budget = QUEUE_BUDGETS.get(level, LLM_SEARCH_QUEUE_BUDGET) if budget is None else budget
+        started = time.perf_counter()
+        deadline = time.monotonic() + budget
+        run = agent_budget.current()
+        run_deadline = run is not None and run.deadline < deadline
+        if run_deadline:
+            deadline = run.deadline
+        ticket = (level, next(self._sequence))
+        with self._cond:
+            heapq.heappush(self._waiting, ticket)
+            try:
+                while True:
+                    if self._waiting[0] == ticket:
+                        backend = self._pick(exclude)
+                        if backend is not None:
+                            heapq.heappop(self._waiting)
+                            backend.in_flight += 1
+                            backend.calls += 1
+                            break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0 and run_deadline:
+                        run.mark_exhausted("deadline")
+                        raise agent_budget.DeadlineExceeded()
+                    if remaining <= 0:
+                        self.shed[PRIORITY_NAMES.get(level, str(level))] += 1
+                        raise LLMOverloaded(f"No LLM slot within {budget:.1f}s")
+                    self._cond.wait(remaining)
+            except BaseException:
+                if ticket in self._waiting:
+                    self._waiting.remove(ticket)
+                    heapq.heapify(self._waiting)
+                # the head may have changed
+                self._cond.notify_all()
+                raise
+            # the next waiter may fit on another backend
+            self._cond.notify_all()
+        metrics.observe("llm_queue_wait", time.perf_counter() - started, started)
+        return backend
+
+    def release(self, backend: Backend, unreachable: bool = False):
+        """Frees the slot; unreachable puts the backend in cooldown."""
+        with self._cond:
+            backend.in_flight -= 1
+            if unreachable:
+                backend.failures += 1
+                backend.down_until = time.monotonic() + self.cooldown
+                logger.warning("LLM backend %s unreachable, skipping it for %.0fs", backend.base_url, self.cooldown)
+            self._cond.notify_all()
+
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    def in_flight(self) -> int:
+        return sum(backend.in_flight for backend in self.backends)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self._cond:
+            return {
+                "max_in_flight_per_backend": self.max_in_flight,
+                "waiting": {
+                    name: sum(1 for level, _ in self._waiting if level == value)
+                    for value, name in PRIORITY_NAMES.items()
+                },
+                "shed": dict(self.shed),
+                "backends": [
+                    {
+                        "base_url": backend.base_url,
+                        "in_flight": backend.in_flight,
+                        "calls": backend.calls,
+                        "failures": backend.failures,
+                        "available": backend.available(now),
+                    }
+                    for backend in self.backends
+                ],
+            }
+
+
+_gateway: LLMGateway | None = None
+_lock = threading.Lock()
+
+
+def _build_chat_model(base_url: str, max_retries: int | None = None):
+    from langchain_openai import ChatOpenAI
+    from app.domain.agents.agent_stack import LLM_MODEL
+    options = {} if max_retries is None else {"max_retries": max_retries}
+    return ChatOpenAI(model=LLM_MODEL, api_key="ollama", base_url=base_url, timeout=LLM_REQUEST_TIMEOUT, **options)
+
+
+def get_gateway() -> LLMGateway:
+    global _gateway
+    if _gateway is None:
+        with _lock:
+            if _gateway is None:
+                _gateway = LLMGateway(OLLAMA_BASE_URLS, _build_chat_model)
+    return _gateway
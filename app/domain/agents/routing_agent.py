@@ -1,14 +1,15 @@
-from langchain import hub
-from langchain_community.tools.tavily_search import TavilySearchResults
-from langchain.prompts import PromptTemplate
-from langgraph.prebuilt import create_react_agent
-from langchain_openai import ChatOpenAI
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_community.chat_models import ChatOllama
-
 from app.schema import User
-import requests
+from app.domain.agents.agent_stack import get_llm, get_agent_executor
+from app.domain.agents.intent_classifier import get_intent_classifier
+from app.domain.agents.answer_cache import ANSWER_CACHE_ENABLED, get_answer_cache
+from app.domain.agents import agent_budget, guest_memory, llm_gateway
+from app.domain.agents.agent_budget import AGENT_DEADLINE
+from app.utils import metrics
+from app.utils.cache_utils import TTLCache
+from app.utils.request_utils import submit_task, tracking_text
 
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import contextvars
 from dotenv import load_dotenv
 import os
 import time
@@ -16,18 +17,25 @@ import time
 import json
 import logging
 
-logging.basicConfig(level=logging.INFO)
-
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
 TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
 
-llm = ChatOpenAI(model="mistral", api_key="ollama", base_url="http://localhost:11434/v1")
-tools = [TavilySearchResults(max_results=2)]
-prompt = hub.pull("wfh/react-agent-executor")
-agent_executor = create_react_agent(llm, tools, messages_modifier=prompt)
+# The task path runs the LLM acknowledgement on this pool and waits for it this long
+# (seconds) before sending a templated one instead.
+TASK_ACK_DEADLINE = float(os.getenv("TASK_ACK_DEADLINE", "8"))
+TASK_FANOUT_WORKERS = int(os.getenv("TASK_FANOUT_WORKERS", "16"))
+
+_task_pool = ThreadPoolExecutor(max_workers=TASK_FANOUT_WORKERS, thread_name_prefix="task-fanout")
+
+# one RoutingAgent per guest, reused across messages; idle or least recently used ones are
+# dropped (their conversation stays in the guest_memory checkpointer)
+AGENT_SESSIONS_MAX = int(os.getenv("AGENT_SESSIONS_MAX", "2000"))
+AGENT_SESSION_TTL = float(os.getenv("AGENT_SESSION_TTL", "3600"))
+
+_sessions = TTLCache(max_entries=AGENT_SESSIONS_MAX, ttl=AGENT_SESSION_TTL)
 
 class RoutingAgent:
     '''Classifies whether the guest query is a task request or an info request.
@@ -35,52 +43,137 @@ class RoutingAgent:
     If it is an info request, it sends the query to the agent executor for a response.'''
     def __init__(self, user):
         self.user = user
-        self.room_number = 400 + len(user.last_name) #for now
-        self.agent_executor = agent_executor
+        self.room_number = user.room_number or "N/A"
         self.guest_name = user.first_name + " " + user.last_name
+        # the guest's conversation thread in guest_memory; a new guest record starts a new one
+        self.thread_id = f"{user.phone}:{user.id}"
+        # wall-clock time of the last search answered for this guest, loaded on first use
+        self._last_turn_at: float | None = None
+
+    @property
+    def agent_executor(self):
+        # only search requests need the ReAct agent; task requests never wait for it to build
+        return get_agent_executor()
 
     def process_message(self, message):
         """
         Main function to process user messages. Determines whether to search the web or
         prepare a task JSON based on the type of request in the message.
         """
-        print('User message:', message)
+        logger.debug("User message: %s", message)
 
-        # Analyze message intent
-        intent = self._analyze_intent(message)
+        # Classify intent and department in one pass over the message
+        with metrics.timed("intent"):
+            classification = get_intent_classifier().classify(message)
+        logger.info("Classified message as %s/%s (confidence %.2f)",
+                    classification.intent, classification.department, classification.confidence)
 
-        if intent == "search":
-            logging.info("Handling search request")
+        if classification.intent == "search":
+            logger.info("Handling search request", extra={"event": "agent.route"})
             return self._handle_search_request(message, self.user.first_name)
-        elif intent == "task":
-            logging.info("Handling task request")
-            return self._prepare_task_json(message)
+        elif classification.intent == "task":
+            logger.info("Handling task request", extra={"event": "agent.route"})
+            return self._prepare_task_json(message, classification.department)
         else:
             return "I'm sorry, I couldn't determine the intent of your request."
 
-    def _analyze_intent(self, message):
-        """
-        Analyzes the intent of the message to determine whether it is a web search or task.
-        Returns "search" for web search, "task" for a task, and None if undecidable.
-        """
-        # Basic heuristic: Check for action keywords
-        action_keywords = ["need", "send", "bring", "deliver", "request", "call", "help"]
-        if any(keyword in message.lower() for keyword in action_keywords):
-            return "task"
-        else:
-            return "search"
-
     def _handle_search_request(self, message, first_name):
         """
         Handles web search requests by invoking the agent executor.
         """
+        # Repeat questions are answered from the semantic cache without running the agent,
+        # unless they may follow up on the guest's previous question
+        question = message
+        follow_up = self._is_follow_up()
+        if ANSWER_CACHE_ENABLED and not follow_up:
+            cached_answer = get_answer_cache().lookup(question, first_name)
+            if cached_answer:
+                return cached_answer
+
         # Append instructions for web-based responses
         message = message + f" Respond in less than 3 sentences as if you were a hotel manager \
           at the ski resort: Ritz Carlton Bachelor Gulch, and refer to me as {first_name}. Please do not make up information."
-        print('Getting response...')
-        response = self.agent_executor.invoke({"messages": [("user", message)]})
-        print('Returning response. This is the response[messages]: ', response['messages'])
-        return response['messages'][-1].content
+        try:
+            with metrics.timed("agent_invoke"), llm_gateway.priority(llm_gateway.SEARCH):
+                answer, finished = self._run_agent(message)
+        except llm_gateway.LLMOverloaded:
+            # shed: every LLM slot is busy; don't cache this reply
+            logger.warning("LLM queue over budget, sending the busy reply", extra={"event": "llm.shed"})
+            answer, finished = self._busy_reply(first_name), False
+        if answer is None:
+            answer = self._out_of_time_reply(first_name)
+        self._remember(question, answer)
+        # only a run that finished on its own is worth answering repeat questions with
+        if finished and not follow_up and ANSWER_CACHE_ENABLED:
+            get_answer_cache().store(question, answer, first_name)
+        return answer
+
+    def _is_follow_up(self):
+        """
+        True if the guest's previous search was answered within AGENT_MEMORY_FOLLOWUP_WINDOW.
+        """
+        if not guest_memory.AGENT_MEMORY_ENABLED:
+            return False
+        if self._last_turn_at is None:
+            try:
+                self._last_turn_at = guest_memory.last_turn_at(self.agent_executor, self.thread_id) or 0.0
+            except Exception as e:
+                logger.error("Could not read conversation history for %s: %s", self.user.phone, e, exc_info=True)
+                self._last_turn_at = 0.0
+        return time.time() - self._last_turn_at < guest_memory.AGENT_MEMORY_FOLLOWUP_WINDOW
+
+    def _remember(self, question, reply):
+        """
+        Records the question and the reply sent in the guest's conversation thread.
+        """
+        if not guest_memory.AGENT_MEMORY_ENABLED:
+            return
+        self._last_turn_at = time.time()
+        try:
+            guest_memory.remember(self.agent_executor, self.thread_id, question, reply)
+        except Exception as e:
+            # the reply still goes out; the next question just sees a longer history
+            logger.error("Could not update conversation history for %s: %s", self.user.phone, e, exc_info=True)
+
+    def _run_agent(self, message):
+        """
+        Runs the ReAct agent within the AGENT_DEADLINE / AGENT_MAX_STEPS /
+        AGENT_MAX_WEB_SEARCHES budget, checking the deadline between steps. Returns
+        (answer, finished): the final answer and True, or None and False when a limit
+        stopped the run. Content of a step that still calls tools is the model's reasoning,
+        not an answer, so it is never returned.
+        """
+        from langchain_core.messages import AIMessage
+        from langgraph.errors import GraphRecursionError
+
+        steps = 0
+        with agent_budget.run() as budget:
+            config = {"recursion_limit": budget.recursion_limit()}
+            if guest_memory.AGENT_MEMORY_ENABLED:
+                config.update(guest_memory.thread_config(self.thread_id))
+            try:
+                for state in self.agent_executor.stream({"messages": [("user", message)]}, config, stream_mode="values"):
+                    last_message = state["messages"][-1]
+                    if isinstance(last_message, AIMessage):
+                        if (not last_message.tool_calls and isinstance(last_message.content, str)
+                                and last_message.content.strip()):
+                            logger.debug("Agent messages: %s", state["messages"])
+                            return last_message.content, True
+                        steps += 1
+                        # stop before running the tools of a step that can't be followed by another
+                        if steps >= budget.max_steps:
+                            budget.mark_exhausted("steps")
+                            break
+                    if budget.expired():
+                        budget.mark_exhausted("deadline")
+                        break
+            except GraphRecursionError:
+                budget.mark_exhausted("steps")
+            except agent_budget.DeadlineExceeded:
+                pass
+        logger.warning("Agent stopped by its %s budget after %.1fs", ", ".join(sorted(budget.exhausted)),
+                       AGENT_DEADLINE - budget.remaining(), extra={"event": "agent.budget_exhausted"})
+        return None, False
 
     def assure_guest(self, response_json):
         """
@@ -105,27 +198,25 @@ class RoutingAgent:
                 )
 
                 # Log the prompt before invoking the model
-                logger.info("Invoking LLM with prompt: %s", prompt)
-
-                # Start the timer to log how long the invocation takes
-                start_time = time.time()
+                logger.debug("Invoking LLM with prompt: %s", prompt)
 
                 try:
-                    # Invoke LLM to generate the response
-                    response = llm.invoke([{"role": "user", "content": prompt}, {"role": "system", "content": "Please limit your response to 3 sentences or fewer."}])
-
-                    # Log how long the invocation took
-                    end_time = time.time()
-                    logger.info("LLM invocation took %.2f seconds", end_time - start_time)
+                    # Invoke LLM to generate the response; timed as the ack_llm stage
+                    with metrics.timed("ack_llm"), llm_gateway.priority(llm_gateway.ACK):
+                        response = get_llm().invoke([{"role": "user", "content": prompt}, {"role": "system", "content": "Please limit your response to 3 sentences or fewer."}])
 
+                except llm_gateway.LLMOverloaded:
+                    # shed: the templated acknowledgement says the same without waiting for a slot
+                    logger.warning("LLM queue over budget, sending the templated acknowledgement", extra={"event": "llm.shed"})
+                    return self._template_acknowledgement(response_json)
                 except Exception as e:
                     # Log any errors that occur during LLM invocation
-                    end_time = time.time()
                     logger.error("Error during LLM invocation: %s", str(e), exc_info=True)
-                    return "Sorry, there was an issue generating a response. Please try again later."
+                    # the task itself went through, so acknowledge it without the LLM
+                    return self._template_acknowledgement(response_json)
 
                 # Log the response
-                logger.info("LLM response: %s", response)
+                logger.debug("LLM response: %s", response)
 
                 # Return the content generated by the LLM
                 guest_response = response.get("content") if hasattr(response, "get") else response.content
@@ -133,12 +224,12 @@ class RoutingAgent:
 
             else:
                 # Log a warning if the structure is unexpected
-                logging.warning(f"Unexpected JSON structure: {response_json}")
+                logger.warning("Unexpected JSON structure: %s", response_json)
                 return "We are processing your request. Please contact us if you need further assistance."
 
         except Exception as e:
             # Log any unexpected errors
-            logging.error(f"An unexpected error occurred in assure_guest: {str(e)}", exc_info=True)
+            logger.error("An unexpected error occurred in assure_guest: %s", e, exc_info=True)
             return (
                 f"Thank you for reaching out, {self.user.first_name}. "
                 f"We are reviewing your request and will get back to you shortly. "
@@ -146,33 +237,13 @@ class RoutingAgent:
             )
        
 
-    def _prepare_task_json(self, message):
+    def _prepare_task_json(self, message, department=None):
         """
         Prepares a JSON object for task requests based on the user message.
         """
-        # TODO: use alg for better department mapping based on message content
-        # Basic example of department mapping based on keywords
-        department_mapping = {
-            "towels": "Housekeeping",
-            "cleaning": "Housekeeping",
-            "room service": "Room Service",
-            "food": "Room Service",
-            "technical issue": "Maintenance",
-            "light": "Maintenance",
-            "leak": "Maintenance",
-            "heat": "Maintenance",
-            "air conditioning": "Maintenance",
-        }
-
-        # Determine department from message
-        department = None
-        for keyword, dept in department_mapping.items():
-            if keyword in message.lower():
-                department = dept
-                break
-
+        # Department comes from the taxonomy classifier ("general" if no department keyword matched)
         if not department:
-            department = "general"  # Fallback if no department is matched
+            department = get_intent_classifier().classify(message).department
 
         # Prepare task JSON
         task_json = {
@@ -182,17 +253,89 @@ class RoutingAgent:
             "request": message
         }
 
-        print("Task JSON prepared: ", task_json)        
-        # send guest a message letting them know their task has been received.
-        reply_task_message = self.assure_guest(task_json)
-        print('sending the shiat to fabis portal...')
-        # uncomment to send to admin portal after its running locally
-        response = requests.post("http://127.0.0.1:5000/api/tasks", json=task_json)
-        print("Task sent to admin portal")
-        print('Response from sending task:', response)
-        task_data = response.json()
-        task_id = task_data.get('id')
-        return reply_task_message + f'\n\n You can track your request status at this link: http://127.0.0.1:5000/view-task/{task_id}.'
-    
-
-    
\ No newline at end of file
+        logger.info("Task prepared for %s", department, extra={"event": "task.prepared"})
+        logger.debug("Task JSON: %s", task_json)
+        started_at = time.monotonic()
+        # the acknowledgement runs in a copy of this context so its stage lands in the message's trace
+        ack_future = _task_pool.submit(contextvars.copy_context().run, self.assure_guest, task_json)
+        # the task only goes into the local spool here; it reaches the portal in the background
+        local_id = self._spool_task(task_json)
+
+        reply_task_message = self._await_branch(ack_future, started_at + TASK_ACK_DEADLINE, "acknowledgement")
+        if reply_task_message is None:
+            reply_task_message = self._template_acknowledgement(task_json)
+        logger.info("Task path took %.2f seconds", time.monotonic() - started_at)
+
+        if local_id is None:
+            return reply_task_message
+        return reply_task_message + '\n\n ' + tracking_text(local_id)
+
+    def _spool_task(self, task_json):
+        """
+        Hands the task to the task dispatcher and returns its tracking id, or None if it
+        couldn't be stored.
+        """
+        try:
+            return submit_task(task_json)
+        except Exception as e:
+            logger.error("Could not queue task for the admin portal: %s", e, exc_info=True)
+            return None
+
+    @staticmethod
+    def _await_branch(future, deadline, name):
+        """
+        Waits for a pooled branch until the monotonic deadline. Returns None if it missed
+        the deadline or failed; a late branch keeps running and its result is dropped.
+        """
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            logger.warning("Task %s missed its deadline", name)
+        except Exception as e:
+            logger.error("Task %s failed: %s", name, e, exc_info=True)
+        return None
+
+    def _template_acknowledgement(self, task_json):
+        """
+        Acknowledgement sent when the LLM doesn't answer within TASK_ACK_DEADLINE, or
+        the LLM gateway sheds the call.
+        """
+        return (
+            f"Thank you, {self.user.first_name}. Your request has been passed to our {task_json['department']} team, "
+            f"who are already working on it. Please let us know if there is anything else we can do for you."
+        )
+
+    def _out_of_time_reply(self, first_name):
+        """
+        Reply to a search question when the agent ran out of budget without an answer.
+        """
+        return (
+            f"I'm sorry, {first_name}, I couldn't find that for you just now. "
+            f"Please contact the front desk and our team will be happy to help."
+        )
+
+    def _busy_reply(self, first_name):
+        """
+        Reply to a search question when the LLM gateway sheds it.
+        """
+        return (
+            f"I'm sorry, {first_name}, we're answering a lot of questions right now. "
+            f"Please ask again in a few minutes, or contact the front desk if it's urgent."
+        )
+
+
+def get_routing_agent(user: User) -> RoutingAgent:
+    """
+    The guest's RoutingAgent, reused while they keep messaging; rebuilt when their guest
+    record changes (e.g. a room move).
+    """
+    agent = _sessions.get(user.phone)
+    if agent is None or agent.user != user:
+        agent = RoutingAgent(user)
+    # set on every message, so the TTL counts from the guest's last message
+    _sessions.set(user.phone, agent)
+    return agent
+
+
+def session_stats() -> dict:
+    return _sessions.stats()
@@ -0,0 +1,117 @@
+"""
+Tools for the ReAct agent: the local hotel knowledge base first, then Tavily web search
+with results cached by normalized query.
+"""
+import os
+import re
+import logging
+import threading
+
+from dotenv import load_dotenv
+
+from app.domain.agents import agent_budget
+from app.domain.agents.knowledge_base import HOTEL_KB_ENABLED, get_knowledge_base
+from app.utils import metrics
+from app.utils.cache_utils import TTLCache
+from app.utils.http_utils import HTTP_READ_TIMEOUT, get_client
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+TAVILY_API_KEY = os.getenv("TAVILY_API_KEY")
+TAVILY_API_URL = os.getenv("TAVILY_API_URL", "https://api.tavily.com").rstrip("/")
+TAVILY_MAX_RESULTS = int(os.getenv("TAVILY_MAX_RESULTS", "2"))
+TAVILY_CACHE_TTL = float(os.getenv("TAVILY_CACHE_TTL", "3600"))
+TAVILY_CACHE_MAX_ENTRIES = int(os.getenv("TAVILY_CACHE_MAX_ENTRIES", "1000"))
+
+_search_cache = TTLCache(max_entries=TAVILY_CACHE_MAX_ENTRIES, ttl=TAVILY_CACHE_TTL)
+_NON_WORD = re.compile(r"[^\w\s]")
+_WHITESPACE = re.compile(r"\s+")
+
+_tool_calls: dict[str, int] = {}
+_tool_calls_lock = threading.Lock()
+
+
+def _record_tool_call(name: str):
+    with _tool_calls_lock:
+        _tool_calls[name] = _tool_calls.get(name, 0) + 1
+
+
+class WebSearchBudgetExhausted(Exception):
+    '''The current agent run has used its Tavily calls, or its deadline has passed.'''
+
+
+def normalize_query(query: str) -> str:
+    return _WHITESPACE.sub(" ", _NON_WORD.sub(" ", query.lower())).strip()
+
+
+def tavily_search(query: str) -> list[dict]:
+    """Tavily search, served from the TTL cache when the same normalized query was asked recently."""
+    key = normalize_query(query)
+    cached = _search_cache.get(key)
+    if cached is not None:
+        return cached
+    # only calls that reach Tavily count against the run's budget
+    budget = agent_budget.current()
+    if budget is not None and not budget.take_web_search():
+        raise WebSearchBudgetExhausted()
+    url = f"{TAVILY_API_URL}/search"
+    client = get_client(url)
+    # a search may not outlast the run's deadline
+    timeout = client.timeout if budget is None else min(HTTP_READ_TIMEOUT, budget.remaining())
+    with metrics.timed("tavily"):
+        response = client.post(
+            url, json={"api_key": TAVILY_API_KEY, "query": query, "max_results": TAVILY_MAX_RESULTS},
+            timeout=timeout,
+        )
+    response.raise_for_status()
+    results = [
+        {"url": result.get("url"), "content": result.get("content")}
+        for result in response.json().get("results", [])
+    ]
+    _search_cache.set(key, results)
+    return results
+
+
+def build_tools(include_knowledge_base: bool = HOTEL_KB_ENABLED) -> list:
+    """Tools in the order the agent should reach for them."""
+    from langchain_core.tools import tool
+
+    @tool
+    def hotel_knowledge_base(query: str) -> str:
+        """Look up facts about the hotel itself: amenities, opening hours, dining, policies and services.
+        Always try this first for any question about the hotel."""
+        _record_tool_call("hotel_knowledge_base")
+        try:
+            passages = get_knowledge_base().search(query)
+        except Exception as e:
+            logger.error("Knowledge base search failed: %s", e, exc_info=True)
+            return "The hotel knowledge base is unavailable."
+        if not passages:
+            return "No matching entry in the hotel knowledge base."
+        return "\n\n".join(passage["text"] for passage in passages)
+
+    @tool
+    def web_search(query: str) -> list[dict] | str:
+        """Search the web for current information that is not about the hotel itself, such as weather,
+        lift and gondola status, local events or restaurants. Use only if the hotel knowledge base has no answer."""
+        _record_tool_call("web_search")
+        try:
+            return tavily_search(query)
+        except WebSearchBudgetExhausted:
+            return "No more web searches are available for this question. Answer with what you have found so far."
+        except Exception as e:
+            logger.error("Tavily search failed: %s", e, exc_info=True)
+            return f"Web search failed: {str(e)}"
+
+    tools = [web_search]
+    if include_knowledge_base:
+        tools.insert(0, hotel_knowledge_base)
+    return tools
+
+
+def tool_stats() -> dict:
+    with _tool_calls_lock:
+        calls = dict(_tool_calls)
+    return {"calls": calls, "tavily_cache": _search_cache.stats()}
@@ -0,0 +1,112 @@
+import os
+import logging
+import threading
+import time
+
+from app.utils import sqlite_utils
+from app.utils.cache_utils import TTLCache
+
+logger = logging.getLogger(__name__)
+
+# Meta redelivers a webhook until it gets a 200, so remember message ids long enough
+# to cover its retry window.
+DEDUPE_BACKEND = os.getenv("DEDUPE_BACKEND", "memory")
+DEDUPE_TTL = float(os.getenv("DEDUPE_TTL", str(24 * 3600)))
+DEDUPE_MAX_ENTRIES = int(os.getenv("DEDUPE_MAX_ENTRIES", "100000"))
+DEDUPE_SQLITE_PATH = os.getenv("DEDUPE_SQLITE_PATH") or sqlite_utils.data_path("dedupe.sqlite3")
+
+# purge expired rows from SQLite once every this many inserts
+_PURGE_EVERY = 1000
+
+
+class MemoryDedupeStore:
+    '''Remembers recently seen WhatsApp message ids in a TTL + LRU cache.'''
+    def __init__(self, max_entries: int = DEDUPE_MAX_ENTRIES, ttl: float = DEDUPE_TTL):
+        self._seen = TTLCache(max_entries=max_entries, ttl=ttl)
+
+    def check_and_mark(self, message_id: str) -> bool:
+        """Returns True if message_id was already seen, otherwise records it and returns False."""
+        return not self._seen.add(message_id)
+
+    def forget(self, message_id: str):
+        """Drops message_id so a redelivery is processed again (e.g. after we answered 503)."""
+        self._seen.pop(message_id)
+
+    def stats(self) -> dict:
+        return {"backend": "memory", **self._seen.stats()}
+
+
+class SQLiteDedupeStore:
+    '''Same contract as MemoryDedupeStore, persisted in SQLite so it survives restarts and
+    is shared by every uvicorn worker pointed at the same file.'''
+    def __init__(self, path: str = DEDUPE_SQLITE_PATH, max_entries: int = DEDUPE_MAX_ENTRIES, ttl: float = DEDUPE_TTL):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite_utils.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS seen_messages (id TEXT PRIMARY KEY, expires_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS seen_messages_expires ON seen_messages (expires_at)")
+        self._inserts = 0
+        self.hits = 0
+        self.misses = 0
+
+    def check_and_mark(self, message_id: str) -> bool:
+        now = time.time()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM seen_messages WHERE id = ? AND expires_at <= ?", (message_id, now))
+                inserted = self._conn.execute(
+                    "INSERT OR IGNORE INTO seen_messages (id, expires_at) VALUES (?, ?)",
+                    (message_id, now + self.ttl),
+                ).rowcount
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            if not inserted:
+                self.hits += 1
+                return True
+            self.misses += 1
+            self._inserts += 1
+            if self._inserts % _PURGE_EVERY == 0:
+                self._purge(now)
+            return False
+
+    def _purge(self, now: float):
+        self._conn.execute("DELETE FROM seen_messages WHERE expires_at <= ?", (now,))
+        # keep the table bounded: drop the rows closest to expiry beyond max_entries
+        self._conn.execute(
+            "DELETE FROM seen_messages WHERE id IN ("
+            "SELECT id FROM seen_messages ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        )
+
+    def forget(self, message_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM seen_messages WHERE id = ?", (message_id,))
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM seen_messages").fetchone()[0]
+            total = self.hits + self.misses
+            return {
+                "backend": "sqlite",
+                "size": size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            }
+
+
+def create_dedupe_store():
+    if DEDUPE_BACKEND == "sqlite":
+        logger.info("Using SQLite dedupe store at %s", DEDUPE_SQLITE_PATH)
+        return SQLiteDedupeStore()
+    if DEDUPE_BACKEND != "memory":
+        logger.warning("Unknown DEDUPE_BACKEND %r, falling back to memory", DEDUPE_BACKEND)
+    return MemoryDedupeStore()
@@ -0,0 +1,266 @@
+import contextvars
+import logging
+import queue
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Callable
+
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# number of recent wait-time samples kept for percentile stats
+WAIT_SAMPLE_SIZE = 1024
+
+_STOP = object()
+
+
+class DispatchQueueFull(Exception):
+    '''Raised when the worker shard for a guest has no room left for another job.'''
+
+
+class JobHold:
+    '''Keeps a guest's job back for hold seconds after their latest message, so messages
+    that arrive in later webhooks (one thought typed as several messages) join it and get
+    one answer. The first argument of a held job must be a list: a job submitted for a key
+    that is already held is merged into it by extending that list, and its other arguments
+    replace the held ones. A job is held at most max_hold seconds after its first message.
+    release(key, fn, args, context, held_for) is called on the hold thread when the hold ends.'''
+    def __init__(self, release: Callable, hold: float, max_hold: float, name: str = "dispatch"):
+        self.hold = hold
+        self.max_hold = max_hold
+        self.name = name
+        self.merged = 0
+        self._release = release
+        self._jobs: dict[str, dict] = {}
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._cond:
+            if self._thread:
+                return
+            self._thread = threading.Thread(target=self._run, name=f"{self.name}-hold", daemon=True)
+            self._thread.start()
+
+    def submit(self, key: str, fn: Callable[..., Any], args: tuple, has_room: Callable[[list[str]], bool]) -> bool:
+        """
+        Merges the job into the one held for key, or holds it as a new job if
+        has_room(held_keys) says its shard can take one more. Returns False if it could not.
+        """
+        now = time.monotonic()
+        with self._cond:
+            job = self._jobs.get(key)
+            if job is not None and job["fn"] is fn:
+                job["args"] = (job["args"][0] + list(args[0]), *args[1:])
+                job["release_at"] = min(job["held_at"] + self.max_hold, now + self.hold)
+                self.merged += 1
+                return True
+            if job is not None or not has_room(list(self._jobs)):
+                return False
+            self._jobs[key] = {
+                "fn": fn, "args": (list(args[0]), *args[1:]), "context": contextvars.copy_context(),
+                "held_at": now, "release_at": now + self.hold,
+            }
+            self._cond.notify()
+            return True
+
+    def flush(self):
+        """Releases every held job now (at shutdown) and stops the hold thread."""
+        with self._cond:
+            jobs, self._jobs = self._jobs, {}
+            thread, self._thread = self._thread, None
+            self._cond.notify_all()
+        for key, job in jobs.items():
+            self._release(key, job["fn"], job["args"], job["context"], time.monotonic() - job["held_at"])
+        if thread:
+            thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._thread is None:
+                    return
+                now = time.monotonic()
+                due = [key for key, job in self._jobs.items() if job["release_at"] <= now]
+                if not due:
+                    upcoming = min((job["release_at"] for job in self._jobs.values()), default=now + 1.0)
+                    self._cond.wait(upcoming - now)
+                    continue
+                jobs = [(key, self._jobs.pop(key)) for key in due]
+            for key, job in jobs:
+                try:
+                    self._release(key, job["fn"], job["args"], job["context"], time.monotonic() - job["held_at"])
+                except Exception as e:
+                    logger.error("Could not release held job for %s: %s", key, e, exc_info=True)
+
+
+class MessageDispatcher:
+    '''Fixed pool of worker threads, each draining its own bounded queue.
+    Jobs are sharded by a key (the guest's phone number) so one guest's messages are
+    handled in order, while messages from different guests run in parallel. A job runs
+    in a copy of the submitter's context, so contextvars such as the active trace follow it.
+    With hold set, jobs submitted with merge=True wait in a JobHold first.'''
+    def __init__(
+        self,
+        num_workers: int = 8,
+        queue_size: int = 100,
+        name: str = "dispatch",
+        hold: float = 0.0,
+        max_hold: float = 10.0,
+    ):
+        if num_workers < 1:
+            raise ValueError("num_workers must be at least 1")
+        self.num_workers = num_workers
+        self.queue_size = queue_size
+        self.name = name
+        self._queues = [queue.Queue(maxsize=queue_size) for _ in range(num_workers)]
+        self._hold = JobHold(self._release_held, hold, max_hold, name) if hold > 0 else None
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        self._accepting = False
+        self._waits = deque(maxlen=WAIT_SAMPLE_SIZE)
+        self._submitted = 0
+        self._rejected = 0
+        self._completed = 0
+        self._failed = 0
+        self._max_wait = 0.0
+
+    def start(self):
+        with self._lock:
+            if self._threads:
+                return
+            for index, jobs in enumerate(self._queues):
+                thread = threading.Thread(
+                    target=self._run_worker,
+                    args=(jobs,),
+                    name=f"{self.name}-worker-{index}",
+                )
+                thread.start()
+                self._threads.append(thread)
+            if self._hold:
+                self._hold.start()
+            self._accepting = True
+        logger.info("Started %d dispatch workers (queue size %d each)", self.num_workers, self.queue_size)
+
+    def shard_for(self, key: str) -> int:
+        """
+        Maps a key to a worker index. crc32 is used instead of hash() so the mapping is
+        stable across processes and restarts.
+        """
+        return zlib.crc32(key.encode("utf-8")) % self.num_workers
+
+    def submit(self, key: str, fn: Callable[..., Any], *args: Any, merge: bool = False):
+        """
+        Queues fn(*args) on the worker that owns key. Raises DispatchQueueFull if that
+        worker's queue is full or the dispatcher is not accepting work. With merge set
+        (and a hold configured), the job is held and merged with the key's later jobs.
+        """
+        if not self._accepting:
+            with self._lock:
+                self._rejected += 1
+            raise DispatchQueueFull("Dispatcher is not accepting new work")
+        if merge and self._hold:
+            self._submit_held(key, fn, args)
+            return
+        try:
+            self._queues[self.shard_for(key)].put_nowait((time.monotonic(), contextvars.copy_context(), fn, args))
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise DispatchQueueFull(f"Dispatch queue for shard {self.shard_for(key)} is full") from None
+        with self._lock:
+            self._submitted += 1
+
+    def _submit_held(self, key: str, fn: Callable[..., Any], args: tuple):
+        shard = self.shard_for(key)
+
+        def has_room(held_keys: list[str]) -> bool:
+            # held jobs count against their shard, so releasing one never finds the queue full
+            held = sum(1 for held_key in held_keys if self.shard_for(held_key) == shard)
+            return self._queues[shard].qsize() + held < self.queue_size
+
+        held = self._hold.submit(key, fn, args, has_room)
+        with self._lock:
+            if not held:
+                self._rejected += 1
+                raise DispatchQueueFull(f"Dispatch queue for shard {shard} is full")
+            self._submitted += 1
+
+    def _release_held(self, key: str, fn: Callable[..., Any], args: tuple, context, held_for: float):
+        context.run(metrics.observe, "merge_hold", held_for)
+        self._queues[self.shard_for(key)].put((time.monotonic(), context, fn, args))
+
+    def _run_worker(self, jobs: queue.Queue):
+        while True:
+            item = jobs.get()
+            if item is _STOP:
+                jobs.task_done()
+                return
+            enqueued_at, context, fn, args = item
+            waited = time.monotonic() - enqueued_at
+            with self._lock:
+                self._waits.append(waited)
+                self._max_wait = max(self._max_wait, waited)
+            try:
+                context.run(metrics.observe, "dispatch_wait", waited)
+                context.run(fn, *args)
+                with self._lock:
+                    self._completed += 1
+            except Exception as e:
+                with self._lock:
+                    self._failed += 1
+                logger.error("Dispatch job failed: %s", e, exc_info=True)
+            finally:
+                jobs.task_done()
+
+    def stats(self) -> dict:
+        depths = [jobs.qsize() for jobs in self._queues]
+        with self._lock:
+            waits = sorted(self._waits)
+            stats = {
+                "workers": self.num_workers,
+                "queue_size": self.queue_size,
+                "queue_depth": sum(depths),
+                "max_shard_depth": max(depths),
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "completed": self._completed,
+                "failed": self._failed,
+                "merged": self._hold.merged if self._hold else 0,
+                "max_wait_seconds": round(self._max_wait, 4),
+            }
+        if waits:
+            stats["avg_wait_seconds"] = round(sum(waits) / len(waits), 4)
+            stats["p95_wait_seconds"] = round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 4)
+        return stats
+
+    def shutdown(self, timeout: float = 30.0):
+        """
+        Stops accepting work, lets every worker finish what is already queued and
+        waits up to timeout seconds for them to exit.
+        """
+        with self._lock:
+            self._accepting = False
+            threads = list(self._threads)
+            self._threads = []
+        if not threads:
+            return
+        if self._hold:
+            # ahead of the stop signals, so held jobs are answered too
+            self._hold.flush()
+        deadline = time.monotonic() + timeout
+        for jobs in self._queues:
+            try:
+                jobs.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.warning("Could not signal a dispatch worker to stop; queue still full")
+        for thread in threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+        pending = sum(jobs.qsize() for jobs in self._queues)
+        if pending:
+            logger.warning("Dispatcher shut down with %d jobs still queued", pending)
+        else:
+            logger.info("Dispatcher drained and stopped")
@@ -0,0 +1,189 @@
+import os
+import csv
+import re
+import sqlite3
+import logging
+import threading
+
+from app.schema import User
+
+logger = logging.getLogger(__name__)
+
+# CSV or SQLite export from the property-management system
+GUEST_DIRECTORY_PATH = os.getenv("GUEST_DIRECTORY_PATH", "data/guests.csv")
+GUEST_DIRECTORY_TABLE = os.getenv("GUEST_DIRECTORY_TABLE", "guests")
+GUEST_DIRECTORY_POLL_SECONDS = float(os.getenv("GUEST_DIRECTORY_POLL_SECONDS", "5"))
+# country code assumed for PMS numbers without one (e.g. 10-digit US numbers)
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "1")
+
+GUEST_FIELDS = ("id", "phone", "first_name", "last_name", "role", "room_number")
+
+_NON_DIGITS = re.compile(r"\D")
+
+
+def normalize_phone(raw: str, default_country_code: str = DEFAULT_COUNTRY_CODE) -> str | None:
+    """
+    Normalizes a phone number from the PMS export to E.164 ("+17818163706"). Exports
+    often include spaces, dashes or a 00 prefix, and 10-digit numbers without a plus
+    are taken as national numbers in default_country_code. Returns None if the input
+    can't be a phone number.
+    """
+    if not raw:
+        return None
+    raw = raw.strip()
+    digits = _NON_DIGITS.sub("", raw)
+    if raw.startswith("00"):
+        digits = digits[2:]
+    elif not raw.startswith("+") and len(digits) == 10 and default_country_code:
+        digits = default_country_code + digits
+    if not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+
+def normalize_whatsapp_id(raw: str) -> str | None:
+    """
+    Normalizes a WhatsApp "from" id to E.164. These always start with the country code
+    (without the plus), so no national-number rule applies: "6591234567" is Singapore.
+    """
+    digits = _NON_DIGITS.sub("", raw or "")
+    if not 8 <= len(digits) <= 15:
+        return None
+    return "+" + digits
+
+
+def _read_csv(path: str) -> list[dict]:
+    with open(path, newline="") as f:
+        return list(csv.DictReader(f))
+
+
+def _read_sqlite(path: str, table: str) -> list[dict]:
+    conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        conn.row_factory = sqlite3.Row
+        rows = conn.execute(f'SELECT {", ".join(GUEST_FIELDS)} FROM "{table}"').fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+
+def _row_key(row: dict) -> tuple:
+    return tuple(str(row.get(field) or "").strip() for field in GUEST_FIELDS)
+
+
+class GuestDirectory:
+    '''In-memory index of in-house guests keyed by E.164 phone number.
+    Loaded from a CSV or SQLite PMS export and reloaded incrementally when the file
+    changes: unchanged guests keep their (immutable) User instance, so lookups are a
+    single dict read.'''
+    def __init__(self, path: str = GUEST_DIRECTORY_PATH, table: str = GUEST_DIRECTORY_TABLE):
+        self.path = path
+        self.table = table
+        self._by_phone: dict[str, User] = {}
+        self._row_keys: dict[str, tuple] = {}
+        self._mtime = None
+        self._reload_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+        self.reload()
+
+    def lookup(self, phone_number: str) -> User | None:
+        phone = normalize_whatsapp_id(phone_number)
+        return self._by_phone.get(phone) if phone else None
+
+    def __len__(self) -> int:
+        return len(self._by_phone)
+
+    def _read_rows(self) -> list[dict]:
+        if self.path.endswith((".sqlite", ".sqlite3", ".db")):
+            return _read_sqlite(self.path, self.table)
+        return _read_csv(self.path)
+
+    def reload(self, force: bool = False) -> bool:
+        """Re-reads the export if its mtime changed (or force is set). Returns True if it was re-read."""
+        with self._reload_lock:
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except FileNotFoundError:
+                if self._mtime is not None or not self._by_phone:
+                    logger.warning("Guest directory %s not found; no guests can be authenticated", self.path)
+                self._mtime = None
+                return False
+            if mtime == self._mtime and not force:
+                return False
+            try:
+                rows = self._read_rows()
+            except Exception as e:
+                logger.error("Failed to read guest directory %s: %s", self.path, e, exc_info=True)
+                return False
+
+            by_phone, row_keys = {}, {}
+            added = changed = 0
+            for row in rows:
+                phone = normalize_phone(str(row.get("phone") or ""))
+                if not phone:
+                    logger.warning("Skipping guest with invalid phone number: %r", row.get("phone"))
+                    continue
+                key = _row_key(row)
+                if self._row_keys.get(phone) == key:
+                    by_phone[phone] = self._by_phone[phone]
+                    row_keys[phone] = key
+                    continue
+                try:
+                    user = User(
+                        id=int(row["id"]),
+                        phone=phone,
+                        first_name=row["first_name"],
+                        last_name=row["last_name"],
+                        role=row.get("role") or "default",
+                        room_number=str(row["room_number"]) if row.get("room_number") not in (None, "") else None,
+                    )
+                except (KeyError, TypeError, ValueError) as e:
+                    # one bad row in the export must not keep every other guest out
+                    logger.warning("Skipping invalid guest row for %s: %s", phone, e)
+                    continue
+                if phone in self._row_keys:
+                    changed += 1
+                else:
+                    added += 1
+                by_phone[phone] = user
+                row_keys[phone] = key
+            removed = len(set(self._by_phone) - set(by_phone))
+            self._by_phone, self._row_keys, self._mtime = by_phone, row_keys, mtime
+            logger.info("Guest directory loaded: %d guests (%d added, %d changed, %d removed)",
+                        len(by_phone), added, changed, removed)
+            return True
+
+    def start_watching(self, interval: float = GUEST_DIRECTORY_POLL_SECONDS):
+        if self._watcher:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="guest-directory-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher:
+            self._watcher.join()
+            self._watcher = None
+
+    def _watch(self, interval: float):
+        while not self._stop.wait(interval):
+            try:
+                self.reload()
+            except Exception as e:
+                # keep watching; the next change to the export may fix it
+                logger.error("Failed to reload guest directory %s: %s", self.path, e, exc_info=True)
+
+
+_directory = None
+_directory_lock = threading.Lock()
+
+
+def get_guest_directory() -> GuestDirectory:
+    global _directory
+    if _directory is None:
+        with _directory_lock:
+            if _directory is None:
+                _directory = GuestDirectory()
+    return _directory
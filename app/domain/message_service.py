@@ -1,14 +1,19 @@
+import io
 import os  
 import json  
-import requests  
+import time
 import logging
-from typing import BinaryIO
+import threading
+from concurrent.futures import Future
+from typing import BinaryIO, Callable
 from dotenv import load_dotenv
-from openai import OpenAI 
-from app.domain.agents.routing_agent import RoutingAgent  
-from app.schema import User, Audio 
-
-logging.basicConfig(level=logging.INFO)
+from app.domain.agents.routing_agent import get_routing_agent  
+from app.domain.guest_directory import get_guest_directory
+from app.domain.outbox_service import OUTBOX_ENABLED, Outbox, SendResult
+from app.schema import User, Audio, Message 
+from app.utils.cache_utils import TTLCache
+from app.utils import metrics
+from app.utils.http_utils import get_client
 
 logger = logging.getLogger(__name__)
 
@@ -16,37 +21,71 @@ load_dotenv()
 
 WHATSAPP_API_KEY = os.getenv("WHATSAPP_API_KEY")
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+GRAPH_API_URL = os.getenv("GRAPH_API_URL", "https://graph.facebook.com/v21.0").rstrip("/")
+WHATSAPP_PHONE_NUMBER_ID = os.getenv("WHATSAPP_PHONE_NUMBER_ID", "504587716075008")
+MEDIA_URL_CACHE_TTL = float(os.getenv("MEDIA_URL_CACHE_TTL", "240"))
+TRANSCRIPT_CACHE_TTL = float(os.getenv("TRANSCRIPT_CACHE_TTL", str(7 * 24 * 3600)))
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv("TRANSCRIPT_CACHE_MAX_ENTRIES", "5000"))
+
+_openai_client = None
+
+_openai_client_lock = threading.Lock()
+
+# Whisper client, created on first voice note so boot doesn't need OPENAI_API_KEY
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        with _openai_client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key= OPENAI_API_KEY)
+    return _openai_client
+
+# Graph media URLs expire after about five minutes, so a looked-up URL is reused for a bit less
+_media_url_cache = TTLCache(max_entries=1000, ttl=MEDIA_URL_CACHE_TTL)
+# forwarded or repeated voice notes carry the same sha256, so they are only transcribed once
+_transcript_cache = TTLCache(max_entries=TRANSCRIPT_CACHE_MAX_ENTRIES, ttl=TRANSCRIPT_CACHE_TTL)
+_transcripts_in_flight: dict[str, Future] = {}
+_transcripts_lock = threading.Lock()
+
+_outbox = None
+_reply_sink = None
 
-llm = OpenAI(api_key= OPENAI_API_KEY)
+# Voice notes are fetched and transcribed on the guest's worker (respond_to_messages), not
+# before the webhook is acknowledged, so a slow Graph API or Whisper can't delay the 200.
 
-# for voice notes (get download URL and download to file system)
-def download_file_from_facebook(file_id: str, file_type: str, mime_type: str) -> str | None:  
-    # First GET request to retrieve the download URL  
-    url = f"https://graph.facebook.com/v19.0/{file_id}"  
+# for voice notes and images (first hop: media id -> short-lived download URL)
+def get_media_url(media_id: str) -> str:
+    download_url = _media_url_cache.get(media_id)
+    if download_url:
+        return download_url
+    url = f"{GRAPH_API_URL}/{media_id}"  
     headers = {"Authorization": f"Bearer {WHATSAPP_API_KEY}"}  
-    response = requests.get(url, headers=headers)
-    if response.status_code == 200:  
-        download_url = response.json().get('url')  
-        # Second GET request to download the file  
-        response = requests.get(download_url, headers=headers)  
-        if response.status_code == 200:
-            # Extract file extension from mime_type    
-            file_extension = mime_type.split('/')[-1].split(';')[0]
-            # Create file_path with extension
-            file_path = f"{file_id}.{file_extension}"  
-            with open(file_path, 'wb') as file:  
-                file.write(response.content)  
-            if file_type == "image" or file_type == "audio":  
-                return file_path  
-        raise ValueError(f"Failed to download file. Status code: {response.status_code}")  
-    raise ValueError(f"Failed to retrieve download URL. Status code: {response.status_code}")
+    response = get_client(url).get(url, headers=headers)
+    if response.status_code != 200:
+        raise ValueError(f"Failed to retrieve download URL. Status code: {response.status_code}")
+    download_url = response.json().get('url')
+    _media_url_cache.set(media_id, download_url)
+    return download_url
+
+# second hop: stream the media into memory, nothing is written to disk
+def download_media(download_url: str) -> io.BytesIO:
+    headers = {"Authorization": f"Bearer {WHATSAPP_API_KEY}"}  
+    buffer = io.BytesIO()
+    with get_client(download_url).stream("GET", download_url, headers=headers) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Failed to download file. Status code: {response.status_code}")
+        for chunk in response.iter_bytes():
+            buffer.write(chunk)
+    buffer.seek(0)
+    return buffer
 
 # transcribe audio using whisper LLM
-def transcribe_audio_file(audio_file: BinaryIO) -> str:  
+def transcribe_audio_file(audio_file: BinaryIO | tuple) -> str:  
     if not audio_file:  
         return "No audio file provided"  
     try:  
-        transcription = llm.audio.transcriptions.create(  
+        transcription = get_openai_client().audio.transcriptions.create(  
             file=audio_file,  
             model="whisper-1",  
             response_format="text"  
@@ -55,42 +94,59 @@ def transcribe_audio_file(audio_file: BinaryIO) -> str:
     except Exception as e:  
         raise ValueError("Error transcribing audio") from e
 
-# transcribe audio using download and transcribe functions defined above
+def _download_and_transcribe(audio: Audio) -> str:
+    start_time = time.perf_counter()
+    download_url = get_media_url(audio.id)
+    looked_up = time.perf_counter()
+    buffer = download_media(download_url)
+    downloaded = time.perf_counter()
+    mime_type = audio.mime_type.split(';')[0].strip()
+    file_name = f"{audio.id}.{mime_type.split('/')[-1]}"
+    transcription = transcribe_audio_file((file_name, buffer, mime_type))
+    transcribed = time.perf_counter()
+    logger.info(
+        "Transcribed voice note %s (%d bytes): lookup %.3fs, download %.3fs, transcribe %.3fs",
+        audio.id, buffer.getbuffer().nbytes, looked_up - start_time, downloaded - looked_up, transcribed - downloaded,
+    )
+    return transcription
+
+# transcribe audio using the functions defined above, once per distinct recording
 def transcribe_audio(audio: Audio) -> str:  
-    file_path = download_file_from_facebook(audio.id, "audio", audio.mime_type)  
-    with open(file_path, 'rb') as audio_binary:  
-        transcription = transcribe_audio_file(audio_binary)  
-    try:  
-        os.remove(file_path)  
-    except Exception as e:  
-        print(f"Failed to delete file: {e}")  
+    transcription = _transcript_cache.get(audio.sha256)
+    if transcription is not None:
+        logger.info("Transcript cache hit for voice note %s", audio.id, extra={"event": "transcript.cache_hit"})
+        return transcription
+    # the same recording sent by two guests at once (e.g. forwarded) shares one transcription
+    with _transcripts_lock:
+        future = _transcripts_in_flight.get(audio.sha256)
+        owner = future is None
+        if owner:
+            future = _transcripts_in_flight[audio.sha256] = Future()
+    if owner:
+        try:
+            with metrics.timed("transcription"):
+                future.set_result(_download_and_transcribe(audio))
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with _transcripts_lock:
+                _transcripts_in_flight.pop(audio.sha256, None)
+    transcription = future.result()
+    _transcript_cache.set(audio.sha256, transcription)
     return transcription
 
 # authneticate user by phone number
 def authenticate_user_by_phone_number(phone_number: str) -> User | None:
-    logger.info(f"Attempting to authenticate user with phone number: {phone_number}")
-
-    allowed_users = [
-        {"id": 1, "phone": "17818163706", "first_name": "David", "last_name": "Dangond", "role": "default"},
-        {"id": 2, "phone": "+0987654321", "first_name": "test", "last_name": "test", "role": "default"}
-    ]
-
-    for user in allowed_users:
-        if user["phone"] == phone_number:
-            logger.info(f"User found: {user['first_name']} {user['last_name']}")
-            return User(**user)
+    user = get_guest_directory().lookup(phone_number)
+    if user:
+        logger.info("Authenticated guest %s", user.id, extra={"event": "auth.ok"})
+        return user
 
-    logger.warning(f"Authentication failed for phone number: {phone_number}")
+    logger.warning("Authentication failed for phone number: %s", phone_number)
     return None
 
-# Send or respond to a guest
-def send_whatsapp_message(to, message, template=False):
-    url = "https://graph.facebook.com/v21.0/504587716075008/messages"
-    headers = {
-        "Authorization": f"Bearer " + WHATSAPP_API_KEY,
-        "Content-Type": "application/json"
-    }
-
+# Build the Graph API body for a text reply or the hello_world template
+def build_message_payload(to, message, template=False) -> dict:
     if not template:
         data = {
             "messaging_product": "whatsapp",
@@ -114,39 +170,143 @@ def send_whatsapp_message(to, message, template=False):
                 }
             }
         }
+    return data
+
+# One Graph API send, as used by the outbox sender; never raises
+def post_whatsapp_payload(phone_number_id: str, data: dict) -> SendResult:
+    url = f"{GRAPH_API_URL}/{phone_number_id}/messages"
+    headers = {
+        "Authorization": f"Bearer {WHATSAPP_API_KEY}",
+        "Content-Type": "application/json"
+    }
+    try:
+        with metrics.timed("whatsapp_send"):
+            response = get_client(url).post(url, headers=headers, content=json.dumps(data))
+    except Exception as e:
+        return SendResult(None, error=str(e))
+    if response.status_code == 401:
+        logger.error("Authentication error: Please check your API key.")
+    logger.info("Sent WhatsApp message to %s: %s", data.get("to"), response.status_code,
+                extra={"event": "whatsapp.send"})
+    retry_after = response.headers.get("Retry-After")
+    return SendResult(
+        response.status_code,
+        retry_after=float(retry_after) if retry_after and retry_after.isdigit() else None,
+        error=None if response.is_success else f"HTTP {response.status_code}: {response.text[:200]}",
+    )
+
+# durable queue in front of the Graph API, started and stopped by the app lifespan
+def get_outbox() -> Outbox:
+    global _outbox
+    if _outbox is None:
+        _outbox = Outbox(send=post_whatsapp_payload)
+    return _outbox
+
+# Worker processes hand replies to the webhook process instead of sending them (see worker_pool)
+def use_reply_sink(sink: Callable[[str, str, bool], None] | None):
+    global _reply_sink
+    _reply_sink = sink
+
+# Send or respond to a guest. Replies go through the outbox unless OUTBOX_ENABLED=0
+def send_whatsapp_message(to, message, template=False):
+    if _reply_sink is not None:
+        _reply_sink(to, message, template)
+        return {"forwarded": True}
+    if OUTBOX_ENABLED:
+        row_id = get_outbox().enqueue(WHATSAPP_PHONE_NUMBER_ID, to, build_message_payload(to, message, template))
+        logger.info("Queued reply %d to %s", row_id, to, extra={"event": "whatsapp.queue"})
+        return {"queued": row_id}
+    return send_whatsapp_message_now(to, message, template)
+
+# Direct synchronous send, bypassing the outbox
+def send_whatsapp_message_now(to, message, template=False):
+    url = f"{GRAPH_API_URL}/{WHATSAPP_PHONE_NUMBER_ID}/messages"
+    headers = {
+        "Authorization": f"Bearer " + WHATSAPP_API_KEY,
+        "Content-Type": "application/json"
+    }
+    data = build_message_payload(to, message, template)
 
     try:
-        # Log the outgoing request details
-        logging.info(f"Sending POST request to {url} with headers: {headers} and data: {json.dumps(data, indent=2)}")
-        
-        # Send the POST request
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        
-        # Log the HTTP response status and body
-        logging.info(f"Response Status Code: {response.status_code}")
-        logging.info(f"Response Body: {response.text}")
+        # Send the POST request over the shared keep-alive pool
+        with metrics.timed("whatsapp_send"):
+            response = get_client(url).post(url, headers=headers, content=json.dumps(data))
+
+        # the payload and response body are only formatted when DEBUG is on
+        logger.info("Sent WhatsApp message to %s: %s", to, response.status_code, extra={"event": "whatsapp.send"})
+        logger.debug("WhatsApp payload %s, response %s", data, response.text)
         if response.status_code == 401:
-            logging.error("Authentication error: Please check your API key.")
-        
+            logger.error("Authentication error: Please check your API key.")
+
         # Parse and return the response JSON
         response_data = response.json()
         return response_data
     except Exception as e:
         # Log any exceptions that occur
-        logging.error(f"An error occurred: {str(e)}", exc_info=True)
+        logger.error("WhatsApp send to %s failed: %s", to, e, exc_info=True)
         return {"error": str(e)}
 
+# merge consecutive text fragments sent within window seconds of each other into one message
+def merge_text_fragments(fragments: list[tuple[Message, str]], window: float) -> list[str]:
+    merged = []
+    previous = None
+    for message, text in fragments:
+        timestamp = int(message.timestamp)
+        if (
+            previous is not None
+            and message.type == "text"
+            and previous.type == "text"
+            and timestamp - int(previous.timestamp) <= window
+        ):
+            merged[-1] = merged[-1] + "\n" + text
+        else:
+            merged.append(text)
+        previous = message
+    return merged
+
+# the text of a guest message, transcribing voice notes; None if there is nothing to answer
+def extract_text(message: Message) -> str | None:
+    if message.type == "audio" and message.audio:
+        return transcribe_audio(message.audio)
+    if message.text:
+        return message.text.body
+    return None
+
+# transcribe one guest's voice notes, merge text fragments, then answer them in order
+def respond_to_messages(messages: list[Message], user: User, window: float):
+    fragments = []
+    for message in messages:
+        try:
+            text = extract_text(message)
+        except Exception as e:
+            # the webhook was acknowledged long ago, so ask the guest instead of waiting for a redelivery
+            logger.error("Could not transcribe voice note %s from %s: %s", message.id, user.phone, e, exc_info=True)
+            send_whatsapp_message(user.phone, "Sorry, I couldn't make out your voice message. Could you type it instead?")
+            continue
+        if text:
+            fragments.append((message, text))
+    respond_and_send_messages(merge_text_fragments(fragments, window), user)
+
+# answer a batch of messages from one guest, in order
+def respond_and_send_messages(user_messages: list[str], user: User):
+    for user_message in user_messages:
+        try:
+            respond_and_send_message(user_message, user)
+        except Exception as e:
+            logger.error("Failed to respond to message from %s: %s", user.phone, e, exc_info=True)
+
 def respond_and_send_message(user_message: str, user: User):
     # if user is locked out, activate faceID:
     if user_message.lower() == ("I am locked out of my room. Can I have a new key?").lower():
         send_whatsapp_message(user.phone, "Sorry to hear that. Sure, please authenticate yourself using FaceID.")
         return
-    # Create an instance of RoutingAgent
-    agent = RoutingAgent(user)
+    # The guest's RoutingAgent, kept between messages
+    agent = get_routing_agent(user)
 
     # Process the user's message
     response = agent.process_message(user_message)
 
-    print('Got agent response: ', response)
+    logger.info("Replying to %s", user.phone, extra={"event": "agent.response"})
+    logger.debug("Agent response for %s: %s", user.phone, response)
 
     send_whatsapp_message(user.phone, response)
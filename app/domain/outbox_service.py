@@ -0,0 +1,380 @@
+import os
+import json
+import contextvars
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+from app.utils import metrics, sqlite_utils
+
+logger = logging.getLogger(__name__)
+
+# Outgoing WhatsApp replies are written here first and sent by a background sender, so a
+# reply survives a restart and a burst is paced to what the Graph API accepts.
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "1") != "0"
+OUTBOX_PATH = os.getenv("OUTBOX_PATH") or sqlite_utils.data_path("outbox.sqlite3")
+OUTBOX_SENDERS = int(os.getenv("OUTBOX_SENDERS", "4"))
+# token bucket per sending phone number id: sustained messages/second and burst size
+OUTBOX_RATE = float(os.getenv("OUTBOX_RATE", "20"))
+OUTBOX_BURST = int(os.getenv("OUTBOX_BURST", "40"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.getenv("OUTBOX_BACKOFF_BASE", "1"))
+OUTBOX_BACKOFF_MAX = float(os.getenv("OUTBOX_BACKOFF_MAX", "300"))
+# delivered and dead rows are kept this long for inspection
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", str(24 * 3600)))
+
+# WhatsApp rejects text bodies longer than this, so coalescing stops short of it
+MAX_TEXT_LENGTH = 4096
+# number of recent latency samples kept for percentile stats
+LATENCY_SAMPLE_SIZE = 1024
+_PURGE_EVERY = 1000
+# leading rows of one guest read per send; coalescing stops at MAX_TEXT_LENGTH well before this
+_COALESCE_ROWS = 64
+
+
+class SendResult:
+    '''What the Graph API made of one send: the HTTP status (None on a transport error),
+    Retry-After in seconds if it sent one, and an error description.'''
+    __slots__ = ("status", "retry_after", "error")
+
+    def __init__(self, status: int | None, retry_after: float | None = None, error: str | None = None):
+        self.status = status
+        self.retry_after = retry_after
+        self.error = error
+
+    @property
+    def ok(self) -> bool:
+        return self.status is not None and 200 <= self.status < 300
+
+    @property
+    def retryable(self) -> bool:
+        return self.status is None or self.status == 429 or self.status >= 500
+
+
+class TokenBucket:
+    '''Classic token bucket. take() returns 0 when a token was taken, otherwise the
+    seconds until one will be available.'''
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = float(capacity)
+        self._updated = time.monotonic()
+
+    def take(self) -> float:
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / self.rate
+
+
+def backoff_delay(attempts: int, base: float = OUTBOX_BACKOFF_BASE, cap: float = OUTBOX_BACKOFF_MAX) -> float:
+    """Exponential backoff with full jitter for the given number of failed attempts."""
+    return random.uniform(0, min(cap, base * 2 ** max(0, attempts - 1)))
+
+
+class Outbox:
+    '''Durable queue of outgoing messages in SQLite, drained by a scheduler thread that
+    hands sends to a small pool.
+
+    Messages to one guest go out in order: a guest with a send in flight or in backoff is
+    skipped until it finishes, and anything queued for that guest meanwhile is coalesced
+    into the next send. No pending row of a guest is due before the guest's oldest one, so
+    the scheduler only reads due rows, through an index, and only as many guests as there
+    are free senders. Delivery is at-least-once; a send interrupted by a crash is repeated
+    on the next start.
+
+    Several processes (uvicorn workers) may enqueue into one outbox file, but only the one
+    holding the lock file next to it sends; the others check once a second and take over
+    when it exits. So rows enqueued by another process go out within about a second.'''
+    def __init__(
+        self,
+        send: Callable[[str, dict], SendResult],
+        path: str = OUTBOX_PATH,
+        senders: int = OUTBOX_SENDERS,
+        rate: float = OUTBOX_RATE,
+        burst: int = OUTBOX_BURST,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.senders = senders
+        self.rate = rate
+        self.burst = burst
+        self.max_attempts = max_attempts
+        self._send = send
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._conn = sqlite_utils.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS outbox ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "phone_number_id TEXT NOT NULL, "
+            "recipient TEXT NOT NULL, "
+            "payload TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "enqueued_at REAL NOT NULL, "
+            "next_attempt_at REAL NOT NULL, "
+            "finished_at REAL, "
+            "last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_status ON outbox (status, id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS outbox_recipient ON outbox (phone_number_id, recipient, status, id)"
+        )
+        self._owner = sqlite_utils.FileLock(path + ".lock")
+        self._standby = False
+        self._buckets: dict[str, TokenBucket] = {}
+        self._in_flight: set[tuple[str, str]] = set()
+        # context of the enqueuing job per row, so the send lands in the reply's trace (lost on restart)
+        self._contexts: dict[int, contextvars.Context] = {}
+        self._pool = None
+        self._thread = None
+        self._running = False
+        self._latencies = deque(maxlen=LATENCY_SAMPLE_SIZE)
+        self._enqueued = 0
+        self._sent = 0
+        self._coalesced = 0
+        self._retries = 0
+        self._failed = 0
+        self._throttled = 0
+        self._finished = 0
+
+    def enqueue(self, phone_number_id: str, recipient: str, payload: dict) -> int:
+        """Persists a Graph API message payload and wakes the sender. Returns the row id."""
+        now = time.time()
+        with self._wakeup:
+            # not due before the guest's earlier messages, which may be in backoff; a guest's
+            # pending rows are due in id order, so the latest one is due last
+            latest = self._conn.execute(
+                "SELECT next_attempt_at FROM outbox WHERE phone_number_id = ? AND recipient = ? AND status = 'pending' "
+                "ORDER BY id DESC LIMIT 1",
+                (phone_number_id, recipient),
+            ).fetchone()
+            row_id = self._conn.execute(
+                "INSERT INTO outbox (phone_number_id, recipient, payload, enqueued_at, next_attempt_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (phone_number_id, recipient, json.dumps(payload), now, max(now, latest[0]) if latest else now),
+            ).lastrowid
+            self._enqueued += 1
+            self._contexts[row_id] = contextvars.copy_context()
+            self._wakeup.notify()
+        return row_id
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._running = True
+            self._pool = ThreadPoolExecutor(max_workers=self.senders, thread_name_prefix="outbox-sender")
+            self._thread = threading.Thread(target=self._run, name="outbox-scheduler", daemon=True)
+            self._thread.start()
+            pending = self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+        logger.info("Started outbox sender (%d pending)", pending)
+
+    def shutdown(self, timeout: float = 30.0):
+        """
+        Stops scheduling new sends and waits up to timeout seconds for the ones in flight.
+        Anything still pending stays in the outbox for the next start.
+        """
+        with self._wakeup:
+            self._running = False
+            thread, pool = self._thread, self._pool
+            self._thread = self._pool = None
+            self._wakeup.notify_all()
+        if not thread:
+            return
+        thread.join(timeout)
+        pool.shutdown(wait=True)
+        with self._lock:
+            self._owner.release()
+        logger.info("Outbox sender stopped with %d message(s) pending", self.depth())
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._running:
+                    return
+                wait = self._schedule_due() if self._owns_file() else 1.0
+                if not self._running:
+                    return
+                self._wakeup.wait(wait)
+
+    def _owns_file(self) -> bool:
+        # called with the lock held; only the process holding the lock file sends
+        if self._owner.held:
+            return True
+        if self._owner.acquire():
+            logger.info("Sending from the outbox at %s", self.path)
+            return True
+        if not self._standby:
+            logger.info("Outbox at %s is sent by another process; this one only enqueues", self.path)
+            self._standby = True
+        return False
+
+    def _schedule_due(self) -> float:
+        """
+        Submits one coalesced send per guest that is due and not already in flight, up to
+        the number of free senders. Called with the lock held; returns how long the
+        scheduler may sleep.
+        """
+        now = time.time()
+        wait = 1.0
+        throttled: set[str] = set()
+        while len(self._in_flight) < self.senders:
+            # the earliest due row of a guest that is not in flight, on a number with tokens left
+            filters = (" AND NOT (phone_number_id = ? AND recipient = ?)" * len(self._in_flight)
+                       + " AND phone_number_id != ?" * len(throttled))
+            params = [value for key in self._in_flight for value in key] + list(throttled)
+            row = self._conn.execute(
+                "SELECT phone_number_id, recipient FROM outbox "
+                f"WHERE status = 'pending' AND next_attempt_at <= ?{filters} ORDER BY next_attempt_at LIMIT 1",
+                (now, *params),
+            ).fetchone()
+            if row is None:
+                break
+            key = (row[0], row[1])
+            group = self._conn.execute(
+                "SELECT id, phone_number_id, recipient, payload, attempts, next_attempt_at, enqueued_at FROM outbox "
+                "WHERE phone_number_id = ? AND recipient = ? AND status = 'pending' ORDER BY id LIMIT ?",
+                (*key, _COALESCE_ROWS),
+            ).fetchall()
+            # the oldest message decides when the guest is due, so order is kept through retries
+            if group[0][5] > now:
+                # a later row was due before it (an outbox written by an older version)
+                self._conn.execute(
+                    "UPDATE outbox SET next_attempt_at = ? WHERE phone_number_id = ? AND recipient = ? "
+                    "AND status = 'pending' AND next_attempt_at < ?",
+                    (group[0][5], *key, group[0][5]),
+                )
+                continue
+            bucket = self._buckets.setdefault(key[0], TokenBucket(self.rate, self.burst))
+            throttled_for = bucket.take()
+            if throttled_for:
+                self._throttled += 1
+                throttled.add(key[0])
+                wait = min(wait, throttled_for)
+                continue
+            batch, payload = self._coalesce(group)
+            self._in_flight.add(key)
+            self._pool.submit(self._deliver, key, batch, payload)
+        upcoming = self._conn.execute(
+            "SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending' AND next_attempt_at > ?", (now,)
+        ).fetchone()[0]
+        if upcoming is not None:
+            wait = min(wait, upcoming - now)
+        return wait
+
+    def _coalesce(self, group: list) -> tuple[list, dict]:
+        """Merges the leading run of text messages into one payload; templates go out on their own."""
+        payload = json.loads(group[0][3])
+        batch = [group[0]]
+        if payload.get("type") != "text":
+            return batch, payload
+        body = payload["text"]["body"]
+        for row in group[1:]:
+            following = json.loads(row[3])
+            if following.get("type") != "text":
+                break
+            merged = body + "\n\n" + following["text"]["body"]
+            if len(merged) > MAX_TEXT_LENGTH:
+                break
+            body = merged
+            batch.append(row)
+        if len(batch) > 1:
+            payload["text"]["body"] = body
+        return batch, payload
+
+    def _deliver(self, key: tuple[str, str], batch: list, payload: dict):
+        with self._lock:
+            contexts = [self._contexts.get(row[0]) for row in batch]
+        context = contexts[0] or contextvars.copy_context()
+        context.run(metrics.observe, "outbox_wait", time.time() - batch[0][6])
+        try:
+            result = context.run(self._send, key[0], payload)
+        except Exception as e:
+            result = SendResult(None, error=str(e))
+        now = time.time()
+        ids = [row[0] for row in batch]
+        placeholders = ",".join("?" * len(ids))
+        with self._wakeup:
+            try:
+                attempts = max(row[4] for row in batch) + 1
+                if result.ok or not result.retryable or attempts >= self.max_attempts:
+                    for row in batch:
+                        self._contexts.pop(row[0], None)
+                if result.ok:
+                    self._conn.execute(
+                        f"UPDATE outbox SET status = 'sent', attempts = ?, finished_at = ? WHERE id IN ({placeholders})",
+                        (attempts, now, *ids),
+                    )
+                    self._sent += 1
+                    self._coalesced += len(batch) - 1
+                    # enqueue-to-delivery time of every message, including retries and rate limiting
+                    self._latencies.extend(now - row[6] for row in batch)
+                elif result.retryable and attempts < self.max_attempts:
+                    delay = max(backoff_delay(attempts), result.retry_after or 0)
+                    self._conn.execute(
+                        f"UPDATE outbox SET attempts = ?, last_error = ? WHERE id IN ({placeholders})",
+                        (attempts, result.error or f"HTTP {result.status}", *ids),
+                    )
+                    # the guest's later messages wait with it
+                    self._conn.execute(
+                        "UPDATE outbox SET next_attempt_at = MAX(next_attempt_at, ?) "
+                        "WHERE phone_number_id = ? AND recipient = ? AND status = 'pending'",
+                        (now + delay, *key),
+                    )
+                    self._retries += 1
+                    logger.warning("Send to %s failed (%s), retrying in %.1fs", key[1], result.error or result.status, delay)
+                else:
+                    self._conn.execute(
+                        f"UPDATE outbox SET status = 'failed', attempts = ?, finished_at = ?, last_error = ? "
+                        f"WHERE id IN ({placeholders})",
+                        (attempts, now, result.error or f"HTTP {result.status}", *ids),
+                    )
+                    self._failed += len(batch)
+                    logger.error("Giving up on %d message(s) to %s after %d attempt(s): %s",
+                                 len(batch), key[1], attempts, result.error or result.status)
+                self._finished += 1
+                if self._finished % _PURGE_EVERY == 0:
+                    self._conn.execute(
+                        "DELETE FROM outbox WHERE status != 'pending' AND finished_at < ?", (now - OUTBOX_RETENTION,)
+                    )
+            finally:
+                self._in_flight.discard(key)
+                self._wakeup.notify()
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM outbox WHERE status = 'pending'").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(enqueued_at) FROM outbox WHERE status = 'pending'"
+            ).fetchone()
+            latencies = sorted(self._latencies)
+            stats = {
+                "depth": depth,
+                "oldest_pending_seconds": round(time.time() - oldest, 2) if oldest else 0.0,
+                "sending": self._owner.held,
+                "in_flight": len(self._in_flight),
+                "enqueued": self._enqueued,
+                "sent": self._sent,
+                "coalesced": self._coalesced,
+                "retries": self._retries,
+                "failed": self._failed,
+                "throttled": self._throttled,
+            }
+        if latencies:
+            stats["avg_latency_seconds"] = round(sum(latencies) / len(latencies), 4)
+            stats["p95_latency_seconds"] = round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 4)
+            stats["max_latency_seconds"] = round(latencies[-1], 4)
+        return stats
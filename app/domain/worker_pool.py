@@ -0,0 +1,409 @@
+"""
+Multi-process mode: guest replies run in WORKER_PROCESSES worker processes instead of
+threads in the webhook process.
+
+The webhook process keeps everything that must be single: parsing, dedupe, the guest
+directory, the outbox sender and the task spool. Each guest is mapped by phone number
+onto a consistent hash ring of worker processes and their jobs go down that worker's
+multiprocessing queue, so one guest's messages are still handled in order, and by the
+process that holds their session, conversation memory and cached searches. Changing the number of workers only
+moves about 1/N of the guests. Inside a worker, a MessageDispatcher runs the jobs on
+DISPATCH_WORKERS threads as in single-process mode. Replies and guest tasks come back over
+a shared event queue and are sent from the webhook process.
+
+Per-process state (LLM gateway slots, caches, stage histograms) is per worker: /metrics
+on the webhook process shows webhook-side stages only, and LLM_MAX_IN_FLIGHT applies to
+each worker separately. chromadb's PersistentClient is not safe to share between
+processes, so each worker keeps its answer cache in its own directory under
+ANSWER_CACHE_PATH (a question cached by one worker is not a hit on another), and the
+knowledge base index is built by the webhook process before the workers start, which
+then only read it. With a merge hold, held jobs wait in the webhook process, ahead of
+the worker queues.
+
+Workers acknowledge each job when it has run. The webhook process keeps every job it has
+not seen acknowledged, including those a worker has already moved from the process queue
+onto its threads. When a worker dies, its replacement gets a fresh queue (the old one may
+be corrupt if the worker died mid-read) with those jobs resubmitted first, in order. A job
+that was in flight in two workers that died is given up, and its message ids are handed to
+on_lost, so a redelivery from Meta is answered. A job that finished just before the crash
+may run twice.
+"""
+import os
+import time
+import queue
+import logging
+import threading
+import zlib
+import multiprocessing
+from bisect import bisect_right
+from typing import Any, Callable
+
+from dotenv import load_dotenv
+
+from app.domain.dispatch_service import DispatchQueueFull, JobHold
+from app.utils import metrics
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 0 keeps guest replies on threads in the webhook process
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+# jobs waiting for one worker process before the webhook answers 503
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", "1000"))
+# points per worker on the hash ring; more points spread guests more evenly
+HASH_RING_REPLICAS = 64
+# how often the event pump checks that every worker process is alive
+WORKER_CHECK_INTERVAL = 1.0
+
+_STOP = None
+# dispatch key of jobs sent to every worker; runs on one of the worker's threads
+BROADCAST_KEY = "broadcast"
+
+
+class HashRing:
+    '''Consistent hash ring over worker indexes, hashed with crc32 so the mapping is the same
+    in every process and across restarts.'''
+    def __init__(self, nodes: list[int], replicas: int = HASH_RING_REPLICAS):
+        points = sorted((zlib.crc32(f"worker-{node}-{replica}".encode("utf-8")), node)
+                        for node in nodes for replica in range(replicas))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> int:
+        index = bisect_right(self._hashes, zlib.crc32(key.encode("utf-8"))) % len(self._hashes)
+        return self._nodes[index]
+
+
+def _run_acked(events, index: int, job_id: int, fn: Callable[..., Any], args: tuple):
+    try:
+        fn(*args)
+    finally:
+        events.put(("done", index, job_id))
+
+
+def _worker_main(index: int, jobs, events, threads: int, thread_queue_size: int, warm_up: bool, shutdown_timeout: float):
+    """Entry point of a worker process."""
+    from app.utils import logging_utils
+    logging_utils.configure_logging()
+    from app.domain import message_service
+    from app.domain.agents import agent_stack, answer_cache
+    from app.domain.dispatch_service import MessageDispatcher
+    from app.utils import request_utils
+
+    # replies and tasks go back to the webhook process, which owns the outbox and the task spool
+    message_service.use_reply_sink(lambda to, message, template: events.put(("reply", to, message, template)))
+    request_utils.use_task_sink(lambda local_id, task_json: events.put(("task", local_id, task_json)))
+    answer_cache.use_path(os.path.join(answer_cache.ANSWER_CACHE_PATH, f"worker-{index}"))
+    dispatcher = MessageDispatcher(num_workers=threads, queue_size=thread_queue_size, name=f"worker{index}-dispatch")
+    dispatcher.start()
+    if warm_up:
+        def _warm_up():
+            agent_stack.warm_up()
+            events.put(("ready", index))
+        threading.Thread(target=_warm_up, name="agent-warmup", daemon=True).start()
+    else:
+        events.put(("ready", index))
+
+    while True:
+        job = jobs.get()
+        if job is _STOP:
+            break
+        job_id, key, message_ids, fn, args = job
+        # the webhook's trace can't cross the process boundary; this one covers the worker's stages
+        metrics.start_trace(message_ids, key)
+        while True:
+            try:
+                dispatcher.submit(key, _run_acked, events, index, job_id, fn, args)
+                break
+            except DispatchQueueFull:
+                # every thread queue is full: stop taking jobs, so the process queue fills
+                # up and the webhook starts answering 503
+                time.sleep(0.05)
+    dispatcher.shutdown(timeout=shutdown_timeout)
+    events.put(("stopped", index))
+
+
+class WorkerPool:
+    '''Worker processes behind the same submit()/stats()/shutdown() interface as MessageDispatcher.'''
+    def __init__(
+        self,
+        num_processes: int,
+        queue_size: int = WORKER_QUEUE_SIZE,
+        threads_per_process: int = 8,
+        thread_queue_size: int = 100,
+        warm_up: bool = True,
+        on_reply: Callable[[str, str, bool], Any] | None = None,
+        on_lost: Callable[[list[str]], Any] | None = None,
+        shutdown_timeout: float = 30.0,
+        hold: float = 0.0,
+        max_hold: float = 10.0,
+    ):
+        if num_processes < 1:
+            raise ValueError("num_processes must be at least 1")
+        self.num_processes = num_processes
+        self.queue_size = queue_size
+        self.threads_per_process = threads_per_process
+        self.thread_queue_size = thread_queue_size
+        self.warm_up = warm_up
+        self.shutdown_timeout = shutdown_timeout
+        self._on_reply = on_reply
+        self._on_lost = on_lost
+        # spawn, not fork: the webhook process has threads and open connections by now
+        self._context = multiprocessing.get_context("spawn")
+        self._jobs = [self._context.Queue(maxsize=queue_size) for _ in range(num_processes)]
+        self._events = self._context.Queue()
+        self._ring = HashRing(list(range(num_processes)))
+        self._processes: list = [None] * num_processes
+        self._ready: set[int] = set()
+        self._pump: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._accepting = False
+        self._submitted = 0
+        self._rejected = 0
+        self._replies = 0
+        self._restarts = 0
+        self._lost = 0
+        # per worker, job id -> (key, message_ids, fn, args, deaths) of jobs not acknowledged yet
+        self._unacked: list[dict[int, tuple]] = [{} for _ in range(num_processes)]
+        self._job_ids = 0
+        self._checked_at = 0.0
+        self._hold = JobHold(self._release_held, hold, max_hold, "worker-pool") if hold > 0 else None
+
+    def _spawn(self, index: int):
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self._jobs[index], self._events, self.threads_per_process, self.thread_queue_size,
+                  self.warm_up, self.shutdown_timeout),
+            name=f"frontdesk-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[index] = process
+
+    def start(self):
+        with self._lock:
+            if self._pump is not None:
+                return
+            for index in range(self.num_processes):
+                self._spawn(index)
+            self._pump = threading.Thread(target=self._run_pump, name="worker-events", daemon=True)
+            self._pump.start()
+            if self._hold:
+                self._hold.start()
+            self._accepting = True
+        logger.info("Started %d worker processes (%d threads each)", self.num_processes, self.threads_per_process)
+
+    def shard_for(self, key: str) -> int:
+        return self._ring.node_for(key)
+
+    def submit(self, key: str, fn: Callable[..., Any], *args: Any, merge: bool = False):
+        """
+        Queues fn(*args) on the worker process that owns key. fn and args must be picklable
+        (a module-level function and plain data). Raises DispatchQueueFull if that worker's
+        queue is full or the pool is not accepting work. With merge set (and a hold
+        configured), the job is held and merged with the key's later jobs.
+        """
+        if not self._accepting:
+            with self._lock:
+                self._rejected += 1
+            raise DispatchQueueFull("Worker pool is not accepting new work")
+        if merge and self._hold:
+            self._submit_held(key, fn, args)
+            return
+        trace = metrics.current_trace()
+        message_ids = trace.message_ids if trace is not None else []
+        shard = self.shard_for(key)
+        try:
+            self._put(shard, key, message_ids, fn, args)
+        except queue.Full:
+            with self._lock:
+                self._rejected += 1
+            raise DispatchQueueFull(f"Queue for worker process {shard} is full") from None
+        with self._lock:
+            self._submitted += 1
+
+    def _put(self, index: int, key: str, message_ids: list[str], fn: Callable[..., Any], args: tuple,
+             timeout: float | None = None):
+        # recorded before the put, so a worker dying in between still has the job resubmitted
+        with self._lock:
+            self._job_ids += 1
+            job_id = self._job_ids
+            self._unacked[index][job_id] = (key, message_ids, fn, args, 0)
+            jobs = self._jobs[index]
+        try:
+            if timeout is None:
+                jobs.put_nowait((job_id, key, message_ids, fn, args))
+            else:
+                jobs.put((job_id, key, message_ids, fn, args), timeout=timeout)
+        except queue.Full:
+            with self._lock:
+                self._unacked[index].pop(job_id, None)
+            raise
+
+    def _submit_held(self, key: str, fn: Callable[..., Any], args: tuple):
+        shard = self.shard_for(key)
+
+        def has_room(held_keys: list[str]) -> bool:
+            # held jobs count against their worker's queue, so releasing one never finds it full
+            held = sum(1 for held_key in held_keys if self.shard_for(held_key) == shard)
+            return self._jobs[shard].qsize() + held < self.queue_size
+
+        held = self._hold.submit(key, fn, args, has_room)
+        with self._lock:
+            if not held:
+                self._rejected += 1
+                raise DispatchQueueFull(f"Queue for worker process {shard} is full")
+            self._submitted += 1
+
+    def _release_held(self, key: str, fn: Callable[..., Any], args: tuple, context, held_for: float):
+        context.run(metrics.observe, "merge_hold", held_for)
+        trace = context.run(metrics.current_trace)
+        message_ids = trace.message_ids if trace is not None else []
+        self._put(self.shard_for(key), key, message_ids, fn, args, timeout=5)
+
+    def broadcast(self, fn: Callable[..., Any], *args: Any):
+        """Queues fn(*args) once on every worker process, e.g. to invalidate their answer caches.
+        Results stay in the workers."""
+        for index in range(self.num_processes):
+            self._put(index, BROADCAST_KEY, [], fn, args, timeout=5)
+
+    def _send_reply(self, to: str, message: str, template: bool):
+        if self._on_reply is not None:
+            return self._on_reply(to, message, template)
+        from app.domain import message_service
+        return message_service.send_whatsapp_message(to, message, template)
+
+    def _run_pump(self):
+        while True:
+            # on a clock, not only when idle: a busy pump must notice a dead worker too
+            if time.monotonic() - self._checked_at >= WORKER_CHECK_INTERVAL:
+                self._checked_at = time.monotonic()
+                self._check_workers()
+            try:
+                event = self._events.get(timeout=WORKER_CHECK_INTERVAL)
+            except queue.Empty:
+                continue
+            if event is _STOP:
+                return
+            kind = event[0]
+            if kind == "done":
+                with self._lock:
+                    self._unacked[event[1]].pop(event[2], None)
+            elif kind == "reply":
+                try:
+                    self._send_reply(*event[1:])
+                    with self._lock:
+                        self._replies += 1
+                except Exception as e:
+                    logger.error("Could not send reply from a worker process: %s", e, exc_info=True)
+            elif kind == "task":
+                try:
+                    from app.utils import request_utils
+                    request_utils.get_task_dispatcher().submit(event[2], local_id=event[1])
+                except Exception as e:
+                    logger.error("Could not spool task %s from a worker process: %s", event[1], e, exc_info=True)
+            elif kind == "ready":
+                with self._lock:
+                    self._ready.add(event[1])
+                logger.info("Worker process %d ready", event[1])
+            elif kind == "stopped":
+                with self._lock:
+                    self._ready.discard(event[1])
+
+    def _check_workers(self):
+        # runs on the pump thread, so acknowledgements already read are not resubmitted
+        if not self._accepting:
+            return
+        for index, process in enumerate(self._processes):
+            if process is not None and not process.is_alive():
+                logger.error("Worker process %d exited with code %s, restarting it", index, process.exitcode)
+                self._replace_worker(index)
+
+    def _replace_worker(self, index: int):
+        with self._lock:
+            unacked, self._unacked[index] = self._unacked[index], {}
+            retry = {job_id: job for job_id, job in unacked.items() if job[4] == 0}
+            lost = [job for job in unacked.values() if job[4] > 0]
+            old = self._jobs[index]
+            # room for the resubmitted jobs on top of the usual queue size
+            self._jobs[index] = jobs = self._context.Queue(maxsize=self.queue_size + len(retry))
+            for job_id, (key, message_ids, fn, args, _) in retry.items():
+                self._unacked[index][job_id] = (key, message_ids, fn, args, 1)
+                jobs.put_nowait((job_id, key, message_ids, fn, args))
+            self._ready.discard(index)
+            self._restarts += 1
+            self._lost += len(lost)
+        old.cancel_join_thread()
+        old.close()
+        if retry:
+            logger.warning("Resubmitting %d unfinished job(s) of worker process %d", len(retry), index)
+        for key, message_ids, *_ in lost:
+            logger.error("Giving up on a job for %s that was running in two worker processes that died", key)
+            if self._on_lost is not None and message_ids:
+                try:
+                    self._on_lost(message_ids)
+                except Exception as e:
+                    logger.error("on_lost failed for %s: %s", key, e, exc_info=True)
+        self._spawn(index)
+
+    def ready(self) -> bool:
+        with self._lock:
+            return len(self._ready) == self.num_processes
+
+    def stats(self) -> dict:
+        depths = [jobs.qsize() for jobs in self._jobs]
+        with self._lock:
+            return {
+                "processes": self.num_processes,
+                "threads_per_process": self.threads_per_process,
+                "queue_size": self.queue_size,
+                "queue_depth": sum(depths),
+                "max_shard_depth": max(depths),
+                "submitted": self._submitted,
+                "rejected": self._rejected,
+                "replies": self._replies,
+                "restarts": self._restarts,
+                "unacked": sum(len(jobs) for jobs in self._unacked),
+                "lost": self._lost,
+                "merged": self._hold.merged if self._hold else 0,
+                "workers": [
+                    {
+                        "pid": process.pid if process is not None else None,
+                        "alive": process is not None and process.is_alive(),
+                        "ready": index in self._ready,
+                        "queue_depth": depths[index],
+                    }
+                    for index, process in enumerate(self._processes)
+                ],
+            }
+
+    def shutdown(self, timeout: float = 30.0):
+        """
+        Stops accepting work, lets each worker process finish what is queued, and sends the
+        replies they produced. Workers still running after timeout seconds are terminated.
+        """
+        with self._lock:
+            self._accepting = False
+            pump = self._pump
+            self._pump = None
+        if pump is None:
+            return
+        if self._hold:
+            # ahead of the stop signals, so held jobs are answered too
+            self._hold.flush()
+        deadline = time.monotonic() + timeout
+        for jobs in self._jobs:
+            try:
+                jobs.put(_STOP, timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Full:
+                logger.warning("Could not signal a worker process to stop; queue still full")
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning("Terminating worker process %d", process.pid)
+                process.terminate()
+        # after the workers, so every reply they queued is sent before the pump stops
+        self._events.put(_STOP)
+        pump.join(max(1.0, deadline - time.monotonic()))
+        logger.info("Worker processes stopped")
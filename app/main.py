@@ -1,16 +1,119 @@
-import threading  
+import os
+import asyncio
 import logging
+import secrets
+import threading
+import time
+from contextlib import asynccontextmanager
 from typing_extensions import Annotated  
-from fastapi import FastAPI, APIRouter, Query, HTTPException, Depends  
+from fastapi import FastAPI, APIRouter, Query, HTTPException, Depends, Request, Header  
+from fastapi.responses import JSONResponse, PlainTextResponse, RedirectResponse
+from pydantic import ValidationError
 from app.domain import message_service
-from app.schema import Payload, Message, Audio, Image, User  
+from app.domain.agents import agent_budget, agent_stack, guest_memory, llm_gateway, routing_agent, tools
+from app.domain.agents import answer_cache
+from app.domain.agents.answer_cache import get_answer_cache
+from app.domain.dispatch_service import MessageDispatcher, DispatchQueueFull
+from app.domain.dedupe_service import create_dedupe_store
+from app.domain.outbox_service import OUTBOX_ENABLED
+from app.domain.worker_pool import WORKER_PROCESSES, WorkerPool
+from app.domain.guest_directory import get_guest_directory
+from app.schema import Message  
+from app.utils import http_utils, logging_utils, metrics, request_utils, webhook_utils
+from app.utils.webhook_utils import InvalidWebhookBody
 
-logging.basicConfig(level=logging.INFO)
+logging_utils.configure_logging()
 logger = logging.getLogger(__name__)
 
 VERIFICATION_TOKEN = "sapientdev-ritz-demo"
+# staff endpoints under /admin require this in the X-Admin-Token header; unset disables them
+ADMIN_API_TOKEN = os.getenv("ADMIN_API_TOKEN")
 
-app = FastAPI()
+# worker pool that runs guest replies; one guest's messages always land on the same worker
+DISPATCH_WORKERS = int(os.getenv("DISPATCH_WORKERS", "8"))
+DISPATCH_QUEUE_SIZE = int(os.getenv("DISPATCH_QUEUE_SIZE", "100"))
+DISPATCH_SHUTDOWN_TIMEOUT = float(os.getenv("DISPATCH_SHUTDOWN_TIMEOUT", "30"))
+# consecutive text messages from one guest sent within this many seconds become one agent call
+MESSAGE_MERGE_WINDOW = float(os.getenv("MESSAGE_MERGE_WINDOW", "10"))
+# seconds a guest's messages wait for more from them before being answered, so fragments that
+# arrive in separate webhooks are merged too; 0 answers every webhook as soon as it arrives
+MESSAGE_MERGE_HOLD = float(os.getenv("MESSAGE_MERGE_HOLD", "0"))
+# set to 0 to build the agent lazily on the first message instead of in the background at boot
+AGENT_WARMUP = os.getenv("AGENT_WARMUP", "1") != "0"
+
+# remembers WhatsApp message ids so webhook redeliveries are not answered twice
+dedupe_store = create_dedupe_store()
+
+
+def forget_message_ids(message_ids: list[str]):
+    """Lets a redelivery of messages whose job was lost be answered."""
+    for message_id in message_ids:
+        dedupe_store.forget(message_id)
+
+
+if WORKER_PROCESSES > 0:
+    # each guest is hashed to a worker process; the processes run DISPATCH_WORKERS threads each
+    dispatcher = WorkerPool(
+        WORKER_PROCESSES,
+        threads_per_process=DISPATCH_WORKERS,
+        thread_queue_size=DISPATCH_QUEUE_SIZE,
+        warm_up=AGENT_WARMUP,
+        on_lost=forget_message_ids,
+        shutdown_timeout=DISPATCH_SHUTDOWN_TIMEOUT,
+        hold=MESSAGE_MERGE_HOLD,
+        max_hold=MESSAGE_MERGE_WINDOW,
+    )
+else:
+    dispatcher = MessageDispatcher(
+        num_workers=DISPATCH_WORKERS,
+        queue_size=DISPATCH_QUEUE_SIZE,
+        hold=MESSAGE_MERGE_HOLD,
+        max_hold=MESSAGE_MERGE_WINDOW,
+    )
+
+metrics.register_gauge("frontdesk_dispatch_queue_depth", "Guest messages waiting for a worker.",
+                       lambda: dispatcher.stats()["queue_depth"])
+if OUTBOX_ENABLED:
+    metrics.register_gauge("frontdesk_outbox_depth", "Replies waiting in the outbox.",
+                           lambda: message_service.get_outbox().depth())
+    metrics.register_gauge("frontdesk_outbox_retries_total", "Outbox sends retried after 429, 5xx or network errors.",
+                           lambda: message_service.get_outbox().stats()["retries"], kind="counter")
+metrics.register_gauge("frontdesk_llm_in_flight", "LLM calls running on the Ollama backends.",
+                       lambda: llm_gateway.get_gateway().in_flight())
+metrics.register_gauge("frontdesk_llm_waiting", "LLM calls queued for a backend slot.",
+                       lambda: llm_gateway.get_gateway().waiting())
+metrics.register_gauge("frontdesk_llm_shed_total", "LLM calls answered from a template after waiting past their queue budget.",
+                       lambda: sum(llm_gateway.get_gateway().shed.values()), kind="counter")
+metrics.register_gauge("frontdesk_task_spool_depth", "Guest tasks waiting to reach the admin portal.",
+                       lambda: request_utils.get_task_dispatcher().depth())
+for limit in agent_budget.exhausted:
+    metrics.register_gauge(f"frontdesk_agent_{limit}_exhausted_total", f"Agent runs cut short by their {limit} limit.",
+                           lambda limit=limit: agent_budget.exhausted[limit], kind="counter")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    if WORKER_PROCESSES and AGENT_WARMUP:
+        # once here rather than in every worker: chromadb's index must not be written by several processes
+        await asyncio.to_thread(agent_stack.warm_up_knowledge_base)
+    dispatcher.start()
+    if OUTBOX_ENABLED:
+        message_service.get_outbox().start()
+    request_utils.get_task_dispatcher().start()
+    get_guest_directory().start_watching()
+    if AGENT_WARMUP and not WORKER_PROCESSES:
+        # build the agent stack off the request path; /readiness reports when it is done
+        threading.Thread(target=agent_stack.warm_up, name="agent-warmup", daemon=True).start()
+    yield
+    dispatcher.shutdown(timeout=DISPATCH_SHUTDOWN_TIMEOUT)
+    # after the dispatcher, so replies from drained jobs are still handed to the sender
+    if OUTBOX_ENABLED:
+        message_service.get_outbox().shutdown(timeout=DISPATCH_SHUTDOWN_TIMEOUT)
+    request_utils.get_task_dispatcher().shutdown(timeout=DISPATCH_SHUTDOWN_TIMEOUT)
+    get_guest_directory().stop_watching()
+    http_utils.close_clients()
+    await http_utils.aclose_clients()
+
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 def verify_whatsapp(
@@ -28,75 +131,174 @@ def health():
 
 @app.get("/readiness")
 def readiness():
+    if WORKER_PROCESSES:
+        # the agent runs in the worker processes, which report when they have warmed up
+        if not dispatcher.ready():
+            return JSONResponse(status_code=503, content={"status": "not ready", "detail": "worker processes starting"})
+        return {"status": "ready"}
+    if not agent_stack.is_ready():
+        detail = agent_stack.warmup_error() or "agent warming up"
+        return JSONResponse(status_code=503, content={"status": "not ready", "detail": detail})
     return {"status": "ready"}
 
-def parse_message(payload: Payload) -> Message | None:  
-    if not payload.entry[0].changes[0].value.messages:  
-        return None  
-    return payload.entry[0].changes[0].value.messages[0]  
-
-def get_current_user(message: Annotated[Message, Depends(parse_message)]) -> User | None:  
-    if not message:  
-        return None  
-    return message_service.authenticate_user_by_phone_number(message.from_)  
-
-def parse_audio_file(message: Annotated[Message, Depends(parse_message)]) -> Audio | None:  
-    if message and message.type == "audio":  
-        return message.audio  
-    return None  
-
-def parse_image_file(message: Annotated[Message, Depends(parse_message)]) -> Image | None:  
-    if message and message.type == "image":  
-        return message.image  
-    return None  
-
-def message_extractor(  
-        message: Annotated[Message, Depends(parse_message)],  
-        audio: Annotated[Audio, Depends(parse_audio_file)],  
-):  
-    if audio:  
-        return message_service.transcribe_audio(audio)  
-    if message and message.text:  
-        return message.text.body  
-    return None
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-@app.post("/", status_code=200)
-def receive_whatsapp(
-        user: Annotated[User, Depends(get_current_user)],  
-        user_message: Annotated[str, Depends(message_extractor)],  
-        image: Annotated[Image, Depends(parse_image_file)],
-):
-    logger.info("Received request")
+@app.get("/stats")
+def stats():
+    return {
+        "dispatch": dispatcher.stats(),
+        "dedupe": dedupe_store.stats(),
+        "answer_cache": get_answer_cache().stats(),
+        "tools": tools.tool_stats(),
+        "llm": llm_gateway.get_gateway().stats(),
+        "agent": agent_budget.stats(),
+        "agent_memory": {**guest_memory.stats(), "sessions": routing_agent.session_stats()},
+        "outbox": message_service.get_outbox().stats() if OUTBOX_ENABLED else {"enabled": False},
+        "tasks": request_utils.get_task_dispatcher().stats(),
+        "logging": {"dropped_records": logging_utils.dropped_records()},
+    }
 
-    # Log the user, user_message, and image
-    logger.info(f"User: {user}")
-    logger.info(f"User message: {user_message}")
-    logger.info(f"Image: {image}")
+def require_admin(x_admin_token: Annotated[str | None, Header()] = None):  
+    if not ADMIN_API_TOKEN or not secrets.compare_digest(x_admin_token or "", ADMIN_API_TOKEN):  
+        raise HTTPException(status_code=403, detail="Forbidden")  
 
-    if not user and not user_message and not image:
-        logger.info("No user, message, or image received. Returning 'ok'")
-        return {"status": "ok"}
+@app.get("/tasks/{local_id}")
+def track_task(local_id: str):
+    # guests' tracking links land here; once the portal has the task, they go on to its page
+    task = request_utils.get_task_dispatcher().lookup(local_id)
+    if task is None:
+        raise HTTPException(status_code=404, detail="Unknown task")
+    if task["portal_id"] is not None:
+        return RedirectResponse(f"{request_utils.ADMIN_PORTAL_URL}/view-task/{task['portal_id']}")
+    return JSONResponse(status_code=202 if task["status"] == "pending" else 200, content=task)
+
+@app.get("/admin/answer-cache", dependencies=[Depends(require_admin)])
+def list_answer_cache(limit: int = 100):
+    if WORKER_PROCESSES:
+        raise HTTPException(status_code=409, detail="Each worker process keeps its own answer cache")
+    cache = get_answer_cache()
+    return {"stats": cache.stats(), "entries": cache.entries(limit=limit)}
+
+@app.delete("/admin/answer-cache", dependencies=[Depends(require_admin)])
+def invalidate_answer_cache(question: str | None = None, entry_id: str | None = None):
+    # no question or entry_id clears the whole cache
+    if WORKER_PROCESSES:
+        # each worker drops the entries from its own cache; the counts stay in the workers
+        dispatcher.broadcast(answer_cache.invalidate, question, entry_id)
+        return JSONResponse(status_code=202, content={"workers": WORKER_PROCESSES})
+    removed = answer_cache.invalidate(question=question, entry_id=entry_id)
+    return {"removed": removed}
+
+@app.get("/admin/traces", dependencies=[Depends(require_admin)])
+def list_traces(limit: int = 20):
+    # slowest recent replies first, each broken down stage by stage
+    return {"traces": metrics.slowest_traces(limit=limit)}
 
+@app.get("/admin/traces/{message_id}", dependencies=[Depends(require_admin)])
+def get_trace(message_id: str):
+    trace = metrics.get_trace(message_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="No trace for this message id")
+    return trace
+
+async def parse_messages(request: Request) -> list[Message]:  
+    # Parsed once per request; status callbacks come back empty without building any models.  
+    # Meta can batch several entries, changes and messages into one POST.  
+    request.state.received_at = time.perf_counter()  
+    body = await request.body()  
+    parse_started = time.perf_counter()  
+    try:  
+        parsed = webhook_utils.parse_webhook_body(body)  
+    except (InvalidWebhookBody, ValidationError) as e:  
+        logger.warning("Rejecting malformed webhook body: %s", e)  
+        raise HTTPException(status_code=422, detail="Malformed webhook payload")  
+    # the per-guest traces don't exist yet, so receive_whatsapp adds this to them  
+    request.state.parse_timing = (parse_started, time.perf_counter() - parse_started)  
+    metrics.observe("parse", request.state.parse_timing[1], parse_started)  
+    if not parsed:  
+        return []  
+    # the sqlite dedupe store can wait on another uvicorn worker's write lock, so it runs off the event loop  
+    return await asyncio.to_thread(drop_redeliveries, parsed)  
+
+def drop_redeliveries(messages: list[Message]) -> list[Message]:  
+    fresh = []  
+    for message in messages:  
+        if dedupe_store.check_and_mark(message.id):  
+            logger.info("Dropping redelivered message %s", message.id, extra={"event": "webhook.duplicate"})  
+            continue  
+        fresh.append(message)  
+    return fresh  
+
+def group_messages_by_sender(messages: Annotated[list[Message], Depends(parse_messages)]) -> dict[str, list[Message]]:  
+    batches = {}  
+    for message in messages:  
+        batches.setdefault(message.from_, []).append(message)  
+    # order inside a payload is not guaranteed, so sort each guest's messages by send time  
+    for batch in batches.values():  
+        batch.sort(key=lambda message: int(message.timestamp))  
+    return batches  
+
+def dispatch_guest_messages(request: Request, phone: str, messages: list[Message]) -> bool | None:
+    """Hands one guest's messages to their worker. Returns None if the sender is not a guest."""
+    # one trace per guest, looked up later by any of its message ids
+    trace = metrics.start_trace([message.id for message in messages], phone, request.state.received_at)
+    trace.record("parse", *request.state.parse_timing)
+    with metrics.timed("auth"):
+        user = message_service.authenticate_user_by_phone_number(phone)
     if not user:
         logger.warning("Unauthorized access attempt - user not found")
-        raise HTTPException(status_code=401, detail="Unauthorized")
+        return None
 
-    if image:
+    if any(message.type == "image" for message in messages):
         logger.info("Image received (Can't handle images yet.)")
-        return print("Image received (Can't handle images yet.)")
+    # voice notes are transcribed by the worker, so the webhook is acknowledged without waiting on Whisper
+    messages = [message for message in messages if (message.type == "audio" and message.audio) or message.text]
+    if not messages:
+        return False
+
+    try:
+        logger.info("Dispatching %d message(s) from %s", len(messages), user.phone,
+                    extra={"event": "webhook.dispatch"})
+        # Hand off to the worker that owns this guest so replies go out in order; with
+        # MESSAGE_MERGE_HOLD set, messages from the guest's next webhooks join this job
+        dispatcher.submit(user.phone, message_service.respond_to_messages, messages, user,
+                          MESSAGE_MERGE_WINDOW, merge=True)
+    except DispatchQueueFull as e:
+        logger.warning("Rejecting message, dispatch queue full: %s", e)
+        # receive_whatsapp forgets the ids so Meta's redelivery gets through once we have capacity again
+        raise HTTPException(status_code=503, detail="Busy, please retry", headers={"Retry-After": "5"})
+    return True
 
-    if user_message:
+@app.post("/", status_code=200)
+async def receive_whatsapp(
+        request: Request,
+        batches: Annotated[dict[str, list[Message]], Depends(group_messages_by_sender)],
+):
+    logger.info("Received request with %d message(s) from %d sender(s)",
+                sum(len(batch) for batch in batches.values()), len(batches), extra={"event": "webhook.received"})
+
+    if not batches:
+        logger.info("No messages received. Returning 'ok'")
+        return {"status": "ok"}
+
+    unauthorized = 0
+    senders = list(batches)
+    for index, phone in enumerate(senders):
         try:
-            logger.info(f"Processing user message: {user_message}")
-            # New thread for async processing 
-            thread = threading.Thread(
-                target=message_service.respond_and_send_message, 
-                args=(user_message, user)
-            )  
-            thread.daemon = True
-            logging.info("Starting a new thread for message processing.")
-            thread.start()
-        except Exception as e:
-            logging.error(f"An error occurred while starting the thread: {str(e)}", exc_info=True)
+            dispatched = dispatch_guest_messages(request, phone, batches[phone])
+        except Exception:
+            # the ids were marked seen while parsing; nothing from this guest or the ones
+            # after it in the payload has been dispatched, so let Meta's redelivery through
+            await asyncio.to_thread(
+                forget_message_ids, [message.id for later in senders[index:] for message in batches[later]]
+            )
+            raise
+        if dispatched is None:
+            unauthorized += 1
+
+    if unauthorized == len(batches):
+        raise HTTPException(status_code=401, detail="Unauthorized")
 
     return {"status": "ok"}
@@ -1,5 +1,5 @@
 from typing import List, Optional  
-from pydantic import BaseModel, Field   
+from pydantic import BaseModel, ConfigDict, Field   
 
 class Profile(BaseModel):  
     name: str  
@@ -55,11 +55,15 @@ class Payload(BaseModel):
     entry: List[Entry]
 
 class User(BaseModel):  
+    # shared between requests by the guest directory, so never mutated  
+    model_config = ConfigDict(frozen=True)  
+
     id: int  
     first_name: str  
     last_name: str  
     phone: str
     role: str
+    room_number: str | None = None
 
 class UserMessage(BaseModel):  
     user: User  
@@ -0,0 +1,66 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import httpx
+
+# Shared HTTP clients. Each upstream host gets its own keep-alive pool so a slow host
+# (e.g. the admin portal) can't starve connections to another (e.g. the Graph API).
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "20"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "10"))
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+
+_LIMITS = httpx.Limits(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+    keepalive_expiry=30.0,
+)
+_TIMEOUT = httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+
+_clients: dict[str, httpx.Client] = {}
+_async_clients: dict[str, httpx.AsyncClient] = {}
+_lock = threading.Lock()
+
+
+def _host_key(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_client(url: str) -> httpx.Client:
+    """Returns the pooled client for the host of url, creating it on first use."""
+    key = _host_key(url)
+    client = _clients.get(key)
+    if client is None:
+        with _lock:
+            client = _clients.get(key)
+            if client is None:
+                client = httpx.Client(limits=_LIMITS, timeout=_TIMEOUT)
+                _clients[key] = client
+    return client
+
+
+def get_async_client(url: str) -> httpx.AsyncClient:
+    """Async counterpart of get_client. Must be used from the event loop that serves the app."""
+    key = _host_key(url)
+    client = _async_clients.get(key)
+    if client is None:
+        client = httpx.AsyncClient(limits=_LIMITS, timeout=_TIMEOUT)
+        _async_clients[key] = client
+    return client
+
+
+def close_clients():
+    with _lock:
+        clients = list(_clients.values())
+        _clients.clear()
+    for client in clients:
+        client.close()
+
+
+async def aclose_clients():
+    clients = list(_async_clients.values())
+    _async_clients.clear()
+    for client in clients:
+        await client.aclose()
@@ -0,0 +1,233 @@
+"""
+Application logging: callers only enqueue records, a background listener formats and
+writes them.
+
+Records keep their msg and args until the listener formats them, so a message that is
+sampled out, filtered by level or never written costs no string formatting on the request
+path (don't mutate an object after passing it as a log argument). Pass values as
+%-style arguments rather than building an f-string, which is formatted before the level
+check. Output is one JSON object per line (LOG_FORMAT=text for plain lines). Records
+tagged with an event, as in
+
+  logger.info("Sent reply to %s", phone, extra={"event": "whatsapp.send"})
+
+can be sampled per event with LOG_SAMPLE_RATES="whatsapp.send=0.1,agent.response=0.05";
+warnings and errors are never sampled. Credentials in headers, extras and message text
+are masked before anything is written.
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+from logging.handlers import QueueHandler, QueueListener
+
+from app.utils import metrics
+
+try:
+    import orjson
+
+    def _dumps(value) -> str:
+        return orjson.dumps(value, default=str).decode("utf-8")
+except ImportError:  # fall back to the stdlib encoder
+    def _dumps(value) -> str:
+        return json.dumps(value, default=str, ensure_ascii=False)
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "")
+# records waiting for the writer; beyond this they are dropped (and counted) rather than block a request
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+REDACTED = "[redacted]"
+SENSITIVE_KEYS = {"authorization", "api_key", "apikey", "access_token", "token", "password", "x-admin-token"}
+_SECRETS_IN_TEXT = re.compile(r"(?i)(bearer\s+|api_key[\"']?\s*[:=]\s*[\"']?)[^\s\"',}]+")
+
+# attributes every LogRecord has; anything else on a record came from extra=
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "taskName"}
+
+
+def redact(value):
+    """Masks credentials in dicts (by key, recursively) and bearer tokens/api keys in strings."""
+    if isinstance(value, dict):
+        return {
+            key: REDACTED if str(key).lower() in SENSITIVE_KEYS else redact(item) for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        return type(value)(redact(item) for item in value)
+    if isinstance(value, str):
+        return _SECRETS_IN_TEXT.sub(lambda match: match.group(1) + REDACTED, value)
+    return value
+
+
+def _redact_structure(value):
+    # dicts and lists are masked by key before they are turned into text; scalars pass
+    # through and are covered by the pattern pass over the finished message
+    return redact(value) if isinstance(value, (dict, list, tuple)) else value
+
+
+def _message(record: logging.LogRecord) -> str:
+    args = record.args
+    if args:
+        if isinstance(args, dict):
+            args = redact(args)
+        else:
+            args = tuple(_redact_structure(arg) for arg in args)
+        try:
+            message = str(record.msg) % args
+        except (TypeError, ValueError):
+            message = f"{record.msg} {args}"
+    else:
+        message = str(record.msg)
+    return _SECRETS_IN_TEXT.sub(lambda match: match.group(1) + REDACTED, message)
+
+
+_last_second = None
+_last_timestamp = ""
+
+
+def _timestamp(created: float, msecs: float) -> str:
+    # strftime is the slow part, so the formatted second is reused
+    global _last_second, _last_timestamp
+    second = int(created)
+    if second != _last_second:
+        _last_second, _last_timestamp = second, time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(second))
+    return f"{_last_timestamp}.{int(msecs):03d}Z"
+
+
+class JSONFormatter(logging.Formatter):
+    '''One JSON object per record: time, level, logger, message, then event, message_id and any other extras.'''
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": _timestamp(record.created, record.msecs),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": _message(record),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = REDACTED if key.lower() in SENSITIVE_KEYS else _redact_structure(value)
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return _dumps(entry)
+
+
+class TextFormatter(logging.Formatter):
+    '''The stdlib layout, with the same redaction as JSONFormatter.'''
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    def formatMessage(self, record: logging.LogRecord) -> str:
+        record.message = _message(record)
+        return super().formatMessage(record)
+
+
+class SamplingFilter(logging.Filter):
+    '''Keeps a share of INFO/DEBUG records per event; records without an event always pass.'''
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = self.rates.get(getattr(record, "event", None), 1.0)
+        return rate >= 1.0 or random.random() < rate
+
+
+class TraceFilter(logging.Filter):
+    '''Tags records with the WhatsApp message id of the active trace. Runs on the caller's
+    thread, where the trace contextvar is visible; the writer thread can't see it.'''
+    def filter(self, record: logging.LogRecord) -> bool:
+        trace = metrics.current_trace()
+        if trace is not None and trace.message_ids:
+            record.message_id = trace.message_ids[0]
+        return True
+
+
+class _LazyQueueHandler(QueueHandler):
+    '''QueueHandler that hands the record over as-is (the stdlib one formats it on the
+    caller's thread) and drops it once max_size records are waiting. The queue is a
+    SimpleQueue, whose put is a fraction of the cost of queue.Queue's; the size check is
+    approximate under concurrency, which is fine for a safety limit.'''
+    def __init__(self, log_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(log_queue)
+        self.max_size = max_size
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+    def enqueue(self, record: logging.LogRecord):
+        if self.queue.qsize() >= self.max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+
+def parse_sample_rates(spec: str) -> dict[str, float]:
+    rates = {}
+    for part in filter(None, (part.strip() for part in spec.split(","))):
+        event, _, rate = part.partition("=")
+        rates[event.strip()] = float(rate)
+    return rates
+
+
+_listener: QueueListener | None = None
+_handler: _LazyQueueHandler | None = None
+_lock = threading.Lock()
+
+
+def configure_logging(
+    stream=None,
+    level: str = LOG_LEVEL,
+    fmt: str = LOG_FORMAT,
+    sample_rates: str = LOG_SAMPLE_RATES,
+    queue_size: int = LOG_QUEUE_SIZE,
+):
+    """
+    Routes the root logger through the queue and starts the writer thread. Replaces any
+    handlers already on the root logger; calling it again reconfigures.
+    """
+    global _listener, _handler
+    # LogRecord fields the formatters never print; skipping them (findCaller in particular)
+    # is most of the cost of creating a record, see "Optimization" in the logging HOWTO
+    logging._srcfile = None
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+    with _lock:
+        stop_logging()
+        log_queue = queue.SimpleQueue()
+        writer = logging.StreamHandler(stream or sys.stderr)
+        writer.setFormatter(TextFormatter() if fmt == "text" else JSONFormatter())
+        _handler = _LazyQueueHandler(log_queue, queue_size)
+        _handler.addFilter(SamplingFilter(parse_sample_rates(sample_rates)))
+        _handler.addFilter(TraceFilter())
+        root = logging.getLogger()
+        for existing in list(root.handlers):
+            root.removeHandler(existing)
+        root.addHandler(_handler)
+        root.setLevel(level)
+        _listener = QueueListener(log_queue, writer)
+        _listener.start()
+
+
+def stop_logging():
+    """Flushes queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def dropped_records() -> int:
+    return _handler.dropped if _handler else 0
+
+
+atexit.register(stop_logging)
@@ -0,0 +1,174 @@
+"""
+Stage timings for guest messages: Prometheus histograms plus a per-message trace.
+
+  with metrics.timed("intent"):
+      classification = classifier.classify(message)
+
+records into the frontdesk_stage_seconds histogram and, if a trace is active in the
+current context, appends the stage to it. A trace is started per guest batch in the
+webhook handler and keyed by every WhatsApp message id in the batch; it follows the
+work onto the dispatcher and fan-out threads through a contextvar. Rendering for
+GET /metrics is the Prometheus text format, written here so no client library is needed.
+"""
+import os
+import time
+import threading
+from bisect import bisect_left
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable
+
+from app.utils.cache_utils import TTLCache
+
+TRACE_MAX_ENTRIES = int(os.getenv("TRACE_MAX_ENTRIES", "2000"))
+TRACE_TTL = float(os.getenv("TRACE_TTL", "3600"))
+
+# seconds; covers a sub-millisecond parse up to a minute-long agent run
+STAGE_BUCKETS = (0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    '''Prometheus histogram with a single label. observe() is a bisect and three
+    additions under a lock; buckets are only made cumulative when rendered.'''
+    def __init__(self, name: str, help: str, label: str, buckets: tuple = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = buckets
+        self._series: dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, label_value: str, value: float):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_value)
+            if series is None:
+                # per-bucket counts (the last one is +Inf), then sum and count
+                series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {label_value: list(series) for label_value, series in self._series.items()}
+        for label_value, series in sorted(snapshot.items()):
+            label = f'{self.label}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{label},le="{le}"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {series[-2]}")
+            lines.append(f"{self.name}_count{{{label}}} {series[-1]}")
+        return lines
+
+
+class Trace:
+    '''Stage timings for one guest batch, with offsets from when the webhook received it.'''
+    __slots__ = ("message_ids", "phone", "started_at", "_start", "stages")
+
+    def __init__(self, message_ids: list[str], phone: str | None = None, started: float | None = None):
+        self.message_ids = message_ids
+        self.phone = phone
+        self._start = time.perf_counter() if started is None else started
+        self.started_at = time.time() - (time.perf_counter() - self._start)
+        self.stages: list[tuple[str, float, float]] = []
+
+    def record(self, stage: str, started: float, seconds: float):
+        # list.append is atomic, so fan-out threads can record into the same trace
+        self.stages.append((stage, started - self._start, seconds))
+
+    @property
+    def duration(self) -> float:
+        return max((offset + seconds for _, offset, seconds in self.stages), default=0.0)
+
+    def to_dict(self) -> dict:
+        return {
+            "message_ids": self.message_ids,
+            "phone": self.phone,
+            "started_at": self.started_at,
+            "duration_seconds": round(self.duration, 4),
+            "stages": [
+                {"stage": stage, "offset_seconds": round(offset, 4), "seconds": round(seconds, 4)}
+                for stage, offset, seconds in sorted(self.stages, key=lambda entry: entry[1])
+            ],
+        }
+
+
+stage_seconds = Histogram(
+    "frontdesk_stage_seconds", "Time spent in each stage of handling a guest message.", "stage"
+)
+
+_current_trace: ContextVar[Trace | None] = ContextVar("frontdesk_trace", default=None)
+_traces = TTLCache(max_entries=TRACE_MAX_ENTRIES, ttl=TRACE_TTL)
+_recent_traces: deque[Trace] = deque(maxlen=TRACE_MAX_ENTRIES)
+_collectors: list[tuple[str, str, str, Callable[[], float]]] = []
+
+
+def observe(stage: str, seconds: float, started: float | None = None, trace: Trace | None = None):
+    """Records a stage timing measured by the caller; started is a perf_counter() value."""
+    stage_seconds.observe(stage, seconds)
+    trace = trace or _current_trace.get()
+    if trace is not None:
+        trace.record(stage, time.perf_counter() - seconds if started is None else started, seconds)
+
+
+class timed:
+    '''Context manager timing the enclosed block as a stage.'''
+    __slots__ = ("stage", "_started")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, time.perf_counter() - self._started, self._started)
+        return False
+
+
+def start_trace(message_ids: list[str], phone: str | None = None, started: float | None = None) -> Trace:
+    """
+    Starts a trace for the current context and indexes it by each message id. started is
+    the perf_counter() value the trace counts from (when the webhook request arrived).
+    """
+    trace = Trace(message_ids, phone, started)
+    _current_trace.set(trace)
+    for message_id in message_ids:
+        _traces.set(message_id, trace)
+    _recent_traces.append(trace)
+    return trace
+
+
+def current_trace() -> Trace | None:
+    return _current_trace.get()
+
+
+def get_trace(message_id: str) -> dict | None:
+    trace = _traces.get(message_id)
+    return trace.to_dict() if trace else None
+
+
+def slowest_traces(limit: int = 20) -> list[dict]:
+    traces = sorted(list(_recent_traces), key=lambda trace: trace.duration, reverse=True)
+    return [trace.to_dict() for trace in traces[:limit]]
+
+
+def register_gauge(name: str, help: str, read: Callable[[], float], kind: str = "gauge"):
+    """Exposes a value read at scrape time, e.g. a queue depth (kind "counter" for totals)."""
+    _collectors.append((name, help, kind, read))
+
+
+def render() -> str:
+    lines = stage_seconds.render()
+    for name, help, kind, read in _collectors:
+        try:
+            value = read()
+        except Exception:
+            continue
+        lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}", f"{name} {value}"]
+    return "\n".join(lines) + "\n"
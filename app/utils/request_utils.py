@@ -1,26 +1,322 @@
-import requests
+import os
 import json
+import time
+import secrets
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-def send_task_to_endpoint(task_json, endpoint_url):
-    """For sending task info to the admin portal."""
-    try:
-        headers = {
-            "Content-Type": "application/json"
-        }
-
-        # Send the POST request
-        response = requests.post(endpoint_url, headers=headers, data=json.dumps(task_json))
-
-        # Log the response
-        if response.status_code == 200 or response.status_code == 201:
-            print("Task successfully sent to the endpoint.")
-            print("Response:", response.json())
-        else:
-            print(f"Failed to send the task. Status Code: {response.status_code}")
-            print("Response:", response.text)
-
-        return response
-
-    except Exception as e:
-        print(f"An error occurred while sending the task: {e}")
-        return None
+from app.domain.outbox_service import backoff_delay
+from app.utils import metrics, sqlite_utils
+from app.utils.http_utils import get_client
+
+logger = logging.getLogger(__name__)
+
+# base URL of the admin portal that receives guest tasks
+ADMIN_PORTAL_URL = os.getenv("ADMIN_PORTAL_URL", "http://127.0.0.1:5000").rstrip("/")
+# tasks are POSTed here one at a time...
+TASK_ENDPOINT = os.getenv("TASK_ENDPOINT", f"{ADMIN_PORTAL_URL}/api/tasks")
+# ...or, if the portal has one, to a batch endpoint taking a JSON list and answering a list of {"id": ...} in order
+TASK_BATCH_ENDPOINT = os.getenv("TASK_BATCH_ENDPOINT")
+TASK_BATCH_SIZE = int(os.getenv("TASK_BATCH_SIZE", "20"))
+# seconds the sender waits after the first task arrives for others to join the batch
+TASK_BATCH_WINDOW = float(os.getenv("TASK_BATCH_WINDOW", "0.05"))
+# concurrent POSTs per batch when there is no batch endpoint
+TASK_SENDERS = int(os.getenv("TASK_SENDERS", "4"))
+TASK_SPOOL_PATH = os.getenv("TASK_SPOOL_PATH") or sqlite_utils.data_path("task_spool.sqlite3")
+TASK_MAX_ATTEMPTS = int(os.getenv("TASK_MAX_ATTEMPTS", "20"))
+TASK_BACKOFF_BASE = float(os.getenv("TASK_BACKOFF_BASE", "1"))
+TASK_BACKOFF_MAX = float(os.getenv("TASK_BACKOFF_MAX", "300"))
+# public URL of this app; guests' tracking links point at its /tasks/<id> redirect
+TASK_TRACKING_URL = (os.getenv("TASK_TRACKING_URL") or "").rstrip("/")
+# sent and failed tasks are kept this long so tracking links keep working
+TASK_RETENTION = float(os.getenv("TASK_RETENTION", str(30 * 24 * 3600)))
+
+_PURGE_EVERY = 1000
+
+
+def _portal_id(body) -> str | None:
+    """The portal's id for a task from its response, or None if it sent none."""
+    portal_id = body.get("id") if isinstance(body, dict) else None
+    return None if portal_id is None else str(portal_id)
+
+
+class TaskDispatcher:
+    '''Spool of guest tasks in SQLite, sent to the admin portal by a background thread.
+
+    submit() only writes the task and returns a locally generated tracking id, so the
+    reply path never waits on the portal and a portal outage loses nothing: tasks stay
+    pending and are retried with backoff until they go through. Due tasks are sent in
+    micro-batches, one POST to TASK_BATCH_ENDPOINT or concurrent POSTs over the pooled
+    client, and the portal's id is recorded against the local one. Each task carries its
+    local id as "reference", so the portal can drop a task sent twice (a send cut off by a
+    crash or a timeout is repeated). Several processes may spool into one file, but only the
+    one holding the lock file next to it sends; the others check once a second and take
+    over when it exits.'''
+    def __init__(
+        self,
+        path: str = TASK_SPOOL_PATH,
+        endpoint: str = TASK_ENDPOINT,
+        batch_endpoint: str | None = TASK_BATCH_ENDPOINT,
+        batch_size: int = TASK_BATCH_SIZE,
+        batch_window: float = TASK_BATCH_WINDOW,
+        max_attempts: int = TASK_MAX_ATTEMPTS,
+    ):
+        self.path = path
+        self.endpoint = endpoint
+        self.batch_endpoint = batch_endpoint
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        self._conn = sqlite_utils.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS tasks ("
+            "local_id TEXT PRIMARY KEY, "
+            "payload TEXT NOT NULL, "
+            "status TEXT NOT NULL DEFAULT 'pending', "
+            "attempts INTEGER NOT NULL DEFAULT 0, "
+            "created_at REAL NOT NULL, "
+            "next_attempt_at REAL NOT NULL, "
+            "finished_at REAL, "
+            "portal_id TEXT, "
+            "last_error TEXT)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_due ON tasks (status, next_attempt_at)")
+        self._owner = sqlite_utils.FileLock(path + ".lock")
+        self._standby = False
+        self._pool = None
+        self._thread = None
+        self._running = False
+        self._submitted = 0
+        self._sent = 0
+        self._batches = 0
+        self._retries = 0
+        self._failed = 0
+        self._finished = 0
+
+    def submit(self, task_json: dict, local_id: str | None = None) -> str:
+        """Spools a task and wakes the sender. Returns the task's local tracking id."""
+        now = time.time()
+        with self._wakeup:
+            while True:
+                task_id = local_id or secrets.token_hex(5)
+                cursor = self._conn.execute(
+                    "INSERT OR IGNORE INTO tasks (local_id, payload, created_at, next_attempt_at) VALUES (?, ?, ?, ?)",
+                    (task_id, json.dumps(task_json), now, now),
+                )
+                # a generated id that collided is drawn again; a given one is only stored once
+                if cursor.rowcount or local_id:
+                    break
+            self._submitted += 1
+            self._wakeup.notify()
+        return task_id
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._running = True
+            if not self.batch_endpoint:
+                self._pool = ThreadPoolExecutor(max_workers=TASK_SENDERS, thread_name_prefix="task-sender")
+            self._thread = threading.Thread(target=self._run, name="task-dispatcher", daemon=True)
+            self._thread.start()
+            pending = self._conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'pending'").fetchone()[0]
+        logger.info("Started task dispatcher (%d pending)", pending)
+
+    def shutdown(self, timeout: float = 30.0):
+        """
+        Stops the sender after the batch in flight, waiting up to timeout seconds. Pending
+        tasks stay in the spool for the next start.
+        """
+        with self._wakeup:
+            self._running = False
+            thread, pool = self._thread, self._pool
+            self._thread = self._pool = None
+            self._wakeup.notify_all()
+        if not thread:
+            return
+        thread.join(timeout)
+        if pool:
+            pool.shutdown(wait=True)
+        with self._lock:
+            self._owner.release()
+        logger.info("Task dispatcher stopped with %d task(s) pending", self.depth())
+
+    def _run(self):
+        while True:
+            with self._wakeup:
+                if not self._running:
+                    return
+                wait = self._next_due_in() if self._owns_file() else 1.0
+                if wait > 0:
+                    self._wakeup.wait(min(wait, 1.0))
+                    continue
+            # let a burst (checkout morning) fill the batch before sending it
+            time.sleep(self.batch_window)
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT local_id, payload, attempts FROM tasks "
+                    "WHERE status = 'pending' AND next_attempt_at <= ? ORDER BY created_at LIMIT ?",
+                    (time.time(), self.batch_size),
+                ).fetchall()
+            if rows:
+                self._deliver(rows)
+
+    def _owns_file(self) -> bool:
+        # called with the lock held; only the process holding the lock file sends
+        if self._owner.held:
+            return True
+        if self._owner.acquire():
+            logger.info("Sending from the task spool at %s", self.path)
+            return True
+        if not self._standby:
+            logger.info("Task spool at %s is sent by another process; this one only spools", self.path)
+            self._standby = True
+        return False
+
+    def _next_due_in(self) -> float:
+        # called with the lock held; seconds until the next pending task is due (1.0 if there is none)
+        due = self._conn.execute("SELECT MIN(next_attempt_at) FROM tasks WHERE status = 'pending'").fetchone()[0]
+        return 1.0 if due is None else due - time.time()
+
+    def _post(self, url: str, body) -> tuple:
+        """Returns (response JSON, None) on a 2xx, else (None, (error, retryable)). A 2xx with
+        an empty or non-JSON body (201/204 from a portal that returns no id) gives (None, None):
+        the portal has the task, so it must not be sent again."""
+        try:
+            response = get_client(url).post(url, json=body)
+        except Exception as e:
+            return None, (str(e), True)
+        if 200 <= response.status_code < 300:
+            try:
+                return response.json(), None
+            except ValueError:
+                return None, None
+        retryable = response.status_code == 429 or response.status_code >= 500
+        return None, (f"HTTP {response.status_code}: {response.text[:200]}", retryable)
+
+    def _send(self, rows: list) -> list:
+        """Sends one batch; returns (portal_id, error) per row, error being (message, retryable) or None."""
+        payloads = [dict(json.loads(row[1]), reference=row[0]) for row in rows]
+        if self.batch_endpoint:
+            body, error = self._post(self.batch_endpoint, payloads)
+            if error:
+                return [(None, error)] * len(rows)
+            if body is None:
+                # a 2xx without a body: the portal has the tasks but sent no ids
+                return [(None, None)] * len(rows)
+            if not isinstance(body, list) or len(body) != len(rows):
+                # can't tell which tasks the portal took; resend them all, "reference" dedupes
+                error = (f"Batch endpoint answered {len(body) if isinstance(body, list) else type(body).__name__} "
+                         f"item(s) for {len(rows)} task(s)", True)
+                return [(None, error)] * len(rows)
+            return [(_portal_id(item), None) for item in body]
+        results = self._pool.map(lambda payload: self._post(self.endpoint, payload), payloads)
+        return [(_portal_id(body), None) if error is None else (None, error) for body, error in results]
+
+    def _deliver(self, rows: list):
+        started = time.perf_counter()
+        try:
+            results = self._send(rows)
+        except Exception as e:
+            results = [(None, (str(e), True))] * len(rows)
+        metrics.observe("portal", time.perf_counter() - started)
+        now = time.time()
+        with self._lock:
+            self._batches += 1
+            for (local_id, _, attempts), (portal_id, error) in zip(rows, results):
+                attempts += 1
+                if error is None:
+                    self._conn.execute(
+                        "UPDATE tasks SET status = 'sent', attempts = ?, finished_at = ?, portal_id = ? WHERE local_id = ?",
+                        (attempts, now, portal_id, local_id),
+                    )
+                    self._sent += 1
+                    logger.info("Task %s sent to the admin portal as %s", local_id, portal_id, extra={"event": "task.sent"})
+                elif error[1] and attempts < self.max_attempts:
+                    delay = backoff_delay(attempts, TASK_BACKOFF_BASE, TASK_BACKOFF_MAX)
+                    self._conn.execute(
+                        "UPDATE tasks SET attempts = ?, next_attempt_at = ?, last_error = ? WHERE local_id = ?",
+                        (attempts, now + delay, error[0], local_id),
+                    )
+                    self._retries += 1
+                    logger.warning("Sending task %s failed (%s), retrying in %.1fs", local_id, error[0], delay)
+                else:
+                    self._conn.execute(
+                        "UPDATE tasks SET status = 'failed', attempts = ?, finished_at = ?, last_error = ? WHERE local_id = ?",
+                        (attempts, now, error[0], local_id),
+                    )
+                    self._failed += 1
+                    logger.error("Giving up on task %s after %d attempt(s): %s", local_id, attempts, error[0])
+                self._finished += 1
+                if self._finished % _PURGE_EVERY == 0:
+                    self._conn.execute(
+                        "DELETE FROM tasks WHERE status != 'pending' AND finished_at < ?", (now - TASK_RETENTION,)
+                    )
+
+    def lookup(self, local_id: str) -> dict | None:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT status, portal_id, attempts, created_at FROM tasks WHERE local_id = ?", (local_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"local_id": local_id, "status": row[0], "portal_id": row[1], "attempts": row[2], "created_at": row[3]}
+
+    def depth(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM tasks WHERE status = 'pending'").fetchone()[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            depth, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM tasks WHERE status = 'pending'"
+            ).fetchone()
+            return {
+                "depth": depth,
+                "oldest_pending_seconds": round(time.time() - oldest, 2) if oldest else 0.0,
+                "sending": self._owner.held,
+                "submitted": self._submitted,
+                "sent": self._sent,
+                "batches": self._batches,
+                "avg_batch_size": round(self._finished / self._batches, 2) if self._batches else 0.0,
+                "retries": self._retries,
+                "failed": self._failed,
+            }
+
+
+_dispatcher: TaskDispatcher | None = None
+_dispatcher_lock = threading.Lock()
+_task_sink = None
+
+
+def get_task_dispatcher() -> TaskDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        with _dispatcher_lock:
+            if _dispatcher is None:
+                _dispatcher = TaskDispatcher()
+    return _dispatcher
+
+
+def use_task_sink(sink):
+    """Worker processes hand tasks to the webhook process, which owns the spool (see worker_pool)."""
+    global _task_sink
+    _task_sink = sink
+
+
+def submit_task(task_json: dict) -> str:
+    """Queues a task for the admin portal and returns its tracking id right away."""
+    if _task_sink is not None:
+        local_id = secrets.token_hex(5)
+        _task_sink(local_id, task_json)
+        return local_id
+    return get_task_dispatcher().submit(task_json)
+
+
+def tracking_text(local_id: str) -> str:
+    if TASK_TRACKING_URL:
+        return f"You can track your request status at this link: {TASK_TRACKING_URL}/tasks/{local_id}."
+    return f"Your request reference is {local_id}."
@@ -0,0 +1,69 @@
+import os
+import sqlite3
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# directory for local state (dedupe store, queues, caches)
+DATA_DIR = os.getenv("DATA_DIR", "var")
+
+
+def data_path(filename: str) -> str:
+    """Returns a path under DATA_DIR. The directory is created when the file is opened."""
+    return os.path.join(DATA_DIR, filename)
+
+
+def connect(path: str) -> sqlite3.Connection:
+    """
+    Opens a connection that can be shared between threads (callers serialize access
+    with their own lock) and by several processes (WAL mode, busy timeout).
+    """
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class FileLock:
+    '''Exclusive, non-blocking lock on a file, used to let one process at a time own a
+    background sender over a shared database. The OS releases it when the holder exits or
+    dies, so another process can take over by calling acquire() again.'''
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    @property
+    def held(self) -> bool:
+        return self._file is not None
+
+    def acquire(self) -> bool:
+        """Takes the lock if no other holder has it. Returns whether this one holds it."""
+        if self._file is not None:
+            return True
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        file = open(self.path, "a+")
+        try:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                file.seek(0)
+                msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            file.close()
+            return False
+        self._file = file
+        return True
+
+    def release(self):
+        if self._file is not None:
+            # closing the file drops the lock
+            self._file.close()
+            self._file = None
@@ -0,0 +1,44 @@
+import re
+import json
+from app.schema import Message
+
+try:
+    import orjson
+    _loads = orjson.loads
+except ImportError:  # fall back to the stdlib decoder
+    _loads = json.loads
+
+# a "messages" key (not the "field": "messages" value every change carries)
+_MESSAGES_KEY = re.compile(rb'"messages"\s*:')
+
+
+class InvalidWebhookBody(ValueError):
+    '''Raised when the webhook body is not JSON or not shaped like a WhatsApp payload.'''
+
+
+def parse_webhook_body(body: bytes) -> list[Message]:
+    """
+    Returns every guest message in a raw webhook body. Most callbacks are delivery/read
+    statuses, which carry no "messages" key at all, so those are acknowledged without
+    decoding the JSON; a body that is not even a JSON object is still rejected. Only the
+    message objects are validated into pydantic models; the Payload/Entry/Change/Value
+    envelope is walked as plain dicts.
+    """
+    # Meta never escapes key names, so a body without this key has no messages.
+    # A false positive (the text inside a message body) just falls through to the full parse.
+    if not _MESSAGES_KEY.search(body):
+        # a cheap shape check in place of the decode, so garbage still gets a 422
+        if not body.strip().startswith(b"{") or not body.rstrip().endswith(b"}"):
+            raise InvalidWebhookBody("Malformed webhook body: not a JSON object")
+        return []
+    try:
+        data = _loads(body)
+        raw_messages = [
+            message
+            for entry in data.get("entry") or []
+            for change in entry.get("changes") or []
+            for message in (change.get("value") or {}).get("messages") or []
+        ]
+    except (ValueError, AttributeError, TypeError) as e:
+        raise InvalidWebhookBody(f"Malformed webhook body: {str(e)}") from e
+    return [Message.model_validate(message) for message in raw_messages]
@@ -0,0 +1,72 @@
+"""
+Whether ANSWER_CACHE_MAX_DISTANCE separates rephrasings of a cached question from
+different questions that share most of their words ("when does the spa open" vs "when
+does the spa close"), using the embedding function the answer cache is configured with.
+
+Each pair is stored and looked up through a fresh AnswerCache. A rephrasing that misses
+costs one agent run; a different question that hits sends a guest the wrong answer, so
+false hits are the number to watch when changing the threshold or EMBEDDING_MODEL.
+
+Needs the embedding model (chromadb downloads its default MiniLM on first use).
+
+Run from the repo root:  python -m benchmarks.bench_answer_cache --max-distance 0.1
+"""
+import argparse
+import tempfile
+
+from app.domain.agents.answer_cache import ANSWER_CACHE_MAX_DISTANCE, AnswerCache
+
+# (cached question, new question): should be answered from the cache
+REPHRASINGS = [
+    ("When does the spa open?", "What time does the spa open?"),
+    ("When does the spa open?", "when does the spa open"),
+    ("Is the pool heated?", "Is the swimming pool heated?"),
+    ("What time is checkout?", "When is check-out?"),
+    ("What is the wifi password?", "What's the wifi password?"),
+    ("Are pets allowed?", "Can I bring my pet?"),
+    ("How far is the airport?", "How far away is the airport?"),
+    ("Is the gondola running today?", "Is the gondola open today?"),
+]
+# (cached question, new question): different answers, must not hit
+DIFFERENT = [
+    ("When does the spa open?", "When does the spa close?"),
+    ("What time does the bar open?", "What time does the bar close?"),
+    ("What time is checkout?", "What time is check-in?"),
+    ("Is the pool heated?", "Is the pool open?"),
+    ("Is the gondola running today?", "Is the gondola running tomorrow?"),
+    ("How far is the airport?", "How far is Vail?"),
+    ("Are pets allowed?", "Are pets allowed in the restaurant?"),
+    ("Is breakfast included?", "Is dinner included?"),
+]
+
+
+def distances(pairs, max_distance):
+    rows = []
+    for cached, asked in pairs:
+        with tempfile.TemporaryDirectory() as path:
+            cache = AnswerCache(path=path, max_distance=max_distance)
+            cache.store(cached, "answer", "")
+            result = cache._get_collection().query(query_texts=[asked.strip().lower()], n_results=1)
+            rows.append((cached, asked, result["distances"][0][0]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-distance", type=float, default=ANSWER_CACHE_MAX_DISTANCE)
+    args = parser.parse_args()
+
+    missed = hit_wrongly = 0
+    for label, pairs, should_hit in (("rephrasings", REPHRASINGS, True), ("different questions", DIFFERENT, False)):
+        print(f"{label} (should {'hit' if should_hit else 'miss'} at distance <= {args.max_distance})")
+        for cached, asked, distance in distances(pairs, args.max_distance):
+            hit = distance <= args.max_distance
+            wrong = hit != should_hit
+            missed += wrong and should_hit
+            hit_wrongly += wrong and not should_hit
+            print(f"  {distance:6.3f} {'hit ' if hit else 'miss'}{' <-' if wrong else '   '} {cached!r} -> {asked!r}")
+    print(f"{missed}/{len(REPHRASINGS)} rephrasings missed, {hit_wrongly}/{len(DIFFERENT)} different questions hit")
+
+
+if __name__ == "__main__":
+    main()
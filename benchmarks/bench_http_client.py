@@ -0,0 +1,99 @@
+"""
+Compares outbound Graph API sends against a local fake server:
+
+  requests  - bare requests.post per call (new TCP connection every time, the old behaviour)
+  pooled    - app.utils.http_utils.get_client (shared keep-alive pool, worker threads)
+  async     - app.utils.http_utils.get_async_client (keep-alive pool on one event loop)
+
+Run from the repo root:  python -m benchmarks.bench_http_client --requests 2000 --concurrency 16
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from app.utils import http_utils
+from benchmarks.fake_services import FakeGraphAPI, start_in_subprocess
+
+HEADERS = {"Authorization": "Bearer fake", "Content-Type": "application/json"}
+
+
+def _body(i: int) -> str:
+    return json.dumps({
+        "messaging_product": "whatsapp",
+        "recipient_type": "individual",
+        "to": f"1555000{i % 100:04d}",
+        "type": "text",
+        "text": {"body": "Your towels are on the way."},
+    })
+
+
+def _timed(send, i):
+    start = time.perf_counter()
+    response = send(i)
+    response.raise_for_status()
+    return time.perf_counter() - start
+
+
+def run_threaded(send, total, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        return list(pool.map(lambda i: _timed(send, i), range(total)))
+
+
+async def run_async(url, total, concurrency):
+    client = http_utils.get_async_client(url)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(url, headers=HEADERS, content=_body(i))
+            response.raise_for_status()
+            return time.perf_counter() - start
+
+    try:
+        return await asyncio.gather(*(one(i) for i in range(total)))
+    finally:
+        await http_utils.aclose_clients()
+
+
+def report(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    p50 = statistics.median(latencies)
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    print(f"{name:<10} {len(latencies) / elapsed:>10.1f} req/s   p50 {p50 * 1000:>7.2f} ms   p99 {p99 * 1000:>7.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=2.0, help="server-side delay per request")
+    args = parser.parse_args()
+
+    server_url, server = start_in_subprocess(FakeGraphAPI, latency=args.latency_ms / 1000)
+    url = f"{server_url}/v21.0/504587716075008/messages"
+    try:
+        modes = {
+            "requests": lambda: run_threaded(
+                lambda i: requests.post(url, headers=HEADERS, data=_body(i)), args.requests, args.concurrency),
+            "pooled": lambda: run_threaded(
+                lambda i: http_utils.get_client(url).post(url, headers=HEADERS, content=_body(i)), args.requests, args.concurrency),
+            "async": lambda: asyncio.run(run_async(url, args.requests, args.concurrency)),
+        }
+        print(f"{args.requests} sends, concurrency {args.concurrency}, server latency {args.latency_ms} ms")
+        for name, run in modes.items():
+            start = time.perf_counter()
+            latencies = run()
+            report(name, latencies, time.perf_counter() - start)
+    finally:
+        http_utils.close_clients()
+        server.terminate()
+
+
+if __name__ == "__main__":
+    main()
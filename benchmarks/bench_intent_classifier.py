@@ -0,0 +1,90 @@
+"""
+Accuracy and throughput of the intent/department classifier against the substring
+heuristics it replaced, on two labelled corpora:
+
+  tuned     - benchmarks/data/intent_corpus.jsonl, the messages taxonomy.json was tuned on
+  held-out  - benchmarks/data/intent_heldout.jsonl, written after the taxonomy and never
+              used to change it; keep it that way, or its accuracy means nothing
+
+  legacy    - any(keyword in message.lower()) for intent, first matching substring for department
+  compiled  - app.domain.agents.intent_classifier (one regex pass, batch API)
+
+Run from the repo root:  python -m benchmarks.bench_intent_classifier --messages 100000
+"""
+import argparse
+import json
+import pathlib
+import time
+
+from app.domain.agents.intent_classifier import IntentClassifier
+
+CORPUS_PATH = pathlib.Path(__file__).parent / "data" / "intent_corpus.jsonl"
+HELDOUT_PATH = pathlib.Path(__file__).parent / "data" / "intent_heldout.jsonl"
+
+LEGACY_ACTION_KEYWORDS = ["need", "send", "bring", "deliver", "request", "call", "help"]
+LEGACY_DEPARTMENTS = {
+    "towels": "Housekeeping",
+    "cleaning": "Housekeeping",
+    "room service": "Room Service",
+    "food": "Room Service",
+    "technical issue": "Maintenance",
+    "light": "Maintenance",
+    "leak": "Maintenance",
+    "heat": "Maintenance",
+    "air conditioning": "Maintenance",
+}
+
+
+def legacy_classify(message):
+    intent = "task" if any(keyword in message.lower() for keyword in LEGACY_ACTION_KEYWORDS) else "search"
+    department = "general"
+    for keyword, dept in LEGACY_DEPARTMENTS.items():
+        if keyword in message.lower():
+            department = dept
+            break
+    return intent, department
+
+
+def accuracy(rows, predictions):
+    intent_ok = sum(row["intent"] == intent for row, (intent, _) in zip(rows, predictions))
+    tasks = [(row, prediction) for row, prediction in zip(rows, predictions) if row["intent"] == "task"]
+    department_ok = sum(row["department"] == department for row, (_, department) in tasks)
+    return intent_ok / len(rows), department_ok / len(tasks)
+
+
+def load(path):
+    return [json.loads(line) for line in path.read_text().splitlines() if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=100000, help="messages classified for the throughput run")
+    args = parser.parse_args()
+
+    rows, heldout = load(CORPUS_PATH), load(HELDOUT_PATH)
+    texts = [row["text"] for row in rows + heldout]
+    batch = (texts * (args.messages // len(texts) + 1))[:args.messages]
+
+    start = time.perf_counter()
+    classifier = IntentClassifier.from_file()
+    build_ms = (time.perf_counter() - start) * 1000
+
+    runs = {
+        "legacy": lambda messages: [legacy_classify(message) for message in messages],
+        "compiled": lambda messages: [(c.intent, c.department) for c in classifier.classify_many(messages)],
+    }
+    print(f"{len(rows)} tuned and {len(heldout)} held-out labelled messages, throughput over {len(batch)} messages "
+          f"(classifier built in {build_ms:.1f} ms)")
+    print(f"{'':<10} {'tuned intent':>12} {'dept':>6} {'held-out intent':>15} {'dept':>6} {'msgs/sec':>12}")
+    for name, run in runs.items():
+        intent_acc, department_acc = accuracy(rows, run([row["text"] for row in rows]))
+        heldout_intent_acc, heldout_department_acc = accuracy(heldout, run([row["text"] for row in heldout]))
+        start = time.perf_counter()
+        run(batch)
+        rate = len(batch) / (time.perf_counter() - start)
+        print(f"{name:<10} {intent_acc:>12.1%} {department_acc:>6.1%} {heldout_intent_acc:>15.1%} "
+              f"{heldout_department_acc:>6.1%} {rate:>12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
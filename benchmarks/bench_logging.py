@@ -0,0 +1,114 @@
+"""
+Logging cost per guest message, on the thread that handles the message:
+
+  print + f-strings  - the statements a message used to go through: eager f-strings, print(),
+                       json.dumps(indent=2) of the send payload and its headers, basicConfig handler
+  queue + json       - app.utils.logging_utils: records queued as-is, formatted by the writer thread
+  queue + sampled    - same, with the per-message info events sampled at 10%
+
+Output goes to os.devnull, so this measures formatting and handler overhead, not the
+terminal. "drain" adds the time until the writer thread has written everything.
+
+Run from the repo root:  python -m benchmarks.bench_logging --messages 20000
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+
+from app.schema import User
+from app.utils import logging_utils
+
+USER = User(id=1, first_name="Ada", last_name="Guest", phone="+15550000000", role="default", room_number="407")
+MESSAGE = "Could you send two extra towels to my room?"
+REPLY = "Of course, Ada. Housekeeping will bring two extra towels to room 407 shortly."
+HEADERS = {"Authorization": "Bearer EAAG" + "x" * 180, "Content-Type": "application/json"}
+PAYLOAD = {
+    "messaging_product": "whatsapp", "preview_url": False, "recipient_type": "individual",
+    "to": USER.phone, "type": "text", "text": {"body": REPLY},
+}
+EVENTS = ("webhook.received", "auth.ok", "agent.route", "task.prepared", "agent.response", "whatsapp.send")
+
+
+def legacy_logs(logger: logging.Logger):
+    # the former per-message statements, copied from main, message_service and routing_agent
+    logger.info(f"Received request with {1} message(s) from {1} sender(s)")
+    logger.info(f"Attempting to authenticate user with phone number: {USER.phone}")
+    logger.info(f"User found: {USER.first_name} {USER.last_name}")
+    logger.info(f"User: {USER}")
+    logger.info(f"Processing {1} user message(s): {[MESSAGE]}")
+    print('User message:', MESSAGE)
+    logging.info("Handling task request")
+    print("Task JSON prepared: ", {"department": "Housekeeping", "guest_name": "Ada Guest", "room_number": "407", "request": MESSAGE})
+    print('Got agent response: ', REPLY)
+    url = "https://graph.facebook.com/v21.0/504587716075008/messages"
+    logging.info(f"Sending POST request to {url} with headers: {HEADERS} and data: {json.dumps(PAYLOAD, indent=2)}")
+    logging.info(f"Response Status Code: {200}")
+    logging.info(f"Response Body: {json.dumps({'messaging_product': 'whatsapp', 'messages': [{'id': 'wamid.x'}]})}")
+
+
+def structured_logs(logger: logging.Logger):
+    # the same message through the current statements
+    logger.info("Received request with %d message(s) from %d sender(s)", 1, 1, extra={"event": "webhook.received"})
+    logger.info("Authenticated guest %s", USER.id, extra={"event": "auth.ok"})
+    logger.info("Dispatching %d message(s) from %s", 1, USER.phone, extra={"event": "webhook.dispatch"})
+    logger.debug("User message: %s", MESSAGE)
+    logger.info("Handling task request", extra={"event": "agent.route"})
+    logger.info("Task prepared for %s", "Housekeeping", extra={"event": "task.prepared"})
+    logger.info("Replying to %s", USER.phone, extra={"event": "agent.response"})
+    logger.debug("Agent response for %s: %s", USER.phone, REPLY)
+    logger.info("Sent WhatsApp message to %s: %s", USER.phone, 200, extra={"event": "whatsapp.send"})
+    logger.debug("WhatsApp payload %s, response %s", PAYLOAD, "{}")
+
+
+def measure(emit, logger: logging.Logger, messages: int, drain) -> tuple[float, float]:
+    """Returns (caller, caller + drain) seconds per message. print() output goes to devnull."""
+    stdout = sys.stdout
+    with open(os.devnull, "w") as devnull:
+        sys.stdout = devnull
+        try:
+            start = time.perf_counter()
+            for _ in range(messages):
+                emit(logger)
+            caller = time.perf_counter() - start
+            drain()
+            total = time.perf_counter() - start
+        finally:
+            sys.stdout = stdout
+    return caller / messages, total / messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000)
+    args = parser.parse_args()
+    logger = logging.getLogger("bench")
+    root = logging.getLogger()
+
+    print(f"{'':<18} {'us/msg':>10} {'+ drain':>10}")
+    with open(os.devnull, "w") as devnull:
+        for label, emit, sample_rates in (
+            ("print + f-strings", legacy_logs, None),
+            ("queue + json", structured_logs, ""),
+            ("queue + sampled", structured_logs, ",".join(f"{event}=0.1" for event in EVENTS)),
+        ):
+            if sample_rates is None:
+                logging_utils.stop_logging()
+                for handler in list(root.handlers):
+                    root.removeHandler(handler)
+                logging.basicConfig(level=logging.INFO, stream=devnull)
+                drain = devnull.flush
+            else:
+                # room for every record, so nothing is dropped and all of them are paid for
+                logging_utils.configure_logging(
+                    stream=devnull, level="INFO", sample_rates=sample_rates, queue_size=args.messages * 10
+                )
+                drain = logging_utils.stop_logging
+            caller, total = measure(emit, logger, args.messages, drain)
+            print(f"{label:<18} {caller * 1e6:>10.1f} {total * 1e6:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
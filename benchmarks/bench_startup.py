@@ -0,0 +1,104 @@
+"""
+Import-time and cold-start benchmark, to catch startup regressions:
+
+  import      - wall time of `import app.main` in a fresh interpreter (median of --runs)
+  cold start  - launch uvicorn and poll until /health answers 200
+
+The agent stack is built lazily, so neither number includes langchain, the hub prompt or
+any network call. Exits non-zero when a --max-* budget is exceeded, so it can gate CI.
+
+Run from the repo root:  python -m benchmarks.bench_startup --runs 5 --max-import-ms 1500
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+import httpx
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+
+
+def _env():
+    env = dict(os.environ, AGENT_WARMUP="0")
+    env.pop("OPENAI_API_KEY", None)
+    return env
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], env=_env(), capture_output=True, text=True, check=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def slowest_imports(limit: int = 8) -> list[tuple[int, str]]:
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"], env=_env(), capture_output=True, text=True
+    ).stderr
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        # modules pulled in directly by app.main and its first-level imports
+        if 1 <= depth <= 2:
+            rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def measure_cold_start(timeout: float = 30.0) -> float:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    start = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=_env(),
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - start < timeout:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/health", timeout=0.5).status_code == 200:
+                    return time.perf_counter() - start
+            except httpx.TransportError:
+                pass
+            time.sleep(0.02)
+        raise TimeoutError(f"/health did not answer within {timeout} seconds")
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, help="fail if median import time exceeds this")
+    parser.add_argument("--max-boot-ms", type=float, help="fail if median cold start exceeds this")
+    args = parser.parse_args()
+
+    import_ms = statistics.median(measure_import() for _ in range(args.runs)) * 1000
+    boot_ms = statistics.median(measure_cold_start() for _ in range(args.runs)) * 1000
+    print(f"import app.main   median {import_ms:8.1f} ms over {args.runs} runs")
+    print(f"cold start        median {boot_ms:8.1f} ms to first /health 200")
+    print("slowest imports under app.main (cumulative):")
+    for cumulative_us, name in slowest_imports():
+        print(f"  {cumulative_us / 1000:8.1f} ms  {name}")
+
+    failed = False
+    if args.max_import_ms and import_ms > args.max_import_ms:
+        print(f"FAIL: import {import_ms:.1f} ms > budget {args.max_import_ms} ms")
+        failed = True
+    if args.max_boot_ms and boot_ms > args.max_boot_ms:
+        print(f"FAIL: cold start {boot_ms:.1f} ms > budget {args.max_boot_ms} ms")
+        failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
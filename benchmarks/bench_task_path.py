@@ -0,0 +1,102 @@
+"""
+End-to-end latency of the task path (RoutingAgent._prepare_task_json) with stubbed services:
+
+  sequential - LLM acknowledgement, then the portal POST (the old behaviour)
+  spooled    - the task goes into the local spool and the guest gets its tracking id at
+               once; the task dispatcher sends it to the portal in the background
+
+The LLM is a stub that sleeps --llm-latency seconds; the admin portal is a local fake
+answering after --portal-latency seconds. The "slow llm" rows make the stub miss
+TASK_ACK_DEADLINE to show the templated acknowledgement kicking in. The last line shows
+how many tasks reached the portal and in how many requests (--batch uses the portal's
+batch endpoint).
+
+Run from the repo root:  python -m benchmarks.bench_task_path --requests 50
+"""
+import os
+import time
+import argparse
+import tempfile
+import statistics
+
+from benchmarks.fake_services import FakeAdminPortal
+
+
+class StubLLM:
+    def __init__(self, latency: float):
+        self.latency = latency
+
+    def invoke(self, messages):
+        time.sleep(self.latency)
+        return {"content": "Thank you, your request is with our team and they are working on it."}
+
+
+def _run(label, handle, messages):
+    latencies = []
+    for message in messages:
+        start = time.perf_counter()
+        handle(message)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"{label:<26} {statistics.median(latencies) * 1000:>8.0f} "
+          f"{latencies[int(len(latencies) * 0.95) - 1] * 1000:>8.0f} {latencies[-1] * 1000:>8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50)
+    parser.add_argument("--llm-latency", type=float, default=0.8)
+    parser.add_argument("--portal-latency", type=float, default=0.3)
+    parser.add_argument("--batch", action="store_true", help="send tasks to the portal's batch endpoint")
+    args = parser.parse_args()
+
+    portal = FakeAdminPortal(latency=args.portal_latency).start()
+    os.environ["ADMIN_PORTAL_URL"] = portal.url
+    os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="bench-task-path-")
+    if args.batch:
+        os.environ["TASK_BATCH_ENDPOINT"] = f"{portal.url}/api/tasks/batch"
+    os.environ.setdefault("TASK_ACK_DEADLINE", str(args.llm_latency + 0.5))
+
+    from app.schema import User
+    from app.domain.agents import agent_stack, routing_agent
+    from app.utils import request_utils
+    from app.utils.http_utils import get_client
+
+    user = User(id=1, first_name="Ada", last_name="Guest", phone="+15550000000", role="guest", room_number="407")
+    agent = routing_agent.RoutingAgent(user)
+    messages = [f"Could you send two extra towels to my room? ({i})" for i in range(args.requests)]
+
+    def sequential(message):
+        task_json = {"department": "Housekeeping", "guest_name": agent.guest_name,
+                     "room_number": agent.room_number, "request": message}
+        reply = agent.assure_guest(task_json)
+        response = get_client(request_utils.TASK_ENDPOINT).post(request_utils.TASK_ENDPOINT, json=task_json)
+        return reply + f"\n\n{request_utils.ADMIN_PORTAL_URL}/view-task/{response.json()['id']}"
+
+    def spooled(message):
+        return agent._prepare_task_json(message, "Housekeeping")
+
+    print(f"llm {args.llm_latency:.2f}s, portal {args.portal_latency:.2f}s, "
+          f"ack deadline {routing_agent.TASK_ACK_DEADLINE:.2f}s, {args.requests} tasks")
+    print(f"{'mode':<26} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    dispatcher = request_utils.get_task_dispatcher()
+    dispatcher.start()
+    agent_stack._llm = StubLLM(args.llm_latency)
+    _run("sequential", sequential, messages)
+    _run("spooled", spooled, messages)
+
+    agent_stack._llm = StubLLM(routing_agent.TASK_ACK_DEADLINE + 1.0)
+    slow = messages[: max(3, args.requests // 10)]
+    _run("sequential (slow llm)", sequential, slow)
+    _run("spooled (slow llm)", spooled, slow)
+
+    while dispatcher.depth():
+        time.sleep(0.05)
+    dispatcher.shutdown()
+    stats = dispatcher.stats()
+    print(f"spooled tasks at the portal: {stats['sent']} in {stats['batches']} batches")
+    portal.stop()
+
+
+if __name__ == "__main__":
+    main()
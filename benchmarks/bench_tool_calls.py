@@ -0,0 +1,78 @@
+"""
+Tool calls and external Tavily calls per answer, with and without the local hotel
+knowledge base ahead of web search.
+
+Needs an OpenAI-compatible chat endpoint that supports tool calling (the local Ollama by
+default, see OLLAMA_BASE_URL / LLM_MODEL). Tavily is replaced by a local fake so external
+calls can be counted; each question set is asked twice to show the Tavily cache.
+
+Run from the repo root:  python -m benchmarks.bench_tool_calls
+"""
+import os
+import time
+import argparse
+import statistics
+
+from benchmarks.fake_services import FakeTavily
+
+QUESTIONS = [
+    "When does the spa open?",
+    "Is the pool heated and until what time is it open?",
+    "What time is check-out?",
+    "Is room service available at night?",
+    "Can I bring my dog?",
+    "What's the weather forecast in Beaver Creek tomorrow?",
+    "Are there any concerts in Vail this weekend?",
+    "Is the gondola running today?",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=2, help="times each question set is asked")
+    args = parser.parse_args()
+
+    tavily = FakeTavily(latency=0.3).start()
+    os.environ["TAVILY_API_URL"] = tavily.url
+    # the questions above are answered by the example corpus
+    os.environ.setdefault("HOTEL_KB_PATH", "data/hotel_kb.example.jsonl")
+    os.environ.setdefault("TAVILY_API_KEY", "fake")
+
+    from langchain_core.callbacks import BaseCallbackHandler
+    from langgraph.prebuilt import create_react_agent
+    from app.domain.agents import agent_stack, tools
+
+    class ToolCounter(BaseCallbackHandler):
+        def __init__(self):
+            self.calls = 0
+
+        def on_tool_start(self, serialized, input_str, **kwargs):
+            self.calls += 1
+
+    try:
+        prompt = agent_stack.get_react_prompt()
+    except Exception as e:
+        print(f"Hub prompt unavailable ({e}); using a plain system prompt")
+        prompt = "You are a helpful hotel concierge. Use the tools to answer."
+
+    print(f"{'mode':<16} {'round':>5} {'tool calls/req':>15} {'tavily calls/req':>17} {'p50 s':>7} {'max s':>7}")
+    for mode, include_knowledge_base in (("web only", False), ("kb + web", True)):
+        executor = create_react_agent(agent_stack.get_llm(), tools.build_tools(include_knowledge_base), messages_modifier=prompt)
+        tools._search_cache.clear()
+        for round_number in range(1, args.rounds + 1):
+            calls, latencies = [], []
+            tavily_before = tavily.requests
+            for question in QUESTIONS:
+                counter = ToolCounter()
+                start = time.perf_counter()
+                executor.invoke({"messages": [("user", question)]}, config={"callbacks": [counter]})
+                latencies.append(time.perf_counter() - start)
+                calls.append(counter.calls)
+            tavily_calls = tavily.requests - tavily_before
+            print(f"{mode:<16} {round_number:>5} {statistics.mean(calls):>15.2f} "
+                  f"{tavily_calls / len(QUESTIONS):>17.2f} {statistics.median(latencies):>7.2f} {max(latencies):>7.2f}")
+    tavily.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""
+Per-request webhook parse cost on the recorded payloads in benchmarks/payloads/:
+
+  pydantic  - json.loads + full Payload validation (what FastAPI did with a Payload body param)
+  fast      - app.utils.webhook_utils.parse_webhook_body (status short-circuit, messages-only models)
+
+Run from the repo root:  python -m benchmarks.bench_webhook_parse --iterations 20000
+"""
+import argparse
+import json
+import pathlib
+import time
+
+from app.schema import Payload
+from app.utils.webhook_utils import parse_webhook_body
+
+PAYLOAD_DIR = pathlib.Path(__file__).parent / "payloads"
+
+
+def parse_with_pydantic(body: bytes):
+    payload = Payload.model_validate(json.loads(body))
+    return [
+        message
+        for entry in payload.entry
+        for change in entry.changes
+        for message in change.value.messages or []
+    ]
+
+
+def per_call_us(fn, body, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        fn(body)
+    return (time.perf_counter() - start) / iterations * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'payload':<24} {'pydantic us':>12} {'fast us':>10} {'speedup':>8}")
+    for path in sorted(PAYLOAD_DIR.glob("*.json")):
+        body = path.read_bytes()
+        assert len(parse_with_pydantic(body)) == len(parse_webhook_body(body)), path.name
+        slow = per_call_us(parse_with_pydantic, body, args.iterations)
+        fast = per_call_us(parse_webhook_body, body, args.iterations)
+        print(f"{path.stem:<24} {slow:>12.2f} {fast:>10.2f} {slow / fast:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
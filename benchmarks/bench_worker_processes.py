@@ -0,0 +1,149 @@
+"""
+Reply throughput of single-process mode against WORKER_PROCESSES=N.
+
+Every configuration answers the same messages with the real reply path
+(message_service.respond_and_send_messages: intent classifier, RoutingAgent, the LangGraph
+agent or the task fan-out, guest memory). The upstreams are stubbed: the LLM, Tavily
+and the admin portal are local fakes, each in its own process so they don't compete for
+the GIL, and replies are counted where they would be handed to the outbox. The LLM
+gateway's in-flight cap is lifted, so the LLM slots don't limit the throughput measured here.
+
+  threads     - MessageDispatcher in this process (WORKER_PROCESSES=0)
+  N processes - WorkerPool, guests hashed over N worker processes
+
+With the stub latencies small, throughput is bound by the Python work per message. That
+work runs under one GIL in single-process mode and scales with the number of processes
+up to the number of cores, so run this on a machine with at least as many cores as the
+largest N.
+
+Run from the repo root:  python -m benchmarks.bench_worker_processes --messages 400 --processes 1,2,4
+"""
+import os
+import json
+import time
+import random
+import argparse
+import tempfile
+import threading
+
+from benchmarks.fake_services import FakeAdminPortal, FakeOpenAI, FakeTavily, start_in_subprocess
+from benchmarks.loadtest import CORPUS_PATH, _seed_prompt_cache
+
+
+class ReplyCounter:
+    def __init__(self):
+        self.count = 0
+        self._cond = threading.Condition()
+
+    def __call__(self, to, message, template=False):
+        with self._cond:
+            self.count += 1
+            self._cond.notify_all()
+
+    def wait_for(self, count: int, timeout: float) -> bool:
+        with self._cond:
+            return self._cond.wait_for(lambda: self.count >= count, timeout)
+
+
+def _messages(count: int, guests: int, seed: int):
+    from app.schema import User
+
+    with open(CORPUS_PATH) as f:
+        texts = [json.loads(line)["text"] for line in f if line.strip()]
+    users = [
+        User(id=i, first_name="Guest", last_name=str(i), phone=f"+1555{i:07d}", role="default", room_number=str(100 + i))
+        for i in range(guests)
+    ]
+    rng = random.Random(seed)
+    return [(rng.choice(users), f"{rng.choice(texts)} [req {n}]") for n in range(count)]
+
+
+def _measure(dispatcher, counter: ReplyCounter, messages, timeout: float) -> float | None:
+    """Submits every message at once and returns replies per second, or None on timeout."""
+    from app.domain import message_service
+
+    start_count = counter.count
+    start = time.perf_counter()
+    for user, text in messages:
+        dispatcher.submit(user.phone, message_service.respond_and_send_messages, [text], user)
+    if not counter.wait_for(start_count + len(messages), timeout):
+        return None
+    return len(messages) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=400)
+    parser.add_argument("--guests", type=int, default=200)
+    parser.add_argument("--processes", default="1,2,4", help="comma-separated worker process counts")
+    parser.add_argument("--threads", type=int, default=8, help="dispatch threads per process")
+    parser.add_argument("--llm-latency", type=float, default=0.01)
+    parser.add_argument("--timeout", type=float, default=600)
+    args = parser.parse_args()
+
+    llm_url, llm = start_in_subprocess(FakeOpenAI, latency=args.llm_latency, tool_rate=0.5)
+    tavily_url, tavily = start_in_subprocess(FakeTavily)
+    portal_url, portal = start_in_subprocess(FakeAdminPortal)
+    workdir = tempfile.mkdtemp(prefix="bench-workers-")
+    # set before the app is imported here, and inherited by the worker processes
+    os.environ.update(
+        OLLAMA_BASE_URL=f"{llm_url}/v1",
+        TAVILY_API_URL=tavily_url,
+        TAVILY_API_KEY="bench",
+        ADMIN_PORTAL_URL=portal_url,
+        DATA_DIR=workdir,
+        PROMPT_CACHE_DIR=os.path.join(workdir, "prompts"),
+        LLM_MAX_IN_FLIGHT="1000",
+        HOTEL_KB_ENABLED="0",
+        ANSWER_CACHE_ENABLED="0",
+        LOG_LEVEL="WARNING",
+    )
+    _seed_prompt_cache()
+
+    from app.domain import message_service
+    from app.domain.agents import agent_stack
+    from app.domain.dispatch_service import MessageDispatcher
+    from app.domain.worker_pool import WorkerPool
+    from app.utils import logging_utils
+    logging_utils.configure_logging(level="WARNING")
+
+    messages = _messages(args.messages, args.guests, seed=1)
+    warmup = _messages(args.guests, args.guests, seed=2)
+    counter = ReplyCounter()
+    print(f"{os.cpu_count()} CPU(s), {args.messages} messages from {args.guests} guests, "
+          f"{args.threads} threads per process, LLM stub {args.llm_latency * 1000:.0f} ms")
+    print(f"{'':<14} {'replies/s':>10} {'speedup':>8}")
+
+    baseline = None
+    try:
+        for processes in [0] + [int(n) for n in args.processes.split(",")]:
+            if processes == 0:
+                label = "threads"
+                agent_stack.warm_up(retry=False)
+                message_service.use_reply_sink(counter)
+                dispatcher = MessageDispatcher(num_workers=args.threads, queue_size=args.messages)
+                dispatcher.start()
+            else:
+                label = f"{processes} processes"
+                message_service.use_reply_sink(None)
+                dispatcher = WorkerPool(processes, queue_size=args.messages, threads_per_process=args.threads,
+                                        thread_queue_size=args.messages, on_reply=counter)
+                dispatcher.start()
+                while not dispatcher.ready():
+                    time.sleep(0.1)
+            # first messages build per-process clients and guest sessions
+            _measure(dispatcher, counter, warmup, args.timeout)
+            rate = _measure(dispatcher, counter, messages, args.timeout)
+            dispatcher.shutdown(timeout=30)
+            if rate is None:
+                print(f"{label:<14} {'timed out':>10}")
+                continue
+            baseline = baseline or rate
+            print(f"{label:<14} {rate:>10.1f} {rate / baseline:>7.2f}x")
+    finally:
+        for process in (llm, tavily, portal):
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()
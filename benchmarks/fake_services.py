@@ -0,0 +1,246 @@
+"""
+Local stand-ins for the services the app talks to, for benchmarks only.
+Each fake runs a keep-alive HTTP/1.1 server on a background thread and adds a
+configurable delay before answering, drawn from one of DISTRIBUTIONS.
+"""
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# latency is the base (uniform), median (lognormal) or mean (exponential) delay in seconds;
+# jitter is the uniform spread or the lognormal sigma
+DISTRIBUTIONS = ("uniform", "lognormal", "exponential")
+
+
+def parse_latency(spec: str) -> dict:
+    """
+    Parses a command-line latency spec into FakeService keyword arguments:
+    "0.3" (fixed), "0.3+0.2" (uniform 0.3-0.5), "lognormal:0.8:0.5", "exponential:0.3".
+    """
+    if ":" in spec:
+        distribution, _, rest = spec.partition(":")
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"unknown latency distribution {distribution!r}")
+        latency, _, jitter = rest.partition(":")
+        return {"latency": float(latency), "jitter": float(jitter or 0), "distribution": distribution}
+    latency, _, jitter = spec.partition("+")
+    return {"latency": float(latency), "jitter": float(jitter or 0), "distribution": "uniform"}
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the stdlib default backlog of 5 drops SYNs under concurrent connects
+    request_queue_size = 512
+
+
+class FakeService:
+    '''Base class: subclasses implement handle(method, path, body) -> (status, body).'''
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, distribution: str = "uniform",
+                 host: str = "127.0.0.1", port: int = 0):
+        if distribution not in DISTRIBUTIONS:
+            raise ValueError(f"unknown latency distribution {distribution!r}")
+        self.latency = latency
+        self.jitter = jitter
+        self.distribution = distribution
+        self.requests = 0
+        self._lock = threading.Lock()
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _dispatch(self, method):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                with service._lock:
+                    service.requests += 1
+                delay = service.delay()
+                if delay:
+                    time.sleep(delay)
+                status, response = service.handle(method, self.path, body)
+                if isinstance(response, (dict, list)):
+                    response = json.dumps(response).encode("utf-8")
+                    content_type = "application/json"
+                elif isinstance(response, str):
+                    response = response.encode("utf-8")
+                    content_type = "text/plain; charset=utf-8"
+                else:
+                    content_type = "application/octet-stream"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(response)))
+                self.end_headers()
+                self.wfile.write(response)
+
+            def do_GET(self):
+                self._dispatch("GET")
+
+            def do_POST(self):
+                self._dispatch("POST")
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = _Server((host, port), Handler)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self) -> float:
+        if self.distribution == "lognormal":
+            return self.latency * math.exp(random.gauss(0, self.jitter)) if self.latency else 0.0
+        if self.distribution == "exponential":
+            return random.expovariate(1 / self.latency) if self.latency else 0.0
+        return self.latency + random.uniform(0, self.jitter)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def handle(self, method: str, path: str, body: bytes):
+        raise NotImplementedError
+
+
+class FakeGraphAPI(FakeService):
+    '''WhatsApp Cloud API: message sends and the two-hop media download.'''
+    def __init__(self, *args, media: bytes = b"\x00" * 16384, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.media = media
+        self.sent: list[dict] = []
+
+    def handle(self, method, path, body):
+        parts = path.strip("/").split("/")
+        if method == "POST" and parts[-1] == "messages":
+            message = json.loads(body)
+            with self._lock:
+                self.sent.append({"to": message.get("to"), "body": message, "received_at": time.monotonic()})
+            return 200, {"messaging_product": "whatsapp", "messages": [{"id": f"wamid.fake{len(self.sent)}"}]}
+        if method == "GET" and parts[0] == "media":
+            return 200, self.media
+        if method == "GET" and len(parts) == 2:
+            return 200, {"url": f"{self.url}/media/{parts[1]}", "id": parts[1]}
+        return 404, {"error": {"message": f"unknown path {path}"}}
+
+
+class FakeTavily(FakeService):
+    '''Tavily search API: POST /search returns canned results echoing the query.'''
+    def handle(self, method, path, body):
+        if method == "POST" and path.rstrip("/") == "/search":
+            query = json.loads(body).get("query", "")
+            return 200, {
+                "query": query,
+                "results": [
+                    {"title": f"Result {i}", "url": f"https://example.com/{i}", "content": f"Snippet {i} about {query}."}
+                    for i in range(2)
+                ],
+            }
+        return 404, {"detail": f"unknown path {path}"}
+
+
+class FakeAdminPortal(FakeService):
+    '''Admin portal: POST /api/tasks stores the task and returns its id; POST /api/tasks/batch
+    takes a list of tasks and returns their ids in order.'''
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tasks: list[dict] = []
+        self.batches = 0
+
+    def _store(self, task: dict) -> dict:
+        with self._lock:
+            self.tasks.append(task)
+            return {"id": len(self.tasks), "status": "pending"}
+
+    def handle(self, method, path, body):
+        if method == "POST" and path.rstrip("/") == "/api/tasks":
+            return 201, self._store(json.loads(body))
+        if method == "POST" and path.rstrip("/") == "/api/tasks/batch":
+            with self._lock:
+                self.batches += 1
+            return 201, [self._store(task) for task in json.loads(body)]
+        return 404, {"error": f"unknown path {path}"}
+
+
+class FakeOpenAI(FakeService):
+    '''OpenAI-compatible API: chat completions for the agent and the acknowledgement (in
+    place of Ollama), and Whisper transcriptions.
+
+    Any "[req N]" markers in the conversation are echoed in the answer, so a load test can
+    match replies to requests. When tools are offered and no tool has answered yet, a
+    tool_rate share of requests first call web_search. A transcription answers with
+    transcripts[N % len] for a file named "...-N.<ext>", tagged "[req N]".'''
+    MARKER = re.compile(r"\[req \d+\]")
+    FILE_NUMBER = re.compile(rb'filename="[^"]*?-(\d+)\.')
+
+    def __init__(self, *args, tool_rate: float = 0.5, transcripts: list[str] | None = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tool_rate = tool_rate
+        self.transcripts = transcripts or ["What time does the spa open?"]
+
+    def _completion(self, message: dict, finish_reason: str) -> dict:
+        return {
+            "id": f"chatcmpl-fake{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": "fake",
+            "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 10, "total_tokens": 20},
+        }
+
+    def handle(self, method, path, body):
+        if method == "POST" and path.endswith("/chat/completions"):
+            request = json.loads(body)
+            messages = request.get("messages", [])
+            markers = self.MARKER.findall(json.dumps(messages))
+            tag = " ".join(dict.fromkeys(markers))
+            answered_by_tool = any(message.get("role") == "tool" for message in messages)
+            number = int(markers[0][5:-1]) if markers else 0
+            if request.get("tools") and not answered_by_tool and number % 100 < self.tool_rate * 100:
+                question = next((m.get("content") for m in messages if m.get("role") == "user"), "")
+                return 200, self._completion({
+                    "role": "assistant",
+                    "content": "",
+                    "tool_calls": [{
+                        "id": f"call_{self.requests}",
+                        "type": "function",
+                        "function": {"name": "web_search", "arguments": json.dumps({"query": str(question)[:200]})},
+                    }],
+                }, "tool_calls")
+            content = f"Thank you for reaching out, we are happy to help. {tag}".strip()
+            return 200, self._completion({"role": "assistant", "content": content}, "stop")
+        if method == "POST" and path.endswith("/audio/transcriptions"):
+            match = self.FILE_NUMBER.search(body)
+            number = int(match.group(1)) if match else 0
+            return 200, f"{self.transcripts[number % len(self.transcripts)]} [req {number}]"
+        return 404, {"error": {"message": f"unknown path {path}"}}
+
+
+def _serve(factory, kwargs, urls):
+    service = factory(**kwargs)
+    urls.put(service.url)
+    service._server.serve_forever()
+
+
+def start_in_subprocess(factory, **kwargs):
+    """
+    Runs a fake in its own process so the server does not compete with the code under
+    test for the GIL. Returns (url, process); call process.terminate() when done.
+    """
+    import multiprocessing
+
+    urls = multiprocessing.Queue()
+    process = multiprocessing.Process(target=_serve, args=(factory, kwargs, urls), daemon=True)
+    process.start()
+    return urls.get(timeout=10), process
+
@@ -0,0 +1,424 @@
+"""
+Load test of the real app: runs `uvicorn app.main:app` in a subprocess with every upstream
+replaced by a local fake, and POSTs WhatsApp webhook payloads at a target rate.
+
+  OpenAI-compatible LLM (agent + acknowledgements) and Whisper - FakeOpenAI
+  Tavily                                                         - FakeTavily
+  Graph API (replies and voice-note media)                       - FakeGraphAPI
+  admin portal /api/tasks                                        - FakeAdminPortal
+
+Messages are synthetic (search and task questions from benchmarks/data/intent_corpus.jsonl,
+plus voice notes) or replayed from recorded payloads (--payloads), re-addressed to
+synthetic guests. Each message carries a "[req N]" marker that the fake LLM echoes, so a
+reply reaching the fake Graph API is matched back to the webhook POST that caused it.
+
+Reports throughput, webhook and end-to-end reply latency (p50/p95/p99), and the app's
+peak thread count and RSS. Results are saved as JSON under benchmarks/results/; pass
+--compare with an earlier file to print the two runs side by side.
+
+Run from the repo root:
+
+  python -m benchmarks.loadtest --rps 20 --duration 60 --llm-latency lognormal:0.8:0.4
+  python -m benchmarks.loadtest --rps 20 --duration 60 --env DISPATCH_WORKERS=16 \\
+      --compare benchmarks/results/loadtest-<earlier run>.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import tempfile
+import threading
+import subprocess
+
+import httpx
+
+from benchmarks.fake_services import (
+    FakeAdminPortal, FakeGraphAPI, FakeOpenAI, FakeTavily, parse_latency,
+)
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CORPUS_PATH = os.path.join(HERE, "data", "intent_corpus.jsonl")
+RESULTS_DIR = os.path.join(HERE, "results")
+MARKER = re.compile(r"\[req (\d+)\]")
+
+# transcripts the fake Whisper returns for voice notes
+VOICE_NOTES = [
+    "What time does the spa open tomorrow?",
+    "Can you bring two extra towels to my room?",
+    "Is the gondola running today?",
+]
+
+
+def _percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))]
+
+
+def _latency_summary(values: list[float]) -> dict:
+    return {
+        "count": len(values),
+        "p50": _percentile(values, 0.50),
+        "p95": _percentile(values, 0.95),
+        "p99": _percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class PayloadFactory:
+    '''Builds the webhook body for request n: a synthetic text or voice message, or a
+    recorded payload with its messages re-addressed to a synthetic guest.'''
+    def __init__(self, guests: list[str], mix: dict[str, float], recorded: list[dict], seed: int):
+        self.guests = guests
+        self.mix = mix
+        self.recorded = recorded
+        self.random = random.Random(seed)
+        with open(CORPUS_PATH) as f:
+            corpus = [json.loads(line) for line in f if line.strip()]
+        self.texts = {
+            intent: [row["text"] for row in corpus if row["intent"] == intent] for intent in ("search", "task")
+        }
+
+    @staticmethod
+    def _envelope(messages: list[dict]) -> dict:
+        return {
+            "object": "whatsapp_business_account",
+            "entry": [{
+                "id": "loadtest",
+                "changes": [{
+                    "field": "messages",
+                    "value": {
+                        "messaging_product": "whatsapp",
+                        "metadata": {"display_phone_number": "15550000000", "phone_number_id": "loadtest"},
+                        "messages": messages,
+                    },
+                }],
+            }],
+        }
+
+    def _readdress(self, message: dict, n: int, phone: str):
+        message.update({"from": phone, "id": f"wamid.load{n}.{message.get('id', '')}", "timestamp": str(int(time.time()))})
+        if message.get("type") == "audio":
+            message["audio"].update({"id": f"media-{n}", "sha256": f"loadtest-{n}"})
+        elif message.get("text"):
+            message["text"]["body"] = f"{message['text']['body']} [req {n}]"
+
+    def build(self, n: int) -> tuple[dict, bool]:
+        """Returns (payload, expects_reply)."""
+        phone = self.random.choice(self.guests)
+        if self.recorded:
+            payload = json.loads(json.dumps(self.random.choice(self.recorded)))
+            messages = [
+                message
+                for entry in payload.get("entry", [])
+                for change in entry.get("changes", [])
+                for message in change.get("value", {}).get("messages", [])
+            ]
+            for message in messages:
+                self._readdress(message, n, phone)
+            return payload, any(message.get("type") in ("text", "audio") for message in messages)
+        kind = self.random.choices(list(self.mix), weights=list(self.mix.values()))[0]
+        if kind == "audio":
+            message = {
+                "type": "audio",
+                "audio": {"mime_type": "audio/ogg; codecs=opus", "sha256": "", "id": "", "voice": True},
+            }
+        else:
+            message = {"type": "text", "text": {"body": self.random.choice(self.texts[kind])}}
+        self._readdress(message, n, phone)
+        return self._envelope([message]), True
+
+
+class ProcessSampler(threading.Thread):
+    '''Samples the app's thread count and RSS from /proc (Linux only).'''
+    def __init__(self, pid: int, interval: float = 0.5):
+        super().__init__(daemon=True)
+        self.pid = pid
+        self.interval = interval
+        self.samples: list[tuple[int, int]] = []
+        self._stop_event = threading.Event()
+
+    def read(self) -> tuple[int, int] | None:
+        try:
+            with open(f"/proc/{self.pid}/status") as f:
+                fields = dict(line.split(":", 1) for line in f if ":" in line)
+            return int(fields["Threads"]), int(fields["VmRSS"].split()[0]) * 1024
+        except (OSError, KeyError, ValueError):
+            return None
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            sample = self.read()
+            if sample:
+                self.samples.append(sample)
+
+    def stop(self) -> dict:
+        self._stop_event.set()
+        if not self.samples:
+            return {}
+        return {
+            "threads_start": self.samples[0][0],
+            "threads_peak": max(threads for threads, _ in self.samples),
+            "rss_start_mb": round(self.samples[0][1] / 2 ** 20, 1),
+            "rss_peak_mb": round(max(rss for _, rss in self.samples) / 2 ** 20, 1),
+        }
+
+
+def _seed_prompt_cache():
+    # the agent's hub prompt, cached locally so the app never reaches the LangChain hub
+    from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+    from app.domain.agents import agent_stack
+
+    prompt = ChatPromptTemplate.from_messages(
+        [("system", "You are a helpful hotel concierge."), MessagesPlaceholder("messages")]
+    )
+    agent_stack._write_cached_prompt(
+        agent_stack._prompt_cache_path(agent_stack.REACT_PROMPT_REF), agent_stack.REACT_PROMPT_REF, prompt
+    )
+
+
+def _write_guests(path: str, count: int) -> list[str]:
+    phones = [f"1555{n:07d}" for n in range(count)]
+    with open(path, "w") as f:
+        f.write("id,phone,first_name,last_name,role,room_number\n")
+        for n, phone in enumerate(phones):
+            f.write(f"{n + 1},{phone},Guest{n},Load,default,{100 + n % 900}\n")
+    return phones
+
+
+def _load_recorded(directory: str) -> list[dict]:
+    payloads = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".json"):
+            with open(os.path.join(directory, name)) as f:
+                payloads.append(json.load(f))
+    return payloads
+
+
+async def _drive(url: str, factory: PayloadFactory, rps: float, duration: float):
+    """Open-loop load: request n is sent at start + n / rps whether or not earlier ones finished."""
+    sent_at: dict[int, float] = {}
+    webhook: list[tuple[int, float]] = []
+    errors = 0
+    total = int(rps * duration)
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=200)
+
+    async with httpx.AsyncClient(limits=limits, timeout=60) as client:
+        async def send(n: int):
+            nonlocal errors
+            payload, expects_reply = factory.build(n)
+            body = json.dumps(payload)
+            started = time.monotonic()
+            if expects_reply:
+                sent_at[n] = started
+            try:
+                response = await client.post(url, content=body, headers={"Content-Type": "application/json"})
+                webhook.append((response.status_code, time.monotonic() - started))
+            except httpx.HTTPError:
+                errors += 1
+
+        start = time.monotonic()
+        tasks = []
+        for n in range(total):
+            delay = start + n / rps - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(send(n)))
+        await asyncio.gather(*tasks)
+    return sent_at, webhook, errors, start
+
+
+def _match_replies(graph: FakeGraphAPI, sent_at: dict[int, float]) -> tuple[dict[int, float], int]:
+    """First reply time per request marker, and the number of replies that carried no marker."""
+    answered: dict[int, float] = {}
+    unmatched = 0
+    for reply in list(graph.sent):
+        body = reply["body"].get("text", {}).get("body", "")
+        numbers = [int(n) for n in MARKER.findall(body)]
+        if not numbers:
+            unmatched += 1
+        for n in numbers:
+            if n in sent_at and n not in answered:
+                answered[n] = reply["received_at"]
+    return answered, unmatched
+
+
+def _print_comparison(current: dict, previous: dict):
+    rows = [
+        ("replies/s", ("throughput", "replies_per_second")),
+        ("reply p50 s", ("reply_latency", "p50")),
+        ("reply p95 s", ("reply_latency", "p95")),
+        ("reply p99 s", ("reply_latency", "p99")),
+        ("webhook p99 s", ("webhook_latency", "p99")),
+        ("answered %", ("throughput", "answered_percent")),
+        ("threads peak", ("process", "threads_peak")),
+        ("rss peak MB", ("process", "rss_peak_mb")),
+    ]
+    print(f"\n{'':<16} {previous.get('label') or 'previous':>14} {current.get('label') or 'current':>14}")
+    for name, (section, key) in rows:
+        before = previous.get(section, {}).get(key)
+        after = current.get(section, {}).get(key)
+        fmt = lambda value: "-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value)
+        print(f"{name:<16} {fmt(before):>14} {fmt(after):>14}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rps", type=float, default=10, help="webhook POSTs per second")
+    parser.add_argument("--duration", type=float, default=30, help="seconds of load")
+    parser.add_argument("--drain", type=float, default=60, help="seconds to wait for outstanding replies")
+    parser.add_argument("--guests", type=int, default=200, help="synthetic guests in the directory")
+    parser.add_argument("--mix", default="search=0.5,task=0.4,audio=0.1", help="synthetic message mix")
+    parser.add_argument("--payloads", help="directory of recorded webhook payloads to replay instead")
+    parser.add_argument("--llm-latency", default="lognormal:0.8:0.4", help="chat completion latency spec")
+    parser.add_argument("--whisper-latency", default="lognormal:1.0:0.3")
+    parser.add_argument("--tavily-latency", default="lognormal:0.6:0.3")
+    parser.add_argument("--graph-latency", default="0.1+0.1")
+    parser.add_argument("--portal-latency", default="0.05+0.05")
+    parser.add_argument("--tool-rate", type=float, default=0.5, help="share of agent runs that call web_search")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra app environment")
+    parser.add_argument("--label", default="", help="name for this run in the results file")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    mix = {kind: float(weight) for kind, weight in (part.split("=") for part in args.mix.split(","))}
+    workdir = tempfile.mkdtemp(prefix="frontdesk-loadtest-")
+
+    llm = FakeOpenAI(tool_rate=args.tool_rate, transcripts=VOICE_NOTES, **parse_latency(args.llm_latency)).start()
+    # Whisper shares the OpenAI base URL in the app, so it gets its own fake to keep its latency separate
+    whisper = FakeOpenAI(transcripts=VOICE_NOTES, **parse_latency(args.whisper_latency)).start()
+    tavily = FakeTavily(**parse_latency(args.tavily_latency)).start()
+    graph = FakeGraphAPI(**parse_latency(args.graph_latency)).start()
+    portal = FakeAdminPortal(**parse_latency(args.portal_latency)).start()
+
+    env = dict(
+        os.environ,
+        DATA_DIR=workdir,
+        PROMPT_CACHE_DIR=os.path.join(workdir, "prompts"),
+        GUEST_DIRECTORY_PATH=os.path.join(workdir, "guests.csv"),
+        LLM_MODEL="fake",
+        OLLAMA_BASE_URL=f"{llm.url}/v1",
+        OPENAI_BASE_URL=f"{whisper.url}/v1",
+        OPENAI_API_KEY="fake",
+        WHATSAPP_API_KEY="fake",
+        GRAPH_API_URL=f"{graph.url}/v21.0",
+        TAVILY_API_URL=tavily.url,
+        TAVILY_API_KEY="fake",
+        ADMIN_PORTAL_URL=portal.url,
+        # both need an embedding model download; turn them on with --env when one is available
+        HOTEL_KB_ENABLED="0",
+        ANSWER_CACHE_ENABLED="0",
+    )
+    env.update(item.split("=", 1) for item in args.env)
+    os.environ["PROMPT_CACHE_DIR"] = env["PROMPT_CACHE_DIR"]
+    _seed_prompt_cache()
+    guests = _write_guests(env["GUEST_DIRECTORY_PATH"], args.guests)
+    recorded = _load_recorded(args.payloads) if args.payloads else []
+    factory = PayloadFactory(guests, mix, recorded, args.seed)
+
+    port = _free_port()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 60
+        while True:
+            try:
+                if httpx.get(f"{base_url}/readiness", timeout=1).status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline or server.poll() is not None:
+                raise RuntimeError("app did not become ready")
+            time.sleep(0.1)
+
+        sampler = ProcessSampler(server.pid)
+        sampler.start()
+        print(f"Driving {base_url} at {args.rps:g} req/s for {args.duration:g}s ...")
+        sent_at, webhook, errors, started = asyncio.run(_drive(f"{base_url}/", factory, args.rps, args.duration))
+
+        drain_deadline = time.monotonic() + args.drain
+        while time.monotonic() < drain_deadline:
+            answered, unmatched = _match_replies(graph, sent_at)
+            if len(answered) >= len(sent_at):
+                break
+            time.sleep(0.25)
+        answered, unmatched = _match_replies(graph, sent_at)
+        process = sampler.stop()
+        app_stats = httpx.get(f"{base_url}/stats", timeout=5).json()
+    finally:
+        server.terminate()
+        server.wait()
+        for fake in (llm, whisper, tavily, graph, portal):
+            fake.stop()
+
+    reply_latencies = [answered[n] - sent_at[n] for n in answered]
+    statuses: dict[str, int] = {}
+    for status, _ in webhook:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    elapsed = (max(answered.values()) - started) if answered else 0.0
+    results = {
+        "label": args.label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config": {key: value for key, value in vars(args).items() if key != "compare"},
+        "throughput": {
+            "requests": len(webhook) + errors,
+            "expecting_reply": len(sent_at),
+            "answered": len(answered),
+            "answered_percent": round(100 * len(answered) / len(sent_at), 1) if sent_at else None,
+            "unmatched_replies": unmatched,
+            "replies_per_second": round(len(answered) / elapsed, 2) if elapsed else None,
+        },
+        "webhook_status": statuses,
+        "webhook_errors": errors,
+        "webhook_latency": _latency_summary([latency for _, latency in webhook]),
+        "reply_latency": _latency_summary(reply_latencies),
+        "process": process,
+        "upstream_requests": {
+            "llm": llm.requests, "whisper": whisper.requests, "tavily": tavily.requests,
+            "graph": graph.requests, "portal": portal.requests,
+        },
+        "app_stats": app_stats,
+    }
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    name = f"loadtest-{time.strftime('%Y%m%d-%H%M%S')}{'-' + args.label if args.label else ''}.json"
+    path = os.path.join(RESULTS_DIR, name)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2)
+
+    throughput, reply = results["throughput"], results["reply_latency"]
+    fmt = lambda value: "-" if value is None else f"{value:.3f}"
+    print(f"requests {throughput['requests']}, answered {throughput['answered']}/{throughput['expecting_reply']} "
+          f"({throughput['answered_percent']}%), {throughput['replies_per_second']} replies/s, webhook status {statuses}")
+    print(f"reply latency s   p50 {fmt(reply['p50'])}  p95 {fmt(reply['p95'])}  p99 {fmt(reply['p99'])}  max {fmt(reply['max'])}")
+    webhook_latency = results["webhook_latency"]
+    print(f"webhook latency s p50 {fmt(webhook_latency['p50'])}  p95 {fmt(webhook_latency['p95'])}  p99 {fmt(webhook_latency['p99'])}")
+    if process:
+        print(f"app threads {process['threads_start']} -> peak {process['threads_peak']}, "
+              f"rss {process['rss_start_mb']} -> peak {process['rss_peak_mb']} MB")
+    print(f"upstream requests {results['upstream_requests']}")
+    print(f"saved {os.path.relpath(path)}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            _print_comparison(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
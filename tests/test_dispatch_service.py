@@ -0,0 +1,144 @@
+import threading
+import time
+import unittest
+
+from app.domain.dispatch_service import DispatchQueueFull, MessageDispatcher
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class MessageDispatcherTest(unittest.TestCase):
+    def test_jobs_of_one_key_run_in_order(self):
+        dispatcher = MessageDispatcher(num_workers=4, queue_size=500)
+        dispatcher.start()
+        self.addCleanup(dispatcher.shutdown)
+        seen = {}
+        lock = threading.Lock()
+
+        def record(key, n):
+            time.sleep(0.0005)
+            with lock:
+                seen.setdefault(key, []).append(n)
+
+        keys = [f"+1555000{i:04d}" for i in range(8)]
+        for n in range(50):
+            for key in keys:
+                dispatcher.submit(key, record, key, n)
+        dispatcher.shutdown()
+
+        self.assertEqual(set(seen), set(keys))
+        for key in keys:
+            self.assertEqual(seen[key], list(range(50)))
+
+    def test_full_shard_rejects(self):
+        dispatcher = MessageDispatcher(num_workers=1, queue_size=2)
+        dispatcher.start()
+        self.addCleanup(dispatcher.shutdown)
+        running, release = threading.Event(), threading.Event()
+
+        def block():
+            running.set()
+            release.wait(5)
+
+        dispatcher.submit("guest", block)
+        running.wait(5)
+        dispatcher.submit("guest", time.sleep, 0)
+        dispatcher.submit("guest", time.sleep, 0)
+        with self.assertRaises(DispatchQueueFull):
+            dispatcher.submit("guest", time.sleep, 0)
+        release.set()
+        dispatcher.shutdown()
+
+        stats = dispatcher.stats()
+        self.assertEqual(stats["rejected"], 1)
+        self.assertEqual(stats["completed"], 3)
+
+    def test_shutdown_drains_queued_jobs(self):
+        dispatcher = MessageDispatcher(num_workers=2, queue_size=100)
+        dispatcher.start()
+        self.addCleanup(dispatcher.shutdown)
+        done = []
+        for n in range(40):
+            dispatcher.submit(f"guest-{n % 5}", lambda n=n: (time.sleep(0.001), done.append(n)))
+        dispatcher.shutdown()
+
+        self.assertEqual(sorted(done), list(range(40)))
+        with self.assertRaises(DispatchQueueFull):
+            dispatcher.submit("guest-0", time.sleep, 0)
+
+    def test_failed_job_does_not_stop_the_worker(self):
+        dispatcher = MessageDispatcher(num_workers=1, queue_size=10)
+        dispatcher.start()
+        self.addCleanup(dispatcher.shutdown)
+        done = []
+        dispatcher.submit("guest", lambda: 1 / 0)
+        dispatcher.submit("guest", done.append, "after")
+        dispatcher.shutdown()
+
+        self.assertEqual(done, ["after"])
+        self.assertEqual(dispatcher.stats()["failed"], 1)
+
+
+class MergeHoldTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = []
+        # one bound method, so the hold sees the same job function for every message
+        self.answer = self.calls.append
+
+    def test_held_messages_of_one_guest_are_merged(self):
+        dispatcher = MessageDispatcher(num_workers=2, queue_size=10, hold=0.2, max_hold=2.0)
+        dispatcher.start()
+        self.addCleanup(dispatcher.shutdown)
+        dispatcher.submit("guest", self.answer, ["first"], merge=True)
+        dispatcher.submit("guest", self.answer, ["second"], merge=True)
+        dispatcher.submit("other", self.answer, ["third"], merge=True)
+        wait_until(lambda: len(self.calls) == 2)
+        dispatcher.shutdown()
+
+        self.assertCountEqual(self.calls, [["first", "second"], ["third"]])
+        self.assertEqual(dispatcher.stats()["merged"], 1)
+
+    def test_unmerged_jobs_skip_the_hold(self):
+        dispatcher = MessageDispatcher(num_workers=1, queue_size=10, hold=5.0, max_hold=10.0)
+        dispatcher.start()
+        self.addCleanup(dispatcher.shutdown)
+        ran = threading.Event()
+        dispatcher.submit("guest", ran.set)
+
+        self.assertTrue(ran.wait(2))
+        dispatcher.shutdown()
+
+    def test_held_jobs_count_against_the_shard(self):
+        dispatcher = MessageDispatcher(num_workers=1, queue_size=2, hold=5.0, max_hold=10.0)
+        dispatcher.start()
+        self.addCleanup(dispatcher.shutdown)
+        dispatcher.submit("a", self.answer, ["a"], merge=True)
+        dispatcher.submit("b", self.answer, ["b"], merge=True)
+        with self.assertRaises(DispatchQueueFull):
+            dispatcher.submit("c", self.answer, ["c"], merge=True)
+        # a message for a guest already held merges into it and takes no room
+        dispatcher.submit("a", self.answer, ["a2"], merge=True)
+        dispatcher.shutdown()
+
+        self.assertCountEqual(self.calls, [["a", "a2"], ["b"]])
+
+    def test_shutdown_runs_held_jobs(self):
+        dispatcher = MessageDispatcher(num_workers=2, queue_size=10, hold=30.0, max_hold=60.0)
+        dispatcher.start()
+        self.addCleanup(dispatcher.shutdown)
+        dispatcher.submit("guest", self.answer, ["late"], merge=True)
+        started = time.monotonic()
+        dispatcher.shutdown()
+
+        self.assertEqual(self.calls, [["late"]])
+        self.assertLess(time.monotonic() - started, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
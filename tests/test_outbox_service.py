@@ -0,0 +1,177 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.domain import outbox_service
+from app.domain.outbox_service import MAX_TEXT_LENGTH, Outbox, SendResult, TokenBucket, backoff_delay
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+def text(body):
+    return {"messaging_product": "whatsapp", "type": "text", "text": {"body": body}}
+
+
+def template(name):
+    return {"messaging_product": "whatsapp", "type": "template", "template": {"name": name}}
+
+
+class RecordingSender:
+    '''Stands in for the Graph API: records every payload and answers with the queued
+    statuses first, then 200.'''
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def __call__(self, phone_number_id, payload):
+        with self._lock:
+            self.sent.append(payload)
+            status = self.statuses.pop(0) if self.statuses else 200
+        return SendResult(status, error=None if status == 200 else f"HTTP {status}")
+
+    def bodies(self):
+        with self._lock:
+            return [p["text"]["body"] if p["type"] == "text" else p["template"]["name"] for p in self.sent]
+
+
+class OutboxTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "outbox.sqlite3")
+        # retries come due at once instead of after seconds of backoff
+        patcher = mock.patch.object(outbox_service, "backoff_delay", return_value=0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def outbox(self, sender, **kwargs):
+        outbox = Outbox(sender, path=self.path, **kwargs)
+        self.addCleanup(outbox.shutdown)
+        return outbox
+
+    def test_pending_texts_to_one_guest_are_coalesced(self):
+        sender = RecordingSender()
+        outbox = self.outbox(sender)
+        outbox.enqueue("pn", "+15550001", text("a"))
+        outbox.enqueue("pn", "+15550001", text("b"))
+        outbox.enqueue("pn", "+15550001", template("checkout"))
+        outbox.enqueue("pn", "+15550001", text("c"))
+        outbox.start()
+        wait_until(lambda: outbox.depth() == 0 and outbox.stats()["in_flight"] == 0)
+
+        self.assertEqual(sender.bodies(), ["a\n\nb", "checkout", "c"])
+        stats = outbox.stats()
+        self.assertEqual(stats["sent"], 3)
+        self.assertEqual(stats["coalesced"], 1)
+
+    def test_coalescing_stops_at_the_text_limit(self):
+        sender = RecordingSender()
+        outbox = self.outbox(sender)
+        long_body = "x" * (MAX_TEXT_LENGTH - 10)
+        outbox.enqueue("pn", "+15550001", text(long_body))
+        outbox.enqueue("pn", "+15550001", text("this one does not fit"))
+        outbox.start()
+        wait_until(lambda: outbox.depth() == 0 and outbox.stats()["in_flight"] == 0)
+
+        self.assertEqual(sender.bodies(), [long_body, "this one does not fit"])
+
+    def test_order_is_kept_through_a_retry(self):
+        sender = RecordingSender(500)
+        outbox = self.outbox(sender)
+        for name in ("first", "second", "third"):
+            outbox.enqueue("pn", "+15550001", template(name))
+        outbox.start()
+        wait_until(lambda: outbox.depth() == 0 and outbox.stats()["in_flight"] == 0)
+
+        self.assertEqual(sender.bodies(), ["first", "first", "second", "third"])
+        self.assertEqual(outbox.stats()["retries"], 1)
+
+    def test_a_message_enqueued_during_backoff_waits_for_the_earlier_one(self):
+        sender = RecordingSender(503)
+        outbox = self.outbox(sender)
+        with mock.patch.object(outbox_service, "backoff_delay", return_value=0.3):
+            outbox.enqueue("pn", "+15550001", template("first"))
+            outbox.start()
+            wait_until(lambda: outbox.stats()["retries"] == 1)
+            outbox.enqueue("pn", "+15550001", template("second"))
+            wait_until(lambda: outbox.depth() == 0 and outbox.stats()["in_flight"] == 0)
+
+        self.assertEqual(sender.bodies(), ["first", "first", "second"])
+
+    def test_client_errors_are_not_retried(self):
+        sender = RecordingSender(400)
+        outbox = self.outbox(sender)
+        outbox.enqueue("pn", "+15550001", template("rejected"))
+        outbox.enqueue("pn", "+15550002", template("other guest"))
+        outbox.start()
+        wait_until(lambda: outbox.depth() == 0 and outbox.stats()["in_flight"] == 0)
+
+        stats = outbox.stats()
+        self.assertEqual(stats["failed"], 1)
+        self.assertEqual(stats["retries"], 0)
+        self.assertEqual(len(sender.sent), 2)
+
+    def test_gives_up_after_max_attempts(self):
+        sender = RecordingSender(500, 500, 500)
+        outbox = self.outbox(sender, max_attempts=3)
+        outbox.enqueue("pn", "+15550001", text("never delivered"))
+        outbox.start()
+        wait_until(lambda: outbox.stats()["failed"] == 1)
+
+        self.assertEqual(len(sender.sent), 3)
+        self.assertEqual(outbox.depth(), 0)
+
+    def test_pending_messages_survive_a_restart(self):
+        first = Outbox(RecordingSender(), path=self.path)
+        first.enqueue("pn", "+15550001", text("queued before the restart"))
+        first.shutdown()
+
+        sender = RecordingSender()
+        outbox = self.outbox(sender)
+        outbox.start()
+        wait_until(lambda: outbox.depth() == 0 and outbox.stats()["in_flight"] == 0)
+
+        self.assertEqual(sender.bodies(), ["queued before the restart"])
+
+    def test_only_one_outbox_on_a_file_sends(self):
+        sender = RecordingSender()
+        first, second = self.outbox(sender), self.outbox(sender)
+        first.start()
+        wait_until(lambda: first.stats()["sending"])
+        second.start()
+        for n in range(10):
+            second.enqueue("pn", f"+1555000{n}", template(str(n)))
+        wait_until(lambda: first.depth() == 0 and first.stats()["in_flight"] == 0, timeout=10)
+
+        self.assertEqual(sorted(sender.bodies(), key=int), [str(n) for n in range(10)])
+        self.assertFalse(second.stats()["sending"])
+
+
+class BackoffTest(unittest.TestCase):
+    def test_backoff_delay_grows_and_is_capped(self):
+        for attempts in range(1, 12):
+            ceiling = min(300, 2 ** (attempts - 1))
+            for _ in range(50):
+                self.assertTrue(0 <= backoff_delay(attempts, 1, 300) <= ceiling)
+        self.assertTrue(any(backoff_delay(10, 1, 300) > 2 for _ in range(50)))
+
+    def test_token_bucket_allows_a_burst_then_paces(self):
+        bucket = TokenBucket(rate=10, capacity=3)
+        self.assertEqual([bucket.take() for _ in range(3)], [0.0, 0.0, 0.0])
+        wait = bucket.take()
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 0.1)
+
+
+if __name__ == "__main__":
+    unittest.main()
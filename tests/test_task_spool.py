@@ -0,0 +1,192 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+from app.utils import request_utils
+from app.utils.request_utils import TaskDispatcher
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not met in time")
+        time.sleep(0.01)
+
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self._body = body
+        self.text = "" if body is None else str(body)
+
+    def json(self):
+        if self._body is None:
+            raise ValueError("no JSON body")
+        return self._body
+
+
+class FakePortal:
+    '''Stands in for the pooled client to the admin portal. Answers with the queued
+    responses first; after that a single task gets {"id": n} and a batch gets one per task.'''
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.posts = []
+        self._lock = threading.Lock()
+
+    def post(self, url, json):
+        with self._lock:
+            self.posts.append((url, json))
+            if self.responses:
+                return self.responses.pop(0)
+            if isinstance(json, list):
+                return FakeResponse(200, [{"id": f"P-{task['reference']}"} for task in json])
+            return FakeResponse(201, {"id": f"P-{json['reference']}"})
+
+    def tasks(self):
+        """Every task posted, one entry per task whether it went alone or in a batch."""
+        with self._lock:
+            return [task for _, body in self.posts for task in (body if isinstance(body, list) else [body])]
+
+
+class TaskSpoolTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "task_spool.sqlite3")
+        patcher = mock.patch.object(request_utils, "backoff_delay", return_value=0.0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def dispatcher(self, portal, **kwargs):
+        patcher = mock.patch.object(request_utils, "get_client", return_value=portal)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        dispatcher = TaskDispatcher(path=self.path, endpoint="http://portal/api/tasks", batch_window=0.0, **kwargs)
+        self.addCleanup(dispatcher.shutdown)
+        return dispatcher
+
+    def test_submit_returns_a_tracking_id_before_the_portal_answers(self):
+        portal = FakePortal()
+        dispatcher = self.dispatcher(portal)
+        local_id = dispatcher.submit({"title": "Extra towels", "room": "204"})
+
+        self.assertEqual(dispatcher.lookup(local_id)["status"], "pending")
+        self.assertEqual(portal.posts, [])
+
+        dispatcher.start()
+        wait_until(lambda: dispatcher.lookup(local_id)["status"] == "sent")
+        task = dispatcher.lookup(local_id)
+        self.assertEqual(task["portal_id"], f"P-{local_id}")
+        self.assertEqual(task["attempts"], 1)
+        self.assertEqual(portal.tasks()[0], {"title": "Extra towels", "room": "204", "reference": local_id})
+
+    def test_portal_outage_is_retried_until_the_task_goes_through(self):
+        portal = FakePortal(FakeResponse(503, "down"), FakeResponse(502, "down"))
+        dispatcher = self.dispatcher(portal)
+        local_id = dispatcher.submit({"title": "Late checkout"})
+        dispatcher.start()
+        wait_until(lambda: dispatcher.lookup(local_id)["status"] == "sent")
+
+        task = dispatcher.lookup(local_id)
+        self.assertEqual(task["attempts"], 3)
+        self.assertEqual(task["portal_id"], f"P-{local_id}")
+        self.assertEqual(dispatcher.stats()["retries"], 2)
+        # every attempt carries the same reference, so the portal can drop a repeat
+        self.assertEqual({task["reference"] for task in portal.tasks()}, {local_id})
+
+    def test_transport_errors_are_retried(self):
+        portal = FakePortal()
+        calls = []
+
+        def flaky_post(url, json):
+            calls.append(json)
+            if len(calls) == 1:
+                raise ConnectionError("connection refused")
+            return FakePortal.post(portal, url, json)
+
+        portal.post = flaky_post
+        dispatcher = self.dispatcher(portal)
+        local_id = dispatcher.submit({"title": "Taxi at 7"})
+        dispatcher.start()
+        wait_until(lambda: dispatcher.lookup(local_id)["status"] == "sent")
+
+        self.assertEqual(dispatcher.lookup(local_id)["attempts"], 2)
+
+    def test_a_rejected_task_is_not_retried(self):
+        portal = FakePortal(FakeResponse(400, "missing room"))
+        dispatcher = self.dispatcher(portal)
+        local_id = dispatcher.submit({"title": "?"})
+        dispatcher.start()
+        wait_until(lambda: dispatcher.lookup(local_id)["status"] == "failed")
+
+        self.assertEqual(len(portal.posts), 1)
+        self.assertEqual(dispatcher.stats()["failed"], 1)
+
+    def test_a_success_without_an_id_is_not_sent_again(self):
+        portal = FakePortal(FakeResponse(204))
+        dispatcher = self.dispatcher(portal)
+        local_id = dispatcher.submit({"title": "Wake-up call"})
+        dispatcher.start()
+        wait_until(lambda: dispatcher.lookup(local_id)["status"] == "sent")
+
+        self.assertIsNone(dispatcher.lookup(local_id)["portal_id"])
+        self.assertEqual(len(portal.posts), 1)
+
+    def test_gives_up_after_max_attempts(self):
+        portal = FakePortal(*[FakeResponse(500, "error")] * 3)
+        dispatcher = self.dispatcher(portal, max_attempts=3)
+        local_id = dispatcher.submit({"title": "Iron"})
+        dispatcher.start()
+        wait_until(lambda: dispatcher.lookup(local_id)["status"] == "failed")
+
+        self.assertEqual(dispatcher.lookup(local_id)["attempts"], 3)
+
+    def test_pending_tasks_survive_a_restart(self):
+        first = TaskDispatcher(path=self.path)
+        local_id = first.submit({"title": "Spooled before the restart"})
+        first.shutdown()
+
+        portal = FakePortal()
+        dispatcher = self.dispatcher(portal)
+        dispatcher.start()
+        wait_until(lambda: dispatcher.lookup(local_id)["status"] == "sent")
+
+        self.assertEqual(dispatcher.lookup(local_id)["portal_id"], f"P-{local_id}")
+
+
+class BatchEndpointTest(TaskSpoolTest):
+    '''The same behaviour through TASK_BATCH_ENDPOINT, plus the batch-only cases.'''
+    def dispatcher(self, portal, **kwargs):
+        kwargs.setdefault("batch_endpoint", "http://portal/api/tasks/batch")
+        return super().dispatcher(portal, **kwargs)
+
+    def test_portal_ids_are_recorded_per_task(self):
+        portal = FakePortal()
+        dispatcher = self.dispatcher(portal)
+        local_ids = [dispatcher.submit({"title": f"task {n}"}) for n in range(5)]
+        dispatcher.start()
+        wait_until(lambda: dispatcher.depth() == 0)
+
+        self.assertEqual(len(portal.posts), 1)
+        for local_id in local_ids:
+            self.assertEqual(dispatcher.lookup(local_id)["portal_id"], f"P-{local_id}")
+
+    def test_a_short_batch_answer_resends_the_batch(self):
+        portal = FakePortal(FakeResponse(200, [{"id": "P-1"}]))
+        dispatcher = self.dispatcher(portal)
+        local_ids = [dispatcher.submit({"title": f"task {n}"}) for n in range(3)]
+        dispatcher.start()
+        wait_until(lambda: dispatcher.depth() == 0)
+
+        self.assertEqual(len(portal.posts), 2)
+        for local_id in local_ids:
+            task = dispatcher.lookup(local_id)
+            self.assertEqual((task["status"], task["attempts"], task["portal_id"]), ("sent", 2, f"P-{local_id}"))
+
+
+if __name__ == "__main__":
+    unittest.main()